@@ -1,31 +1,103 @@
 from django.contrib import admin
-from chatbot.models import ChatSession, ChatMessage
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
+from chatbot.models import ChatSession, ChatMessage, ChatDailyStats
+from knowledge.fulltext import FullTextSearchMixin
+from knowledge.models import RUGIPOKnowledge
+
+# Unfiltered changelists of tables at least this big show an estimated count
+ESTIMATED_COUNT_THRESHOLD = 100000
+
+def estimated_count(model, using='default'):
+    """
+    Row count from the planner statistics (PostgreSQL) or ANALYZE results
+    (SQLite), or None if the table has never been analyzed
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [table])
+            row = cursor.fetchone()
+            return row[0] if row and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            if 'sqlite_stat1' not in connection.introspection.table_names(cursor):
+                return None
+            cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+    return None
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Skips COUNT(*) over a whole big table; filtered lists are counted exactly
+    """
+    
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
 
 class ChatMessageInline(admin.TabularInline):
     model = ChatMessage
     extra = 0
-    readonly_fields = ['message_type', 'content', 'created_at']
+    readonly_fields = [
+        'message_type', 'content', 'route', 'route_score', 'category', 'tokens', 'latency_ms', 'created_at'
+    ]
+    ordering = ['created_at']
     can_delete = False
 
 @admin.register(ChatSession)
 class ChatSessionAdmin(admin.ModelAdmin):
     list_display = ['session_id', 'created_at', 'last_activity', 'message_count']
-    readonly_fields = ['session_id', 'created_at', 'last_activity']
+    readonly_fields = ['session_id', 'created_at', 'last_activity', 'summary', 'summary_until']
     inlines = [ChatMessageInline]
     list_filter = ['created_at', 'last_activity']
     date_hierarchy = 'created_at'
+    ordering = ['-last_activity']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    def get_queryset(self, request):
+        # A correlated subquery is only evaluated for the rows on the page
+        # (a JOIN + GROUP BY would aggregate every message first)
+        message_count = (
+            ChatMessage.objects.filter(session=OuterRef('pk'))
+            .order_by()
+            .values('session')
+            .annotate(count=Count('*'))
+            .values('count')
+        )
+        return super().get_queryset(request).annotate(
+            message_count=Coalesce(Subquery(message_count), 0)
+        )
     
     def message_count(self, obj):
-        return obj.messages.count()
+        return obj.message_count
     message_count.short_description = 'Messages'
+    message_count.admin_order_field = 'message_count'
 
 @admin.register(ChatMessage)
-class ChatMessageAdmin(admin.ModelAdmin):
-    list_display = ['session_link', 'message_type', 'content_preview', 'created_at']
-    list_filter = ['message_type', 'created_at']
-    readonly_fields = ['session', 'message_type', 'content', 'created_at']
+class ChatMessageAdmin(FullTextSearchMixin, admin.ModelAdmin):
+    list_display = ['session_link', 'message_type', 'content_preview', 'route', 'route_score', 'created_at']
+    list_filter = ['message_type', 'route', 'created_at']
+    readonly_fields = [
+        'session', 'message_type', 'content', 'route', 'route_score', 'category', 'tokens', 'latency_ms',
+        'created_at',
+    ]
     search_fields = ['content']
-    date_hierarchy = 'created_at'
+    list_select_related = ['session']
+    # Newest first by primary key, which needs no sort over the whole table
+    ordering = ['-id']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     def session_link(self, obj):
         return str(obj.session.session_id)[:8]
@@ -33,4 +105,39 @@ class ChatMessageAdmin(admin.ModelAdmin):
     
     def content_preview(self, obj):
         return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
-    content_preview.short_description = 'Content'
\ No newline at end of file
+    content_preview.short_description = 'Content'
+
+@admin.register(ChatDailyStats)
+class ChatDailyStatsAdmin(admin.ModelAdmin):
+    """
+    Read-only view of the daily rollups (chatbot.services.analytics)
+    """
+    list_display = [
+        'date', 'sessions', 'questions', 'messages', 'fallbacks', 'fallback_rate',
+        'avg_latency', 'tokens', 'top_categories'
+    ]
+    date_hierarchy = 'date'
+    ordering = ['-date']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+    
+    def fallback_rate(self, obj):
+        answers = obj.messages - obj.questions
+        return f"{obj.fallbacks / answers:.1%}" if answers else '-'
+    fallback_rate.short_description = 'Fallback rate'
+    
+    def avg_latency(self, obj):
+        return f"{obj.avg_latency_ms:,} ms" if obj.avg_latency_ms is not None else '-'
+    avg_latency.short_description = 'Avg latency'
+    
+    def top_categories(self, obj):
+        names = dict(RUGIPOKnowledge.CATEGORY_CHOICES)
+        return ', '.join(f"{names.get(category, category)} ({count})" for category, count in obj.top_categories())
+    top_categories.short_description = 'Top categories'
\ No newline at end of file
@@ -0,0 +1,134 @@
+import gzip
+import json
+import os
+import time
+from datetime import timedelta
+from itertools import groupby
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from chatbot.models import ChatSession, ChatMessage
+
+SESSION_FIELDS = ('id', 'session_id', 'created_at', 'last_activity', 'summary', 'summary_until')
+MESSAGE_FIELDS = (
+    'session_id', 'message_type', 'content', 'route', 'route_score', 'category', 'tokens', 'latency_ms', 'created_at'
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Archive chat sessions inactive for longer than the retention period to a '
+        'gzipped JSONL file (one session with its messages per line) and delete them '
+        'in small batches'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int,
+            default=getattr(settings, 'CHATBOT_CHAT_RETENTION_DAYS', 90),
+            help='Archive sessions with no activity for this many days'
+        )
+        parser.add_argument(
+            '--output-dir',
+            default=getattr(settings, 'CHATBOT_CHAT_ARCHIVE_DIR', Path(settings.BASE_DIR) / 'archives')
+        )
+        parser.add_argument('--batch-size', type=int, default=500, help='Sessions per delete transaction')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Messages fetched per database round trip')
+        parser.add_argument('--sleep', type=float, default=0.0, help='Pause between batches (seconds)')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be archived')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        old_sessions = ChatSession.objects.filter(last_activity__lt=cutoff)
+        
+        if options['dry_run']:
+            self.stdout.write(
+                f"{old_sessions.count():,} sessions with "
+                f"{ChatMessage.objects.filter(session__in=old_sessions).count():,} messages "
+                f"inactive since {cutoff:%Y-%m-%d %H:%M}"
+            )
+            return
+        
+        os.makedirs(options['output_dir'], exist_ok=True)
+        path = os.path.join(
+            options['output_dir'],
+            f"chat-history-{cutoff:%Y%m%d}-{timezone.now():%Y%m%d%H%M%S}.jsonl.gz"
+        )
+        
+        sessions = messages = 0
+        last_pk = 0
+        started = time.perf_counter()
+        with gzip.open(path, 'wt', encoding='utf-8') as archive:
+            while True:
+                batch = self.archive_batch(archive, cutoff, last_pk, options['batch_size'], options['chunk_size'])
+                if batch is None:
+                    break
+                last_pk, batch_sessions, batch_messages = batch
+                sessions += batch_sessions
+                messages += batch_messages
+                self.stdout.write(f"  {sessions:,} sessions, {messages:,} messages")
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+        elapsed = time.perf_counter() - started
+        
+        if not sessions:
+            os.remove(path)
+            self.stdout.write(self.style.SUCCESS(f"✓ No sessions inactive since {cutoff:%Y-%m-%d %H:%M}"))
+            return
+        
+        rows = sessions + messages
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ Archived and deleted {sessions:,} sessions and {messages:,} messages to {path}"
+        ))
+        self.stdout.write(
+            f"  {elapsed:.1f}s, {rows / elapsed if elapsed else 0:,.0f} rows/sec, "
+            f"{os.path.getsize(path):,} bytes written"
+        )
+
+    def archive_batch(self, archive, cutoff, after_pk, batch_size, chunk_size):
+        """
+        Write the next batch of inactive sessions (by pk) and delete them in
+        one short transaction
+        Returns (last pk, sessions, messages), or None when none are left
+        """
+        with transaction.atomic():
+            # Re-checked under the lock so a session that came back to life
+            # since the last batch is kept
+            sessions = list(
+                ChatSession.objects.select_for_update()
+                .filter(pk__gt=after_pk, last_activity__lt=cutoff)
+                .order_by('pk')
+                .values(*SESSION_FIELDS)[:batch_size]
+            )
+            if not sessions:
+                return None
+        
+            pks = [session['id'] for session in sessions]
+            rows = (
+                ChatMessage.objects.filter(session_id__in=pks)
+                .order_by('session_id', 'created_at', 'id')
+                .values(*MESSAGE_FIELDS)
+                .iterator(chunk_size=chunk_size)
+            )
+            # Messages stream in session order, so one session is held at a time
+            by_pk = {session['id']: session for session in sessions}
+            messages = 0
+            for session_pk, session_messages in groupby(rows, key=lambda row: row.pop('session_id')):
+                session_messages = list(session_messages)
+                messages += len(session_messages)
+                self.write_session(archive, by_pk.pop(session_pk), session_messages)
+            for session in by_pk.values():
+                self.write_session(archive, session, [])
+            archive.flush()
+        
+            # Messages go with their sessions
+            ChatSession.objects.filter(pk__in=pks).delete()
+        return pks[-1], len(pks), messages
+
+    def write_session(self, archive, session, messages):
+        line = {key: value for key, value in session.items() if key != 'id'}
+        line['messages'] = messages
+        archive.write(json.dumps(line, cls=DjangoJSONEncoder) + '\n')
\ No newline at end of file
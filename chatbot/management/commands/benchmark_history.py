@@ -0,0 +1,167 @@
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from django.contrib import admin
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models
+from django.db.utils import ConnectionHandler
+from chatbot.models import ChatSession, ChatMessage
+from chatbot.views import history_page_query, recent_messages_query
+from chatbot.services.summaries import history_limit
+
+# Stands in for the looked-up session's id in the compiled queries
+SESSION_PK = -1
+
+BATCH_SIZE = 50000
+
+# Indexes before the (session, created_at) index migration (0005): Django's
+# default foreign key index; after it, the models' own indexes
+BEFORE_INDEXES = [
+    (ChatMessage, models.Index(fields=['session'], name='chatbot_chatmessage_session_id')),
+]
+AFTER_INDEXES = [(model, index) for model in (ChatSession, ChatMessage) for index in model._meta.indexes]
+
+
+def benchmark_queries():
+    """
+    The querysets the chat endpoints and admin run, built by the same code,
+    as {name: (queryset, per session)}
+    """
+    session = ChatSession(pk=SESSION_PK, summary_until=0)
+    session_admin = admin.site._registry[ChatSession]
+    return {
+        'history (send_message)': (recent_messages_query(session, history_limit()), True),
+        'history page (get_history)': (history_page_query(session, {})[0], True),
+        'recent sessions (admin)': (
+            session_admin.get_queryset(None)[:session_admin.list_per_page],
+            False,
+        ),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the chat history queries on a synthetic SQLite table with the '
+        'indexes before and after the (session, created_at) index migration'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000000)
+        parser.add_argument('--sessions', type=int, default=20000)
+        parser.add_argument('--lookups', type=int, default=2000, help='Queries timed per case')
+        parser.add_argument('--path', help='New SQLite file to use (default: a temporary file)')
+        parser.add_argument('--force', action='store_true', help='Overwrite the --path file if it exists')
+
+    def handle(self, *args, **options):
+        path = options['path'] or os.path.join(tempfile.mkdtemp(), 'benchmark_history.sqlite3')
+        if os.path.exists(path):
+            if not options['force']:
+                raise CommandError(f"{path} already exists; pass --force to overwrite it")
+            os.remove(path)
+        # A connection of its own, so the project's database is never touched
+        db = ConnectionHandler({
+            'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': path},
+        })['default']
+        db.ensure_connection()
+        
+        try:
+            self.stdout.write(f"Building {options['messages']:,} messages in {options['sessions']:,} sessions at {path}")
+            started = time.perf_counter()
+            self.populate(db, options['messages'], options['sessions'])
+            self.stdout.write(f"  built in {time.perf_counter() - started:.1f}s")
+        
+            queries = self.compile_queries(db)
+            session_ids = [random.randint(1, options['sessions']) for _ in range(options['lookups'])]
+            before = self.run_queries(db, queries, AFTER_INDEXES, BEFORE_INDEXES, session_ids)
+            after = self.run_queries(db, queries, BEFORE_INDEXES, AFTER_INDEXES, session_ids)
+        
+            for name in queries:
+                speedup = before[name]['ms'] / after[name]['ms'] if after[name]['ms'] else 0
+                self.stdout.write(self.style.SUCCESS(f"\n✓ {name}: {speedup:.1f}x faster"))
+                self.stdout.write(f"  before: {before[name]['ms']:.3f} ms/query  plan: {before[name]['plan']}")
+                self.stdout.write(f"  after:  {after[name]['ms']:.3f} ms/query  plan: {after[name]['plan']}")
+        finally:
+            db.close()
+            if not options['path']:
+                os.remove(path)
+                os.rmdir(os.path.dirname(path))
+
+    def populate(self, db, n_messages, n_sessions):
+        """
+        Sessions with interleaved traffic: messages arrive in time order but
+        each belongs to a random session, as in production
+        The tables come from the models, with all of their current indexes
+        """
+        with db.schema_editor() as editor:
+            editor.create_model(ChatSession)
+            editor.create_model(ChatMessage)
+        
+        db.set_autocommit(False)
+        cursor = db.create_cursor()
+        start = datetime(2025, 1, 1)
+        cursor.executemany(
+            'INSERT INTO chatbot_chatsession (session_id, created_at, last_activity, summary, summary_until) '
+            'VALUES (%s, %s, %s, \'\', 0)',
+            [
+                (f'{i:032x}', start.isoformat(' '), (start + timedelta(seconds=random.randint(0, 10 ** 7))).isoformat(' '))
+                for i in range(1, n_sessions + 1)
+            ]
+        )
+        
+        content = 'What are the admission requirements for ND Computer Engineering? ' * 3
+        for offset in range(0, n_messages, BATCH_SIZE):
+            cursor.executemany(
+                'INSERT INTO chatbot_chatmessage (session_id, message_type, content, created_at, route) '
+                'VALUES (%s, %s, %s, %s, \'\')',
+                [
+                    (
+                        random.randint(1, n_sessions),
+                        'user' if i % 2 == 0 else 'bot',
+                        content,
+                        (start + timedelta(seconds=i * 10)).isoformat(' '),
+                    )
+                    for i in range(offset, min(offset + BATCH_SIZE, n_messages))
+                ]
+            )
+        db.commit()
+        db.set_autocommit(True)
+
+    def compile_queries(self, db):
+        """
+        SQL of benchmark_queries() for the benchmark database, as
+        {name: (sql, params, positions of the session id in params)}
+        """
+        compiled = {}
+        for name, (queryset, per_session) in benchmark_queries().items():
+            sql, params = queryset.query.get_compiler(connection=db).as_sql()
+            session_params = [i for i, param in enumerate(params) if param == SESSION_PK] if per_session else []
+            compiled[name] = (sql, list(params), session_params)
+        return compiled
+
+    def run_queries(self, db, queries, drop, create, session_ids):
+        with db.schema_editor() as editor:
+            for model, index in drop:
+                editor.remove_index(model, index)
+            for model, index in create:
+                editor.add_index(model, index)
+        cursor = db.create_cursor()
+        cursor.execute('ANALYZE')
+        
+        results = {}
+        for name, (sql, params, session_params) in queries.items():
+            lookups = []
+            for session_id in session_ids:
+                lookup = list(params)
+                for i in session_params:
+                    lookup[i] = session_id
+                lookups.append(lookup)
+            plan = '; '.join(row[-1] for row in cursor.execute('EXPLAIN QUERY PLAN ' + sql, lookups[0]))
+        
+            started = time.perf_counter()
+            for lookup in lookups:
+                cursor.execute(sql, lookup).fetchall()
+            elapsed = time.perf_counter() - started
+            results[name] = {'ms': elapsed * 1000 / len(session_ids), 'plan': plan}
+        return results
\ No newline at end of file
@@ -0,0 +1,35 @@
+import time
+from django.core.management.base import BaseCommand
+from chatbot.services.tfidf_index import build_tfidf_index
+from knowledge.models import RUGIPOKnowledge
+
+
+class Command(BaseCommand):
+    help = 'Build the local TF-IDF similarity index (.npy files in settings.TFIDF_INDEX_DIR) from active Q&As'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output-dir',
+            help='Directory for the index files (defaults to settings.TFIDF_INDEX_DIR)',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            start = time.perf_counter()
+            entries = list(
+                RUGIPOKnowledge.objects.filter(is_active=True)
+                .order_by('id')
+                .values('id', 'question', 'answer', 'keywords')
+            )
+            n_docs, n_terms = build_tfidf_index(entries, options['output_dir'])
+            
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'✓ Built TF-IDF index: {n_docs} documents, {n_terms} terms '
+                    f'in {time.perf_counter() - start:.2f}s'
+                )
+            )
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'✗ Error building TF-IDF index: {str(e)}')
+            )
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from chatbot.services.analytics import BATCH_SIZE, get_watermark, update_daily_stats
+
+
+class Command(BaseCommand):
+    help = 'Add chat messages and sessions saved since the last run to the daily chat stats'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Ids folded in per transaction')
+
+    def handle(self, *args, **options):
+        try:
+            result = update_daily_stats(batch_size=options['batch_size'])
+            watermark = get_watermark()
+            self.stdout.write(self.style.SUCCESS(
+                f"✓ Added {result['messages']:,} messages and {result['sessions']:,} sessions to the daily stats"
+            ))
+            if watermark:
+                self.stdout.write(f"  {watermark}")
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'✗ Error updating chat stats: {str(e)}')
+            )
\ No newline at end of file
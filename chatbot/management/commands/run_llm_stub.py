@@ -0,0 +1,116 @@
+import json
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.core.management.base import BaseCommand
+from chatbot.services.llm_backends import StubBackend
+
+
+class Command(BaseCommand):
+    help = (
+        'Serve the deterministic stub LLM as an OpenAI-compatible API for load testing. '
+        'Point the app at it with CHATBOT_LLM_BACKEND=openai_compatible and '
+        'CHATBOT_LLM_BASE_URL=http://HOST:PORT/v1'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--latency', type=float, default=0.5, help='Seconds before the first token')
+        parser.add_argument('--tokens-per-second', type=float, default=50, help='Generation speed (0 = instant)')
+
+    def handle(self, *args, **options):
+        backend = StubBackend(options['latency'], options['tokens_per_second'])
+        handler = type('StubHandler', (StubHandler,), {'backend': backend})
+        server = ThreadingHTTPServer((options['host'], options['port']), handler)
+        
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ Stub LLM listening on http://{options['host']}:{options['port']}/v1 "
+            f"(latency {options['latency']}s, {options['tokens_per_second']} tokens/s)"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Minimal /v1/chat/completions endpoint (JSON and streamed SSE)
+    """
+    backend = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/v1/chat/completions':
+            self.send_error(404)
+            return
+        
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        messages = body.get('messages', [])
+        completion_id = f"chatcmpl-stub-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        
+        if body.get('stream'):
+            self._stream(messages, completion_id, created)
+            return
+        
+        result = self.backend.complete(messages)
+        self._send_json({
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': created,
+            'model': self.backend.model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': result['content']},
+                'finish_reason': 'stop',
+            }],
+            'usage': _api_usage(result['usage']),
+        })
+
+    def _stream(self, messages, completion_id, created):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        
+        for chunk in self.backend.stream(messages):
+            data = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': self.backend.model,
+                'choices': [],
+                'usage': _api_usage(chunk['usage']) if chunk['usage'] else None,
+            }
+            if chunk['delta']:
+                data['choices'] = [{'index': 0, 'delta': {'content': chunk['delta']}, 'finish_reason': None}]
+            self.wfile.write(f"data: {json.dumps(data)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _send_json(self, data):
+        payload = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def _api_usage(usage):
+    return {
+        'prompt_tokens': usage['prompt_tokens'],
+        'completion_tokens': usage['completion_tokens'],
+        'total_tokens': usage['total_tokens'],
+        'prompt_tokens_details': {'cached_tokens': usage['cached_tokens']},
+    }
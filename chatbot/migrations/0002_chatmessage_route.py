@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='route',
+            field=models.CharField(blank=True, choices=[('direct', 'Knowledge base'), ('cache', 'Answer cache'), ('llm', 'LLM'), ('fallback', 'Fallback')], max_length=10),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='route_score',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
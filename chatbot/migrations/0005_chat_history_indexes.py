@@ -0,0 +1,35 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0004_chatmessage_created_at_default'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='chatmessage',
+            options={},
+        ),
+        migrations.AlterModelOptions(
+            name='chatsession',
+            options={},
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['session', 'created_at'], name='chat_message_session_time_idx'),
+        ),
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='session',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='chatbot.chatsession'),
+        ),
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(fields=['-last_activity'], name='chat_session_activity_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:05
+
+from django.db import migrations
+
+from knowledge.fulltext import CreateFullTextIndex
+
+
+class Migration(migrations.Migration):
+
+    # The PostgreSQL index is built CONCURRENTLY, which can't run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('chatbot', '0005_chat_history_indexes'),
+    ]
+
+    operations = [
+        CreateFullTextIndex('chatmessage', ['content']),
+    ]
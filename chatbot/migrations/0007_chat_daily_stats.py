@@ -0,0 +1,58 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0006_chatmessage_fulltext'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('sessions', models.PositiveIntegerField(default=0, help_text='Sessions started')),
+                ('messages', models.PositiveIntegerField(default=0)),
+                ('questions', models.PositiveIntegerField(default=0, help_text='User messages')),
+                ('fallbacks', models.PositiveIntegerField(default=0, help_text='Answers from the fallback search')),
+                ('tokens', models.BigIntegerField(default=0)),
+                ('latency_total_ms', models.BigIntegerField(default=0)),
+                ('latency_count', models.PositiveIntegerField(default=0)),
+                ('categories', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Daily chat stats',
+                'verbose_name_plural': 'Daily chat stats',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ChatStatsWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_message_id', models.BigIntegerField(default=0)),
+                ('last_session_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='category',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='latency_ms',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='tokens',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 import uuid
 
 class ChatSession(models.Model):
@@ -8,9 +9,15 @@ class ChatSession(models.Model):
     session_id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
     last_activity = models.DateTimeField(auto_now=True)
+    # Rolling summary of the conversation up to message id summary_until
+    summary = models.TextField(blank=True)
+    summary_until = models.BigIntegerField(default=0)
     
     class Meta:
-        ordering = ['-last_activity']
+        indexes = [
+            # Most recently active sessions first (admin changelist)
+            models.Index(fields=['-last_activity'], name='chat_session_activity_idx'),
+        ]
     
     def __str__(self):
         return f"Session {self.session_id}"
@@ -24,13 +31,78 @@ class ChatMessage(models.Model):
         ('bot', 'Bot'),
     ]
     
-    session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='messages')
+    ROUTE_CHOICES = [
+        ('direct', 'Knowledge base'),
+        ('cache', 'Answer cache'),
+        ('llm', 'LLM'),
+        ('fallback', 'Fallback'),
+    ]
+    
+    # Indexed by the (session, created_at) index below
+    session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='messages', db_index=False)
     message_type = models.CharField(max_length=10, choices=MESSAGE_TYPE_CHOICES)
     content = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    # How a bot message was answered, and the best knowledge base match confidence
+    route = models.CharField(max_length=10, choices=ROUTE_CHOICES, blank=True)
+    route_score = models.FloatField(null=True, blank=True)
+    # Bot messages, for the daily stats: category of the best knowledge base
+    # match, LLM tokens used and milliseconds from question to saved answer
+    # (all nullable, so SQLite adds the columns without rebuilding the table,
+    # which would also drop its full-text triggers)
+    category = models.CharField(max_length=50, null=True, blank=True)
+    tokens = models.PositiveIntegerField(null=True, blank=True)
+    latency_ms = models.PositiveIntegerField(null=True, blank=True)
+    # Set explicitly when messages are saved in bulk after the reply
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     
     class Meta:
-        ordering = ['created_at']
+        indexes = [
+            # A session's messages in time order, newest-first history included
+            models.Index(fields=['session', 'created_at'], name='chat_message_session_time_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.message_type}: {self.content[:50]}"
+
+class ChatDailyStats(models.Model):
+    """
+    Chat traffic rolled up per day (see chatbot.services.analytics), so
+    reports never scan the message table
+    """
+    date = models.DateField(unique=True)
+    sessions = models.PositiveIntegerField(default=0, help_text='Sessions started')
+    messages = models.PositiveIntegerField(default=0)
+    questions = models.PositiveIntegerField(default=0, help_text='User messages')
+    fallbacks = models.PositiveIntegerField(default=0, help_text='Answers from the fallback search')
+    tokens = models.BigIntegerField(default=0)
+    latency_total_ms = models.BigIntegerField(default=0)
+    latency_count = models.PositiveIntegerField(default=0)
+    # {category: answers whose best knowledge base match was in it}
+    categories = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Daily chat stats'
+        verbose_name_plural = 'Daily chat stats'
+        ordering = ['-date']
+    
+    def __str__(self):
+        return f"Chat stats {self.date}"
+    
+    @property
+    def avg_latency_ms(self):
+        return round(self.latency_total_ms / self.latency_count) if self.latency_count else None
+    
+    def top_categories(self, limit=3):
+        return sorted(self.categories.items(), key=lambda item: -item[1])[:limit]
+
+class ChatStatsWatermark(models.Model):
+    """
+    Last message and session ids already counted in ChatDailyStats (one row)
+    """
+    last_message_id = models.BigIntegerField(default=0)
+    last_session_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
-        return f"{self.message_type}: {self.content[:50]}"
\ No newline at end of file
+        return f"Messages up to {self.last_message_id}, sessions up to {self.last_session_id}"
\ No newline at end of file
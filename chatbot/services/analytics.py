@@ -0,0 +1,129 @@
+"""
+Daily rollups of chat traffic (ChatDailyStats)
+Each run only reads the messages and sessions added since the watermark (by
+primary key) and adds them to the per-day rows, so reports never scan the
+message table. Runs from the scheduler and `python manage.py rollup_chat_stats`
+"""
+import logging
+import threading
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from chatbot.models import ChatDailyStats, ChatMessage, ChatSession, ChatStatsWatermark
+
+logger = logging.getLogger(__name__)
+
+# Ids folded in per transaction
+BATCH_SIZE = 50000
+# Rows younger than this are left for the next run, so rows still being
+# inserted with lower ids (e.g. a write-behind flush) are not skipped
+SETTLE_SECONDS = 60
+
+_lock = threading.Lock()
+
+
+def _next_batch_end(model, after_id, settled_before, batch_size):
+    """
+    Last id of the next batch after after_id, or None if nothing has settled
+    """
+    rows = model.objects.filter(pk__gt=after_id)
+    first = rows.order_by('pk').values_list('pk', flat=True).first()
+    if first is None:
+        return None
+    return rows.filter(pk__lt=first + batch_size, created_at__lt=settled_before).aggregate(last=Max('pk'))['last']
+
+
+def _stats_for(day, cache):
+    if day not in cache:
+        cache[day], _ = ChatDailyStats.objects.select_for_update().get_or_create(date=day)
+    return cache[day]
+
+
+def _add_messages(after_id, last_id):
+    messages = (
+        ChatMessage.objects.filter(pk__gt=after_id, pk__lte=last_id)
+        .annotate(day=TruncDate('created_at'))
+        .order_by()
+    )
+    per_day = messages.values('day').annotate(
+        messages=Count('pk'),
+        questions=Count('pk', filter=Q(message_type='user')),
+        fallbacks=Count('pk', filter=Q(route='fallback')),
+        tokens=Sum('tokens'),
+        latency_total=Sum('latency_ms'),
+        latency_count=Count('latency_ms'),
+    )
+    per_category = (
+        messages.filter(message_type='bot', category__gt='')
+        .values('day', 'category')
+        .annotate(count=Count('pk'))
+    )
+
+    days = {}
+    for row in per_day:
+        stats = _stats_for(row['day'], days)
+        stats.messages += row['messages']
+        stats.questions += row['questions']
+        stats.fallbacks += row['fallbacks']
+        stats.tokens += row['tokens'] or 0
+        stats.latency_total_ms += row['latency_total'] or 0
+        stats.latency_count += row['latency_count']
+    for row in per_category:
+        categories = _stats_for(row['day'], days).categories
+        categories[row['category']] = categories.get(row['category'], 0) + row['count']
+    for stats in days.values():
+        stats.save()
+    return sum(row['messages'] for row in per_day)
+
+
+def _add_sessions(after_id, last_id):
+    per_day = (
+        ChatSession.objects.filter(pk__gt=after_id, pk__lte=last_id)
+        .annotate(day=TruncDate('created_at'))
+        .order_by()
+        .values('day')
+        .annotate(sessions=Count('pk'))
+    )
+    days = {}
+    for row in per_day:
+        _stats_for(row['day'], days).sessions += row['sessions']
+    for stats in days.values():
+        stats.save()
+    return sum(row['sessions'] for row in per_day)
+
+
+def update_daily_stats(batch_size=BATCH_SIZE):
+    """
+    Fold messages and sessions saved since the last run into ChatDailyStats
+    Each batch is added together with the watermark in one transaction, so
+    rows are counted exactly once; returns the numbers of rows read
+    """
+    settled_before = timezone.now() - timedelta(seconds=SETTLE_SECONDS)
+    processed = {'messages': 0, 'sessions': 0}
+    steps = (
+        (ChatMessage, 'last_message_id', _add_messages, 'messages'),
+        (ChatSession, 'last_session_id', _add_sessions, 'sessions'),
+    )
+
+    with _lock:
+        for model, field, add, name in steps:
+            while True:
+                with transaction.atomic():
+                    watermark, _ = ChatStatsWatermark.objects.select_for_update().get_or_create(pk=1)
+                    after_id = getattr(watermark, field)
+                    last_id = _next_batch_end(model, after_id, settled_before, batch_size)
+                    if last_id is None:
+                        break
+                    processed[name] += add(after_id, last_id)
+                    setattr(watermark, field, last_id)
+                    watermark.save()
+
+    if processed['messages'] or processed['sessions']:
+        logger.info(f"Chat stats updated with {processed['messages']} messages and {processed['sessions']} sessions")
+    return processed
+
+
+def get_watermark():
+    return ChatStatsWatermark.objects.filter(pk=1).first()
\ No newline at end of file
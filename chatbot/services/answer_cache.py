@@ -0,0 +1,82 @@
+"""
+Cache of chatbot answers for repeated questions
+Backed by Django's cache framework; entries expire after a TTL and the
+local-memory backend evicts least recently used entries past MAX_ENTRIES
+"""
+import hashlib
+import re
+from django.conf import settings
+from django.core.cache import caches
+from chatbot.services import metrics
+
+KEY_PREFIX = 'chatbot:answer:'
+STAT_NAMES = ('hits', 'misses', 'saved_tokens')
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def get_cache():
+    return caches[getattr(settings, 'CHATBOT_ANSWER_CACHE_ALIAS', 'default')]
+
+
+def is_enabled():
+    return getattr(settings, 'CHATBOT_ANSWER_CACHE_TTL', 0) > 0
+
+
+def normalize_question(question):
+    """
+    Case, punctuation and whitespace-insensitive form of a question
+    """
+    return ' '.join(_WORD_RE.findall(question.lower()))
+
+
+def make_cache_key(question, kb_version, context=''):
+    """
+    Key on the normalized question, the KB version and (optionally) a hash of
+    the retrieved context, so a KB change never serves a stale answer
+    """
+    raw = f"{kb_version}|{normalize_question(question)}|{context}"
+    return KEY_PREFIX + hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def get_cached_answer(key):
+    """
+    Return the cached answer or None, recording the hit/miss
+    """
+    if not is_enabled():
+        return None
+
+    entry = get_cache().get(key)
+    if entry is None:
+        metrics.incr('answer_cache_misses')
+        return None
+
+    metrics.incr('answer_cache_hits')
+    metrics.incr('answer_cache_saved_tokens', entry.get('tokens', 0))
+    return entry['answer']
+
+
+def store_answer(key, answer, tokens=0):
+    if not is_enabled():
+        return
+    get_cache().set(
+        key,
+        {'answer': answer, 'tokens': tokens},
+        timeout=getattr(settings, 'CHATBOT_ANSWER_CACHE_TTL', 0),
+    )
+
+
+def get_answer_cache_stats():
+    """
+    Hit rate and tokens saved since the counters were last reset
+    """
+    counters = metrics.get_counters(['answer_cache_' + name for name in STAT_NAMES])
+    stats = {name: counters['answer_cache_' + name] for name in STAT_NAMES}
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+    stats['enabled'] = is_enabled()
+    return stats
+
+
+def reset_answer_cache_stats():
+    metrics.reset_counters(['answer_cache_' + name for name in STAT_NAMES])
@@ -0,0 +1,110 @@
+"""
+Category router for retrieval
+A multinomial naive Bayes model (a linear classifier in log space) is trained
+from the knowledge base rows once per KB version and maps a query to its
+likely categories, so retrieval only scores those partitions of the index
+"""
+import math
+from django.conf import settings
+from chatbot.services.knowledge_cache import get_knowledge_snapshot
+from chatbot.services.search_index import tokenize
+
+# Laplace smoothing
+ALPHA = 1.0
+
+
+class CategoryRouter:
+    """
+    Sum of weight * log P(term | category) over query terms, trained on each
+    entry's question and keywords plus the category's name
+    The prior is uniform so a category with many rows (news) doesn't attract
+    queries just by being big
+    """
+
+    def __init__(self, entries):
+        term_counts = {}
+        doc_counts = {}
+        names = {}
+        for qa in entries:
+            category = qa.get('category', '')
+            doc_counts[category] = doc_counts.get(category, 0) + 1
+            names[category] = qa.get('category_display', '')
+            counts = term_counts.setdefault(category, {})
+            for term in tokenize(f"{qa.get('question', '')} {qa.get('keywords', '')}"):
+                counts[term] = counts.get(term, 0) + 1
+
+        # The category name is evidence even for categories with few rows
+        for category, name in names.items():
+            counts = term_counts[category]
+            for term in tokenize(name):
+                counts[term] = counts.get(term, 0) + 1
+
+        vocabulary = {term for counts in term_counts.values() for term in counts}
+        self.categories = sorted(doc_counts)
+        self.log_likelihood = {}
+        self.log_unseen = {}
+        for category in self.categories:
+            counts = term_counts[category]
+            denominator = sum(counts.values()) + ALPHA * len(vocabulary)
+            self.log_unseen[category] = math.log(ALPHA / denominator)
+            for term, count in counts.items():
+                self.log_likelihood.setdefault(term, {})[category] = math.log((count + ALPHA) / denominator)
+
+    def probabilities(self, query_terms):
+        """
+        {category: probability} for {term: weight}, or None if no query term
+        is in the training vocabulary
+        """
+        known = {t: w for t, w in query_terms.items() if t in self.log_likelihood}
+        if not known:
+            return None
+
+        scores = {}
+        for category in self.categories:
+            score = 0.0
+            for term, weight in known.items():
+                score += weight * self.log_likelihood[term].get(category, self.log_unseen[category])
+            scores[category] = score
+
+        top = max(scores.values())
+        exp_scores = {c: math.exp(s - top) for c, s in scores.items()}
+        total = sum(exp_scores.values())
+        return {c: s / total for c, s in exp_scores.items()}
+
+    def route(self, query_terms, coverage, max_categories):
+        """
+        Fewest categories whose probabilities add up to coverage, or None
+        (search everything) if that takes more than max_categories
+        """
+        probabilities = self.probabilities(query_terms)
+        if probabilities is None or len(self.categories) <= 1:
+            return None
+
+        selected = []
+        cumulative = 0.0
+        for category in sorted(probabilities, key=lambda c: (-probabilities[c], c)):
+            selected.append(category)
+            cumulative += probabilities[category]
+            if cumulative >= coverage:
+                return selected
+            if len(selected) >= max_categories:
+                return None
+        return None
+
+
+def get_category_router(snapshot=None):
+    snapshot = snapshot or get_knowledge_snapshot()
+    return snapshot.derived('category_router', lambda snap: CategoryRouter(snap.entries))
+
+
+def route_categories(query_terms, snapshot=None):
+    """
+    Categories to search for {term: weight}; None means all of them
+    """
+    if not getattr(settings, 'CHATBOT_CATEGORY_ROUTING', True) or not query_terms:
+        return None
+    return get_category_router(snapshot).route(
+        query_terms,
+        coverage=getattr(settings, 'CHATBOT_CATEGORY_ROUTER_COVERAGE', 0.95),
+        max_categories=getattr(settings, 'CHATBOT_CATEGORY_ROUTER_MAX_CATEGORIES', 3),
+    )
\ No newline at end of file
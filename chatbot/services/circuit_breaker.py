@@ -0,0 +1,132 @@
+"""
+Circuit breaker for the upstream LLM
+After repeated upstream failures the breaker opens and calls fail immediately
+(so the chatbot answers from the local fallback in milliseconds); after a
+cooldown a single trial call is let through to test whether it has recovered
+"""
+import logging
+import threading
+import time
+import openai
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the upstream while the breaker is open"""
+
+
+def is_upstream_failure(error):
+    """
+    Errors that mean the upstream is unavailable (network, timeouts, 5xx,
+    rate limits and exhausted quota), as opposed to a bad request
+    """
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+class CircuitBreaker:
+    """
+    Per-process closed/open/half-open breaker
+    """
+
+    def __init__(self, name, failure_threshold=None, cooldown=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or getattr(settings, 'CHATBOT_BREAKER_FAILURE_THRESHOLD', 5)
+        self.cooldown = cooldown or getattr(settings, 'CHATBOT_BREAKER_COOLDOWN', 30)
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = ''
+        self._trial_in_flight = False
+        self.rejected = 0
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError unless a call may go ahead
+        """
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+                self._trial_in_flight = False
+                logger.info(f"Circuit breaker {self.name} half-open, trying upstream again")
+
+            if self.state == CLOSED:
+                return
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+
+            self.rejected += 1
+            raise CircuitOpenError(f"{self.name} circuit is open: {self.last_error}")
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"Circuit breaker {self.name} closed")
+            self.state = CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self, error):
+        """
+        Count an error; only upstream failures move the breaker towards open
+        """
+        if isinstance(error, CircuitOpenError):
+            return
+        with self._lock:
+            self._trial_in_flight = False
+            if not is_upstream_failure(error):
+                return
+
+            self.failures += 1
+            self.last_error = str(error)[:200]
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logger.warning(f"Circuit breaker {self.name} opened after {self.failures} failures: {self.last_error}")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def call(self, fn):
+        self.before_call()
+        try:
+            result = fn()
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        self.record_success()
+        return result
+
+    async def acall(self, fn):
+        self.before_call()
+        try:
+            result = await fn()
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        self.record_success()
+        return result
+
+    def status(self):
+        with self._lock:
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = max(round(self.cooldown - (time.monotonic() - self.opened_at), 1), 0)
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'failure_threshold': self.failure_threshold,
+                'cooldown_seconds': self.cooldown,
+                'retry_in_seconds': retry_in,
+                'rejected_calls': self.rejected,
+                'last_error': self.last_error,
+            }
@@ -0,0 +1,62 @@
+"""
+Write-through cache of each session's recent messages
+The chat endpoints append every saved exchange here, so building the next
+prompt's history doesn't have to read back what this worker just wrote
+Entries are stamped with the session's last_activity; a stamp that doesn't
+match the session row (another worker wrote since) counts as a miss
+"""
+from django.conf import settings
+from django.core.cache import caches
+from chatbot.services import metrics
+
+KEY_PREFIX = 'chatbot:history:'
+
+
+def get_cache():
+    return caches[getattr(settings, 'CHATBOT_HISTORY_CACHE_ALIAS', 'default')]
+
+
+def is_enabled():
+    return getattr(settings, 'CHATBOT_HISTORY_CACHE_TTL', 0) > 0
+
+
+def _key(session_pk):
+    return f"{KEY_PREFIX}{session_pk}"
+
+
+def get_messages(session):
+    """
+    Cached messages (oldest first, id/message_type/content dicts) for a
+    session, or None on a miss
+    """
+    if not is_enabled():
+        return None
+
+    entry = get_cache().get(_key(session.pk))
+    if entry is None or entry['last_activity'] != session.last_activity:
+        metrics.incr('history_cache_misses')
+        return None
+
+    metrics.incr('history_cache_hits')
+    return entry['messages']
+
+
+def store_messages(session, messages, max_messages):
+    """
+    Keep the last max_messages messages, stamped with the session's activity
+    """
+    if not is_enabled():
+        return
+    get_cache().set(
+        _key(session.pk),
+        {'last_activity': session.last_activity, 'messages': list(messages)[-max_messages:]},
+        timeout=getattr(settings, 'CHATBOT_HISTORY_CACHE_TTL', 0),
+    )
+
+
+def get_history_cache_stats():
+    stats = metrics.get_counters(['history_cache_hits', 'history_cache_misses'])
+    lookups = stats['history_cache_hits'] + stats['history_cache_misses']
+    stats['hit_rate'] = round(stats['history_cache_hits'] / lookups, 4) if lookups else 0.0
+    stats['enabled'] = is_enabled()
+    return stats
\ No newline at end of file
@@ -0,0 +1,146 @@
+"""
+Per-worker cache of the exported JSON knowledge base
+Files are only re-read when their stat changes, and the parsed data is only
+replaced when the file contents actually differ
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_snapshot = None
+_file_stamps = None
+
+
+class KnowledgeSnapshot:
+    """
+    Immutable view of the knowledge base for one KB version
+    Anything derived from the entries (indexes, prompts) is memoized here so it
+    is rebuilt automatically when the version changes
+    """
+
+    def __init__(self, version, entries):
+        self.version = version
+        self.entries = entries
+        self._derived = {}
+        # Reentrant so one derived value can be built from another
+        self._derived_lock = threading.RLock()
+
+    def derived(self, name, builder):
+        """Return builder(self) computed once for this snapshot"""
+        try:
+            return self._derived[name]
+        except KeyError:
+            pass
+
+        with self._derived_lock:
+            if name not in self._derived:
+                self._derived[name] = builder(self)
+            return self._derived[name]
+
+
+def get_knowledge_base_paths():
+    """
+    JSON files that make up the knowledge base, in load order
+    """
+    return [
+        Path(settings.KNOWLEDGE_BASE_JSON_PATH),
+        Path(settings.GENERAL_KNOWLEDGE_JSON_PATH),
+    ]
+
+
+def _stat_files(paths):
+    stamps = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            stamps.append((str(path), st.st_ino, st.st_size, st.st_mtime_ns))
+        except FileNotFoundError:
+            stamps.append((str(path), None, None, None))
+    return tuple(stamps)
+
+
+def _read_files(paths):
+    """
+    Read raw file contents, skipping missing files
+    """
+    contents = []
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                contents.append(f.read())
+        except FileNotFoundError:
+            contents.append(b'')
+    return contents
+
+
+def _parse(contents):
+    qa_data = []
+    for raw in contents:
+        if not raw:
+            continue
+        data = json.loads(raw.decode('utf-8'))
+        qa_data.extend(data.get('qa_data', []))
+    return qa_data
+
+
+def get_knowledge_snapshot():
+    """
+    Return the current KnowledgeSnapshot, reloading only if the files changed
+    """
+    global _snapshot, _file_stamps
+
+    paths = get_knowledge_base_paths()
+    stamps = _stat_files(paths)
+    if _snapshot is not None and stamps == _file_stamps:
+        return _snapshot
+
+    with _lock:
+        if _snapshot is not None and stamps == _file_stamps:
+            return _snapshot
+
+        contents = _read_files(paths)
+        digest = hashlib.sha1()
+        for raw in contents:
+            digest.update(hashlib.sha1(raw).digest())
+        version = digest.hexdigest()[:16]
+
+        if _snapshot is None or _snapshot.version != version:
+            try:
+                entries = _parse(contents)
+            except ValueError as e:
+                # Keep serving the previous version; stamps stay stale so we retry
+                logger.error(f"Error parsing knowledge base: {str(e)}")
+                if _snapshot is None:
+                    _snapshot = KnowledgeSnapshot('', [])
+                return _snapshot
+
+            _snapshot = KnowledgeSnapshot(version, entries)
+            logger.info(f"Knowledge base loaded: {len(entries)} items (version {version})")
+
+        _file_stamps = stamps
+        return _snapshot
+
+
+def get_knowledge_version():
+    """
+    Content hash of the current knowledge base
+    """
+    return get_knowledge_snapshot().version
+
+
+def clear_knowledge_cache():
+    """
+    Drop the cached snapshot so the next access reloads from disk
+    """
+    global _snapshot, _file_stamps
+
+    with _lock:
+        _snapshot = None
+        _file_stamps = None
@@ -0,0 +1,204 @@
+"""
+LLM backends for the chatbot, selected with settings.CHATBOT_LLM_BACKEND
+- 'openai': the OpenAI API
+- 'openai_compatible': any server speaking the OpenAI API at CHATBOT_LLM_BASE_URL
+- 'stub': deterministic local replies with configurable latency and token
+  rate, for load testing without network access
+
+Every backend returns usage as a dict with prompt_tokens, completion_tokens,
+total_tokens and cached_tokens
+"""
+import asyncio
+import threading
+import time
+from django.conf import settings
+from chatbot.services.token_budget import count_tokens, count_messages_tokens
+
+_lock = threading.Lock()
+_backend = None
+
+
+def _usage_dict(usage):
+    if not usage:
+        return None
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return {
+        'prompt_tokens': usage.prompt_tokens or 0,
+        'completion_tokens': usage.completion_tokens or 0,
+        'total_tokens': usage.total_tokens or 0,
+        'cached_tokens': (getattr(details, 'cached_tokens', None) or 0) if details else 0,
+    }
+
+
+class OpenAIBackend:
+    """
+    OpenAI chat completions, optionally against an OpenAI-compatible base URL
+    """
+
+    def __init__(self, api_key, model, base_url=None, timeout=None, max_retries=None):
+        from openai import OpenAI, AsyncOpenAI
+
+        options = {
+            'api_key': api_key,
+            'base_url': base_url or None,
+            'timeout': timeout,
+            'max_retries': max_retries,
+        }
+        self.model = model
+        self.client = OpenAI(**options)
+        # Used by the async views so waiting on the LLM doesn't hold a worker thread
+        self.async_client = AsyncOpenAI(**options)
+
+    def completion_options(self, messages):
+        """
+        Keyword arguments for chat.completions.create
+        """
+        return {
+            'model': self.model,
+            'messages': messages,
+            'temperature': 0.7,
+            'max_tokens': 500,
+        }
+
+    def complete(self, messages):
+        response = self.client.chat.completions.create(**self.completion_options(messages))
+        return {
+            'content': response.choices[0].message.content,
+            'usage': _usage_dict(response.usage),
+        }
+
+    async def acomplete(self, messages):
+        response = await self.async_client.chat.completions.create(**self.completion_options(messages))
+        return {
+            'content': response.choices[0].message.content,
+            'usage': _usage_dict(response.usage),
+        }
+
+    def stream(self, messages):
+        """
+        Yield {'delta': text, 'usage': dict or None} as the answer is generated
+        """
+        stream = self.client.chat.completions.create(
+            **self.completion_options(messages),
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            yield {'delta': delta or '', 'usage': _usage_dict(chunk.usage)}
+
+
+class StubBackend:
+    """
+    Deterministic local backend: replies with the best retrieved Q&A answer
+    after `latency` seconds, emitting `tokens_per_second` tokens per second
+    """
+
+    model = 'stub'
+
+    def __init__(self, latency=0.0, tokens_per_second=0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+
+    def reply_for(self, messages):
+        """
+        Build the reply from the knowledge message (the last system message)
+        """
+        user_message = messages[-1]['content']
+        context = next((m['content'] for m in reversed(messages) if m['role'] == 'system'), '')
+        answer = None
+        for line in context.splitlines():
+            if line.startswith('A: '):
+                answer = line[3:]
+                break
+        if answer:
+            return f"(stub) {answer}"
+        return f"(stub) You asked: {user_message}"
+
+    def _pieces(self, content):
+        words = content.split(' ')
+        return [w + ' ' for w in words[:-1]] + words[-1:]
+
+    def _usage(self, messages, content):
+        prompt_tokens = count_messages_tokens(messages)
+        completion_tokens = count_tokens(content)
+        return {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+            'cached_tokens': 0,
+        }
+
+    def _generation_time(self, content):
+        if not self.tokens_per_second:
+            return 0.0
+        return count_tokens(content) / self.tokens_per_second
+
+    def complete(self, messages):
+        content = self.reply_for(messages)
+        time.sleep(self.latency + self._generation_time(content))
+        return {'content': content, 'usage': self._usage(messages, content)}
+
+    async def acomplete(self, messages):
+        content = self.reply_for(messages)
+        await asyncio.sleep(self.latency + self._generation_time(content))
+        return {'content': content, 'usage': self._usage(messages, content)}
+
+    def stream(self, messages):
+        content = self.reply_for(messages)
+        time.sleep(self.latency)
+        for piece in self._pieces(content):
+            if self.tokens_per_second:
+                time.sleep(count_tokens(piece) / self.tokens_per_second)
+            yield {'delta': piece, 'usage': None}
+        yield {'delta': '', 'usage': self._usage(messages, content)}
+
+
+def create_backend(name=None):
+    """
+    Instantiate the backend configured in settings (or the one named)
+    """
+    name = name or getattr(settings, 'CHATBOT_LLM_BACKEND', 'openai')
+    if name == 'stub':
+        return StubBackend(
+            latency=getattr(settings, 'CHATBOT_STUB_LATENCY', 0.5),
+            tokens_per_second=getattr(settings, 'CHATBOT_STUB_TOKENS_PER_SECOND', 50),
+        )
+    if name in ('openai', 'openai_compatible'):
+        return OpenAIBackend(
+            api_key=settings.OPENAI_API_KEY or 'not-needed',
+            model=getattr(settings, 'CHATBOT_LLM_MODEL', 'gpt-4o-mini'),
+            base_url=getattr(settings, 'CHATBOT_LLM_BASE_URL', None) if name == 'openai_compatible' else None,
+            timeout=settings.OPENAI_TIMEOUT,
+            max_retries=settings.OPENAI_MAX_RETRIES,
+        )
+    raise ValueError(f"Unknown CHATBOT_LLM_BACKEND: {name}")
+
+
+def is_backend_configured():
+    """
+    The OpenAI backend needs an API key; the others can always be used
+    """
+    if getattr(settings, 'CHATBOT_LLM_BACKEND', 'openai') == 'openai':
+        return bool(settings.OPENAI_API_KEY)
+    return True
+
+
+def get_llm_backend():
+    """
+    Shared backend instance for this process
+    """
+    global _backend
+
+    if _backend is None:
+        with _lock:
+            if _backend is None:
+                _backend = create_backend()
+    return _backend
+
+
+def reset_llm_backend():
+    global _backend
+
+    with _lock:
+        _backend = None
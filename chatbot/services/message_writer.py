@@ -0,0 +1,250 @@
+"""
+Optional write-behind persistence for chat messages
+With CHATBOT_WRITE_BEHIND on, saved exchanges are queued in memory and a
+background thread writes them in batches with bulk_create (together with the
+sessions' last_activity), so replying doesn't wait on database writes
+Queued messages are visible to this process's history reads until flushed;
+CHATBOT_WRITE_BEHIND_MAX_DELAY bounds how much could be lost if the process
+dies without a clean shutdown
+"""
+import atexit
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import connections, transaction
+from chatbot.models import ChatSession, ChatMessage
+from chatbot.services import metrics
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_writer = None
+
+
+class MessageWriter:
+    """
+    Bounded in-process queue of unsaved messages and the thread flushing it
+    """
+
+    def __init__(self, batch_size, max_delay, max_queue):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        # (session_pk, messages, last_activity) in arrival order
+        self._queue = []
+        self._queued = 0
+        self._oldest = None
+        # Per session: unsaved messages and the latest unsaved activity
+        self._pending = {}
+        self._activity = {}
+        self._stopping = False
+        self._thread = None
+
+    def enqueue(self, session_pk, messages, last_activity):
+        """
+        Queue messages for a session; returns False if the queue is full (the
+        caller should save them itself)
+        """
+        with self._lock:
+            if self._stopping or self._queued + len(messages) > self.max_queue:
+                metrics.incr('write_behind_overflows')
+                return False
+            if not self._queue:
+                self._oldest = time.monotonic()
+            self._queue.append((session_pk, messages, last_activity))
+            self._queued += len(messages)
+            self._pending.setdefault(session_pk, []).extend(messages)
+            self._activity[session_pk] = max(self._activity.get(session_pk, last_activity), last_activity)
+            self._wakeup.notify()
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='chat-write-behind', daemon=True)
+                self._thread.start()
+        return True
+
+    def pending_messages(self, session_pk):
+        """
+        Unsaved messages of a session, oldest first
+        """
+        with self._lock:
+            return list(self._pending.get(session_pk, ()))
+
+    def pending_activity(self, session_pk):
+        """
+        last_activity of the session's newest unsaved exchange, or None
+        """
+        with self._lock:
+            return self._activity.get(session_pk)
+
+    def _due(self):
+        return self._queued >= self.batch_size or (
+            self._queue and time.monotonic() - self._oldest >= self.max_delay
+        )
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._stopping and not self._due():
+                    timeout = self.max_delay - (time.monotonic() - self._oldest) if self._queue else None
+                    self._wakeup.wait(timeout)
+                if self._stopping:
+                    return
+            self.flush()
+            connections.close_all()
+
+    def flush(self):
+        """
+        Write everything queued so far; returns the number of messages saved
+        Failed batches are put back and retried on the next flush
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = self._queue
+                self._queue = []
+                self._queued = 0
+            if not batch:
+                return 0
+
+            messages = [msg for _, msgs, _ in batch for msg in msgs]
+            try:
+                self._write(batch, messages)
+            except Exception as e:
+                logger.error(f"Write-behind flush of {len(messages)} messages failed: {str(e)}")
+                metrics.incr('write_behind_failures')
+                batch = self._without_deleted_sessions(batch)
+                for _, msgs, _ in batch:
+                    for msg in msgs:
+                        msg.pk = None
+                with self._lock:
+                    if batch and not self._queue:
+                        self._oldest = time.monotonic()
+                    self._queue = batch + self._queue
+                    self._queued += sum(len(msgs) for _, msgs, _ in batch)
+                return 0
+
+            with self._lock:
+                for session_pk, msgs, _ in batch:
+                    saved = set(map(id, msgs))
+                    remaining = [m for m in self._pending.get(session_pk, ()) if id(m) not in saved]
+                    if remaining:
+                        self._pending[session_pk] = remaining
+                    else:
+                        self._pending.pop(session_pk, None)
+                        self._activity.pop(session_pk, None)
+            metrics.incr('write_behind_flushed', len(messages))
+            return len(messages)
+
+    def _write(self, batch, messages):
+        activity = {}
+        for session_pk, _, last_activity in batch:
+            activity[session_pk] = max(activity.get(session_pk, last_activity), last_activity)
+
+        with transaction.atomic():
+            ChatMessage.objects.bulk_create(messages, batch_size=self.batch_size)
+            for session_pk, last_activity in activity.items():
+                ChatSession.objects.filter(pk=session_pk, last_activity__lt=last_activity).update(
+                    last_activity=last_activity
+                )
+
+    def _without_deleted_sessions(self, batch):
+        """
+        Drop queued messages of sessions deleted in the meantime, which would
+        otherwise fail every retry
+        """
+        try:
+            existing = set(ChatSession.objects.filter(
+                pk__in={session_pk for session_pk, _, _ in batch}
+            ).values_list('pk', flat=True))
+        except Exception:
+            return batch
+
+        kept = [entry for entry in batch if entry[0] in existing]
+        if len(kept) < len(batch):
+            with self._lock:
+                for session_pk, _, _ in batch:
+                    if session_pk not in existing:
+                        self._pending.pop(session_pk, None)
+                        self._activity.pop(session_pk, None)
+            logger.warning(f"Dropped queued messages of {len(batch) - len(kept)} deleted sessions")
+        return kept
+
+    def stop(self):
+        """
+        Stop the thread and write whatever is still queued
+        """
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            queued = self._queued
+        stats = metrics.get_counters(['write_behind_flushed', 'write_behind_failures', 'write_behind_overflows'])
+        stats['queued'] = queued
+        return stats
+
+
+def is_enabled():
+    return getattr(settings, 'CHATBOT_WRITE_BEHIND', False)
+
+
+def get_message_writer():
+    """
+    Shared writer for this process, or None when write-behind is off
+    """
+    global _writer
+
+    if not is_enabled():
+        return None
+    if _writer is None:
+        with _lock:
+            if _writer is None:
+                _writer = MessageWriter(
+                    batch_size=getattr(settings, 'CHATBOT_WRITE_BEHIND_BATCH_SIZE', 500),
+                    max_delay=getattr(settings, 'CHATBOT_WRITE_BEHIND_MAX_DELAY', 1.0),
+                    max_queue=getattr(settings, 'CHATBOT_WRITE_BEHIND_QUEUE_SIZE', 10000),
+                )
+                # Flush what is left when the worker shuts down
+                atexit.register(_writer.stop)
+    return _writer
+
+
+def stop_message_writer():
+    """
+    Flush and discard the shared writer
+    """
+    global _writer
+
+    with _lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        atexit.unregister(writer.stop)
+        writer.stop()
+
+
+def pending_messages(session_pk):
+    return _writer.pending_messages(session_pk) if _writer is not None else []
+
+
+def effective_last_activity(session):
+    """
+    The session's last_activity including exchanges not saved yet
+    """
+    pending = _writer.pending_activity(session.pk) if _writer is not None else None
+    if pending is not None and pending > session.last_activity:
+        return pending
+    return session.last_activity
+
+
+def get_write_behind_stats():
+    if _writer is None:
+        return {'enabled': is_enabled(), 'queued': 0}
+    return {'enabled': is_enabled(), **_writer.stats()}
\ No newline at end of file
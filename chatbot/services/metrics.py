@@ -0,0 +1,45 @@
+"""
+Counters for the chatbot services
+Kept in Django's cache so workers sharing a cache backend report the same numbers
+"""
+import logging
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'chatbot:metrics:'
+
+
+def get_cache():
+    return caches[getattr(settings, 'CHATBOT_METRICS_CACHE_ALIAS', 'default')]
+
+
+def incr(name, amount=1):
+    """
+    Add amount to the named counter
+    """
+    if not amount:
+        return
+    cache = get_cache()
+    key = KEY_PREFIX + name
+    try:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key, amount)
+    except ValueError:
+        # Counter was evicted between add() and incr()
+        cache.set(key, amount, timeout=None)
+    except Exception as e:
+        logger.warning(f"Error updating counter {name}: {str(e)}")
+
+
+def get_counters(names):
+    """
+    Current value of each named counter (0 if never incremented)
+    """
+    values = get_cache().get_many([KEY_PREFIX + name for name in names])
+    return {name: values.get(KEY_PREFIX + name, 0) for name in names}
+
+
+def reset_counters(names):
+    get_cache().delete_many([KEY_PREFIX + name for name in names])
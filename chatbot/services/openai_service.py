@@ -1,98 +1,96 @@
-from openai import OpenAI
-from django.conf import settings
-import json
+import logging
+from asgiref.sync import sync_to_async
+from chatbot.services import answer_cache, metrics
+from chatbot.services.singleflight import SingleFlight
+from chatbot.services.llm_backends import get_llm_backend, is_backend_configured
+from chatbot.services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from chatbot.services.routing import (
+    ROUTE_CACHE, ROUTE_DIRECT, ROUTE_FALLBACK, ROUTE_LLM, format_direct_answer, route_question,
+)
+from chatbot.services.knowledge_cache import get_knowledge_snapshot
+from chatbot.services.search_index import routed_search, weighted_query_terms
+from chatbot.services.retrieval import retrieve_relevant_knowledge, format_knowledge_entry, uses_database
+from chatbot.services.token_budget import (
+    MESSAGE_OVERHEAD, REPLY_OVERHEAD, count_tokens, count_message_tokens,
+    count_messages_tokens, get_budget, trim_history, truncate_to_tokens,
+)
 
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
+logger = logging.getLogger(__name__)
+
+# Skips OpenAI entirely (straight to the keyword fallback) while it is failing
+openai_breaker = CircuitBreaker('openai')
+
+# Coalesces identical first-turn questions that are in flight at the same time
+openai_calls = SingleFlight('openai_calls')
 
 def load_knowledge_base():
     """
     Load all Q&A from JSON files (engineering + general)
+    Served from the per-worker cache; files are only re-parsed when they change
     """
-    qa_data = []
-    
-    # Load engineering knowledge
-    try:
-        with open(settings.KNOWLEDGE_BASE_JSON_PATH, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            qa_data.extend(data.get('qa_data', []))
-    except FileNotFoundError:
-        pass
-    
-    # Load general knowledge
-    try:
-        from pathlib import Path
-        general_path = Path(settings.BASE_DIR) / 'data' / 'general_qa.json'
-        with open(general_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            qa_data.extend(data.get('qa_data', []))
-    except FileNotFoundError:
-        pass
-    
-    return qa_data
+    return get_knowledge_snapshot().entries
 
-def create_system_prompt():
-    """
-    Create system prompt with knowledge base
-    """
-    knowledge_base = load_knowledge_base()
-    
-    prompt = """You are an AI assistant for Rufus Giwa Polytechnic (RUGIPO) student support services.
+SYSTEM_INSTRUCTIONS = """You are an AI assistant for Rufus Giwa Polytechnic (RUGIPO) student support services.
 Your role is to help students with information about RUGIPO, including engineering programs, general information, admissions, fees, and other student services.
 
 IMPORTANT INSTRUCTIONS:
 1. Be friendly, professional, and helpful
-2. Use the comprehensive knowledge base provided below
+2. Use the knowledge base entries provided with each question (the most relevant ones for this conversation)
 3. If you don't have information in the knowledge base, use your general knowledge
 4. If you still don't know, be honest and suggest they contact the admin office
 5. Keep responses concise but informative
-6. Use simple, clear language
+6. Use simple, clear language"""
 
-RUGIPO KNOWLEDGE BASE:
-"""
-    
-    if knowledge_base:
-        for qa in knowledge_base:
-            prompt += f"\n\nCategory: {qa['category_display']}"
-            prompt += f"\nQ: {qa['question']}"
-            prompt += f"\nA: {qa['answer']}"
-    else:
-        prompt += "\n(No Faculty of Engineering data available yet)"
+def _build_system_prompt_prefix(snapshot):
+    """
+    Static part of the system prompt for one KB version
+    Sorted deterministically so it is byte-identical in every worker
+    """
+    metrics.incr('prompt_prefix_builds')
     
-    prompt += "\n\nRemember: Always be helpful and guide students to the right information or resources."
+    counts = {}
+    for qa in snapshot.entries:
+        counts[qa['category_display']] = counts.get(qa['category_display'], 0) + 1
     
-    return prompt
+    parts = [
+        SYSTEM_INSTRUCTIONS,
+        "",
+        f"RUGIPO KNOWLEDGE BASE OVERVIEW ({len(snapshot.entries)} entries):",
+    ]
+    parts.extend(f"- {category} ({counts[category]})" for category in sorted(counts))
+    parts.extend([
+        "",
+        "Remember: Always be helpful and guide students to the right information or resources.",
+    ])
+    return "\n".join(parts)
+
+def get_system_prompt_prefix(snapshot=None):
+    """
+    Memoized system prompt prefix for the current KB version
+    It comes first in every request so OpenAI can reuse its cached prefix
+    """
+    snapshot = snapshot or get_knowledge_snapshot()
+    return snapshot.derived('system_prompt_prefix', _build_system_prompt_prefix)
+
+def create_context_prompt(knowledge_entries):
+    """
+    Knowledge base entries for this request, sent after the stable prefix
+    """
+    if not knowledge_entries:
+        return "RUGIPO KNOWLEDGE BASE:\n(No matching knowledge base entries for this question)"
+    return "RUGIPO KNOWLEDGE BASE:\n\n" + "\n\n".join(
+        format_knowledge_entry(qa) for qa in knowledge_entries
+    )
 
 def fallback_keyword_search(user_message):
     """
     Simple keyword-based search for when OpenAI is unavailable
     """
-    knowledge_base = load_knowledge_base()
-    user_message_lower = user_message.lower()
-    
-    # Search for matching questions
-    best_match = None
-    highest_score = 0
-    
-    for qa in knowledge_base:
-        score = 0
-        question_lower = qa['question'].lower()
-        answer_lower = qa['answer'].lower()
-        keywords = qa.get('keywords', '').lower()
-        
-        # Check if words from user message appear in question, answer or keywords
-        words = user_message_lower.split()
-        for word in words:
-            if len(word) > 3:  # Ignore short words
-                if word in question_lower:
-                    score += 3
-                if word in keywords:
-                    score += 2
-                if word in answer_lower:
-                    score += 1
-        
-        if score > highest_score:
-            highest_score = score
-            best_match = qa
+    # Prebuilt BM25 index (question/keywords/answer weighted 3/2/1), narrowed
+    # to the categories the question is about
+    results = routed_search(weighted_query_terms(user_message), limit=1)
+    best_match = results[0][1] if results else None
+    highest_score = results[0][0] if results else 0
     
     if best_match and highest_score > 0:
         return f"**{best_match['category_display']}**\n\n{best_match['answer']}\n\nIf you need more specific information, please contact the Faculty office."
@@ -121,46 +119,310 @@ def fallback_keyword_search(user_message):
 
 """
 
-def get_chatbot_response(user_message, conversation_history=None):
+def build_messages(user_message, conversation_history=None, knowledge_entries=None):
+    """
+    Assemble the chat completion messages
+    Layout: stable system prefix, history, retrieved knowledge, user message;
+    everything up to the end of the history is identical between turns
+    """
+    metrics.incr('prompt_prefix_requests')
+    messages = [
+        {"role": "system", "content": get_system_prompt_prefix()}
+    ]
+    
+    # Add conversation history if exists
+    if conversation_history:
+        for msg in conversation_history:
+            messages.append({
+                "role": msg['role'],
+                "content": msg['content']
+            })
+    
+    # Knowledge relevant to this question
+    messages.append({
+        "role": "system",
+        "content": create_context_prompt(knowledge_entries or [])
+    })
+    
+    # Add current user message
+    messages.append({
+        "role": "user",
+        "content": user_message
+    })
+    
+    return messages
+
+def record_usage(usage):
     """
-    Get response from OpenAI ChatGPT with fallback to keyword search
+    Track prompt tokens and how many of them OpenAI served from its prompt cache
     """
-    if not settings.OPENAI_API_KEY:
+    if not usage:
+        return
+    metrics.incr('prompt_tokens', usage['prompt_tokens'])
+    metrics.incr('cached_prompt_tokens', usage['cached_tokens'])
+
+def get_prompt_cache_stats():
+    """
+    How often the memoized prefix is reused, and OpenAI's cached token share
+    """
+    stats = metrics.get_counters([
+        'prompt_prefix_builds', 'prompt_prefix_requests', 'prompt_tokens', 'cached_prompt_tokens',
+    ])
+    requests = stats['prompt_prefix_requests']
+    stats['prefix_reuse_rate'] = round(1 - stats['prompt_prefix_builds'] / requests, 4) if requests else 0.0
+    tokens = stats['prompt_tokens']
+    stats['cached_token_rate'] = round(stats['cached_prompt_tokens'] / tokens, 4) if tokens else 0.0
+    return stats
+
+def prepare_prompt(user_message, conversation_history=None):
+    """
+    Build the messages for a request within the configured token budget
+    The instructions and user message come first, then the most recent history,
+    then as much retrieved knowledge as still fits
+    Returns a dict with the messages, the knowledge entries used and token counts
+    """
+    budget = get_budget()
+    user_message = truncate_to_tokens(user_message, budget['user_message'])
+    
+    snapshot = get_knowledge_snapshot()
+    instructions_tokens = snapshot.derived(
+        'system_prompt_prefix_tokens',
+        lambda snap: count_tokens(get_system_prompt_prefix(snap))
+    )
+    context_overhead = MESSAGE_OVERHEAD + count_tokens(create_context_prompt([]))
+    used = (
+        instructions_tokens + MESSAGE_OVERHEAD + context_overhead
+        + count_message_tokens({'content': user_message}) + REPLY_OVERHEAD
+    )
+    
+    history, history_tokens = trim_history(
+        conversation_history,
+        max(min(budget['history'], budget['total'] - used), 0)
+    )
+    used += history_tokens
+    
+    knowledge_entries = retrieve_relevant_knowledge(
+        user_message,
+        history,
+        token_budget=max(min(budget['context'], budget['total'] - used), 0)
+    )
+    messages = build_messages(user_message, history, knowledge_entries)
+    
+    token_counts = {
+        'instructions': instructions_tokens,
+        'context': count_message_tokens(messages[-2]),
+        'history': history_tokens,
+        'user_message': count_message_tokens(messages[-1]),
+        'total': count_messages_tokens(messages),
+    }
+    logger.info(
+        f"Prompt tokens: {token_counts['total']} "
+        f"(instructions {token_counts['instructions']}, context {token_counts['context']} "
+        f"from {len(knowledge_entries)} Q&As, history {history_tokens} "
+        f"from {len(history)} messages, user {token_counts['user_message']})"
+    )
+    
+    return {
+        'messages': messages,
+        'knowledge_entries': knowledge_entries,
+        'token_counts': token_counts,
+    }
+
+def get_question_key(user_message, conversation_history, knowledge_entries):
+    """
+    Key identifying a question for the answer cache and request coalescing,
+    or None if the request has history (later answers depend on it)
+    """
+    if conversation_history:
+        return None
+    return answer_cache.make_cache_key(
+        user_message,
+        get_knowledge_snapshot().version,
+        ','.join(str(qa.get('id')) for qa in knowledge_entries),
+    )
+
+def fallback_response(user_message, error=None):
+    """
+    Keyword-search answer used when OpenAI is not configured or fails
+    """
+    if error is None:
         return "OpenAI API key is not configured. Using basic mode.\n\n" + fallback_keyword_search(user_message)
     
+    if isinstance(error, CircuitOpenError):
+        return "⚠️ The AI service is temporarily unavailable. Using basic search mode.\n\n" + fallback_keyword_search(user_message)
+    
+    # If OpenAI fails (quota, network, etc), use fallback
+    error_msg = str(error)
+    if 'insufficient_quota' in error_msg or '429' in error_msg:
+        return "⚠️ OpenAI quota exceeded. Using basic search mode.\n\n" + fallback_keyword_search(user_message)
+    return "Sorry, I encountered an error. Using basic mode.\n\n" + fallback_keyword_search(user_message)
+
+def make_reply(content, route, decision=None, tokens=None):
+    """
+    Reply dict; the routing decision gives the match score and the category
+    of the best knowledge base match, tokens are those of the LLM call
+    """
+    entry = decision['entry'] if decision else None
+    return {
+        'content': content,
+        'route': route,
+        'score': decision['score'] if decision else None,
+        'category': entry['category'] if entry else '',
+        'tokens': tokens,
+    }
+
+def get_chatbot_reply(user_message, conversation_history=None):
+    """
+    Answer a message, returning {'content', 'route', 'score', 'category', 'tokens'}
+    route is 'direct' (curated answer above the confidence threshold), 'cache',
+    'llm' or 'fallback'; score is the best knowledge base match confidence and
+    category its category; tokens is the LLM usage (None for other routes and
+    for requests that shared another request's call)
+    """
+    decision = route_question(user_message)
+    if decision['route'] == ROUTE_DIRECT:
+        return make_reply(format_direct_answer(decision['entry']), ROUTE_DIRECT, decision)
+    
+    if not is_backend_configured():
+        return make_reply(fallback_response(user_message), ROUTE_FALLBACK, decision)
+    
+    try:
+        # Only send the Q&As relevant to this conversation, within the token budget
+        prompt = prepare_prompt(user_message, conversation_history)
+        
+        # Repeated first-turn questions are served from the answer cache
+        question_key = get_question_key(user_message, conversation_history, prompt['knowledge_entries'])
+        if question_key:
+            cached = answer_cache.get_cached_answer(question_key)
+            if cached is not None:
+                return make_reply(cached, ROUTE_CACHE, decision)
+        
+        # Set only when this request made the call itself
+        usage = {}
+        
+        def ask_openai():
+            result = openai_breaker.call(lambda: get_llm_backend().complete(prompt['messages']))
+            
+            record_usage(result['usage'])
+            usage['tokens'] = result['usage']['total_tokens'] if result['usage'] else 0
+            if question_key:
+                answer_cache.store_answer(question_key, result['content'], usage['tokens'])
+            return result['content']
+        
+        # Identical questions asked at the same time share one OpenAI call;
+        # its tokens are counted for the request that made it only
+        if question_key:
+            content = openai_calls.do(question_key, ask_openai)
+        else:
+            content = ask_openai()
+        return make_reply(content, ROUTE_LLM, decision, usage.get('tokens'))
+        
+    except Exception as e:
+        return make_reply(fallback_response(user_message, e), ROUTE_FALLBACK, decision)
+
+async def aget_chatbot_reply(user_message, conversation_history=None):
+    """
+    Async version of get_chatbot_reply using AsyncOpenAI
+    """
+    decision = route_question(user_message)
+    if decision['route'] == ROUTE_DIRECT:
+        return make_reply(format_direct_answer(decision['entry']), ROUTE_DIRECT, decision)
+    
+    if not is_backend_configured():
+        return make_reply(fallback_response(user_message), ROUTE_FALLBACK, decision)
+    
     try:
-        messages = [
-            {"role": "system", "content": create_system_prompt()}
-        ]
+        if uses_database():
+            prompt = await sync_to_async(prepare_prompt)(user_message, conversation_history)
+        else:
+            prompt = prepare_prompt(user_message, conversation_history)
+        
+        question_key = get_question_key(user_message, conversation_history, prompt['knowledge_entries'])
+        if question_key:
+            cached = answer_cache.get_cached_answer(question_key)
+            if cached is not None:
+                return make_reply(cached, ROUTE_CACHE, decision)
+        
+        usage = {}
         
-        # Add conversation history if exists
-        if conversation_history:
-            for msg in conversation_history:
-                messages.append({
-                    "role": msg['role'],
-                    "content": msg['content']
-                })
+        async def ask_openai():
+            result = await openai_breaker.acall(lambda: get_llm_backend().acomplete(prompt['messages']))
+            
+            record_usage(result['usage'])
+            usage['tokens'] = result['usage']['total_tokens'] if result['usage'] else 0
+            if question_key:
+                answer_cache.store_answer(question_key, result['content'], usage['tokens'])
+            return result['content']
         
-        # Add current user message
-        messages.append({
-            "role": "user",
-            "content": user_message
-        })
+        if question_key:
+            content = await openai_calls.ado(question_key, ask_openai)
+        else:
+            content = await ask_openai()
+        return make_reply(content, ROUTE_LLM, decision, usage.get('tokens'))
         
-        # Call OpenAI API
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=500
-        )
+    except Exception as e:
+        return make_reply(fallback_response(user_message, e), ROUTE_FALLBACK, decision)
+
+def stream_chatbot_response(user_message, conversation_history=None, reply_info=None):
+    """
+    Same as get_chatbot_reply, but yields the answer in chunks as OpenAI
+    generates it
+    Pass a dict as reply_info to receive the route, score, category and tokens
+    """
+    if reply_info is None:
+        reply_info = {}
+    
+    decision = route_question(user_message)
+    reply = make_reply('', decision['route'], decision)
+    reply_info.update(route=reply['route'], score=reply['score'], category=reply['category'])
+    if decision['route'] == ROUTE_DIRECT:
+        yield format_direct_answer(decision['entry'])
+        return
+    
+    if not is_backend_configured():
+        reply_info['route'] = ROUTE_FALLBACK
+        yield fallback_response(user_message)
+        return
+    
+    parts = []
+    try:
+        prompt = prepare_prompt(user_message, conversation_history)
         
-        return response.choices[0].message.content
+        question_key = get_question_key(user_message, conversation_history, prompt['knowledge_entries'])
+        if question_key:
+            cached = answer_cache.get_cached_answer(question_key)
+            if cached is not None:
+                reply_info['route'] = ROUTE_CACHE
+                yield cached
+                return
         
+        openai_breaker.before_call()
+        try:
+            tokens = 0
+            for chunk in get_llm_backend().stream(prompt['messages']):
+                if chunk['usage']:
+                    tokens = chunk['usage']['total_tokens']
+                    record_usage(chunk['usage'])
+                if chunk['delta']:
+                    parts.append(chunk['delta'])
+                    yield chunk['delta']
+        except GeneratorExit:
+            # The client disconnected mid-stream; OpenAI itself was fine
+            openai_breaker.record_success()
+            raise
+        except Exception as e:
+            openai_breaker.record_failure(e)
+            raise
+        openai_breaker.record_success()
+        reply_info['tokens'] = tokens
+        
+        if question_key and parts:
+            answer_cache.store_answer(question_key, ''.join(parts), tokens)
+    
     except Exception as e:
-        pass
-        # If OpenAI fails (quota, network, etc), use fallback
-        error_msg = str(e)
-        if 'insufficient_quota' in error_msg or '429' in error_msg:
-            return "⚠️ OpenAI quota exceeded. Using basic search mode.\n\n" + fallback_keyword_search(user_message)
-        return "Sorry, I encountered an error. Using basic mode.\n\n" + fallback_keyword_search(user_message)
\ No newline at end of file
+        if parts:
+            # Part of the answer has already been sent
+            yield "\n\n(Response interrupted. Please try again.)"
+        else:
+            reply_info['route'] = ROUTE_FALLBACK
+            yield fallback_response(user_message, e)
\ No newline at end of file
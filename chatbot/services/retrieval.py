@@ -0,0 +1,130 @@
+"""
+Retrieval stage for the chatbot prompt
+Ranks knowledge base entries against the user message (and recent history)
+so only the most relevant Q&As are sent to the model
+"""
+import logging
+from django.conf import settings
+from django.db import DatabaseError
+from chatbot.services.knowledge_cache import get_knowledge_snapshot
+from chatbot.services.search_index import routed_search, weighted_query_terms
+from chatbot.services.token_budget import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Weight given to terms taken from earlier user turns
+HISTORY_WEIGHT = 0.5
+
+# Matches fetched from the database full-text index per query
+FULLTEXT_CANDIDATES = 50
+
+
+def build_query_terms(user_message, conversation_history=None, snapshot=None):
+    """
+    Weighted query terms from the message plus recent user turns
+    Likely misspellings also bring in their correction at a reduced weight
+    """
+    terms = {}
+    if conversation_history:
+        for msg in conversation_history:
+            if msg['role'] == 'user':
+                for term, weight in weighted_query_terms(msg['content'], HISTORY_WEIGHT, snapshot).items():
+                    terms[term] = max(terms.get(term, 0), weight)
+    for term, weight in weighted_query_terms(user_message, 1.0, snapshot).items():
+        terms[term] = max(terms.get(term, 0), weight)
+    return terms
+
+
+def rank_knowledge(user_message, conversation_history=None, snapshot=None):
+    """
+    Return (score, entry) pairs for matching entries, best first
+    """
+    query = build_query_terms(user_message, conversation_history, snapshot)
+    if not query:
+        return []
+    
+    backend = getattr(settings, 'CHATBOT_RETRIEVAL_BACKEND', 'bm25')
+    if backend == 'tfidf':
+        results = _rank_tfidf(query, snapshot or get_knowledge_snapshot())
+        if results is not None:
+            return results
+    elif backend == 'fulltext':
+        results = _rank_fulltext(query, snapshot or get_knowledge_snapshot())
+        if results is not None:
+            return results
+    return routed_search(query, snapshot=snapshot)
+
+
+def uses_database():
+    """
+    Whether ranking queries the database (async callers must run it in a thread)
+    """
+    return getattr(settings, 'CHATBOT_RETRIEVAL_BACKEND', 'bm25') == 'fulltext'
+
+
+def _entries_for(snapshot, ranked_ids):
+    """
+    (score, entry) pairs for (score, id) pairs of knowledge base rows; rows
+    that are no longer in the exported knowledge base are skipped
+    """
+    by_id = snapshot.derived('entries_by_id', lambda snap: {qa['id']: qa for qa in snap.entries})
+    return [(score, by_id[qa_id]) for score, qa_id in ranked_ids if qa_id in by_id]
+
+
+def _rank_tfidf(query, snapshot):
+    """
+    Rank with the memory-mapped TF-IDF index; None if it has not been built
+    """
+    from chatbot.services.tfidf_index import get_tfidf_index
+    
+    index = get_tfidf_index()
+    if index is None:
+        return None
+    
+    return _entries_for(snapshot, index.search(query, limit=None))
+
+
+def _rank_fulltext(query, snapshot):
+    """
+    Rank with the database full-text index (entries matching any query term);
+    None if the query failed
+    """
+    from knowledge.search import search_knowledge
+    
+    try:
+        rows = list(
+            search_knowledge(' '.join(query), any_word=True, limit=FULLTEXT_CANDIDATES)
+            .values_list('id', 'search_rank')
+        )
+    except DatabaseError as e:
+        logger.error(f"Full-text retrieval failed: {str(e)}")
+        return None
+    
+    return _entries_for(snapshot, ((rank, qa_id) for qa_id, rank in rows))
+
+
+def format_knowledge_entry(qa):
+    return f"Category: {qa['category_display']}\nQ: {qa['question']}\nA: {qa['answer']}"
+
+
+def retrieve_relevant_knowledge(user_message, conversation_history=None, top_k=None, token_budget=None):
+    """
+    Select the top-k entries that fit within the context token budget
+    """
+    if top_k is None:
+        top_k = getattr(settings, 'CHATBOT_RETRIEVAL_TOP_K', 8)
+    if token_budget is None:
+        token_budget = getattr(settings, 'CHATBOT_CONTEXT_TOKEN_BUDGET', 1500)
+
+    selected = []
+    used = 0
+    for score, qa in rank_knowledge(user_message, conversation_history):
+        if len(selected) >= top_k:
+            break
+        # Entries are joined with a blank line in the system prompt
+        cost = count_tokens(format_knowledge_entry(qa)) + 1
+        if used + cost > token_budget:
+            continue
+        selected.append(qa)
+        used += cost
+    return selected
@@ -0,0 +1,107 @@
+"""
+Confidence-gated routing between curated answers and the LLM
+Questions that (nearly) match a knowledge base question are answered straight
+from the knowledge base; everything else goes to the LLM
+"""
+import heapq
+import logging
+from django.conf import settings
+from chatbot.services import metrics
+from chatbot.services.category_router import route_categories
+from chatbot.services.search_index import (
+    CORRECTION_WEIGHT, expand_query, get_search_index, weighted_query_terms,
+)
+
+logger = logging.getLogger(__name__)
+
+ROUTE_DIRECT = 'direct'
+ROUTE_CACHE = 'cache'
+ROUTE_LLM = 'llm'
+ROUTE_FALLBACK = 'fallback'
+
+# BM25 candidates whose confidence is checked
+CANDIDATES = 3
+
+DIRECT_ANSWER_TEMPLATE = "**{category_display}**\n\n{answer}"
+
+
+def match_confidence(index, query, doc_id):
+    """
+    0-1 confidence that a query asks the same thing as an entry's question
+    Harmonic mean (idf weighted) of how much of the query the entry's
+    question/keywords cover and how much of the entry's question the query
+    covers, so an exact question scores 1.0 and rare words count the most
+    query holds (term, correction) pairs; a term only matched through its
+    spelling correction counts CORRECTION_WEIGHT
+    """
+    question = index.question_terms[doc_id]
+    if not query or not question:
+        return 0.0
+
+    covered = question | index.keyword_terms[doc_id]
+    terms = {term for term, _ in query}
+    corrections = {correction for _, correction in query if correction is not None}
+
+    def credit(term, correction, matched):
+        if term in matched:
+            return 1.0
+        return CORRECTION_WEIGHT if correction is not None and correction in matched else 0.0
+
+    query_weight = sum(index.term_idf(term) for term, _ in query)
+    question_weight = sum(index.term_idf(t) for t in question)
+    recall = sum(index.term_idf(term) * credit(term, correction, covered) for term, correction in query) / query_weight
+    precision = sum(
+        index.term_idf(t) * (1.0 if t in terms else CORRECTION_WEIGHT if t in corrections else 0.0)
+        for t in question
+    ) / question_weight
+    if not recall or not precision:
+        return 0.0
+    return 2 * recall * precision / (recall + precision)
+
+
+def get_threshold():
+    return getattr(settings, 'CHATBOT_DIRECT_ANSWER_THRESHOLD', 0.8)
+
+
+def route_question(user_message):
+    """
+    Decide how to answer a message
+    Returns {'route': 'direct' or 'llm', 'score': confidence, 'entry': best Q&A}
+    """
+    index = get_search_index()
+    query = list(dict.fromkeys(expand_query(user_message)))
+    weighted = weighted_query_terms(user_message)
+    scores = {}
+    categories = route_categories(weighted)
+    if categories is not None:
+        scores = index.score(weighted, categories)
+    if not scores:
+        scores = index.score(weighted)
+    candidates = heapq.nsmallest(CANDIDATES, scores.items(), key=lambda item: (-item[1], item[0]))
+
+    best_entry, best_score = None, 0.0
+    for doc_id, _ in candidates:
+        confidence = match_confidence(index, query, doc_id)
+        if confidence > best_score:
+            best_entry, best_score = index.entries[doc_id], confidence
+
+    best_score = round(best_score, 4)
+    route = ROUTE_DIRECT if best_entry is not None and best_score >= get_threshold() else ROUTE_LLM
+    metrics.incr(f'route_{route}')
+    logger.info(f"Routed to {route} (confidence {best_score})")
+    return {'route': route, 'score': best_score, 'entry': best_entry}
+
+
+def format_direct_answer(qa):
+    return DIRECT_ANSWER_TEMPLATE.format(category_display=qa['category_display'], answer=qa['answer'])
+
+
+def get_routing_stats():
+    """
+    How many messages were answered directly vs sent to the LLM
+    """
+    stats = metrics.get_counters([f'route_{ROUTE_DIRECT}', f'route_{ROUTE_LLM}'])
+    total = sum(stats.values())
+    stats['direct_rate'] = round(stats[f'route_{ROUTE_DIRECT}'] / total, 4) if total else 0.0
+    stats['threshold'] = get_threshold()
+    return stats
\ No newline at end of file
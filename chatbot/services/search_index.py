@@ -0,0 +1,215 @@
+"""
+Inverted index with BM25F scoring over the knowledge base
+Built once per KB version and shared by the keyword fallback and retrieval
+"""
+import heapq
+import math
+import re
+from chatbot.services.knowledge_cache import get_knowledge_snapshot
+from chatbot.services.spelling import SpellingIndex
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+STOP_WORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'been', 'but', 'by', 'can', 'do',
+    'does', 'did', 'for', 'from', 'has', 'have', 'had', 'how', 'i', 'in', 'is',
+    'it', 'me', 'my', 'of', 'on', 'or', 'please', 'so', 'tell', 'the', 'to',
+    'was', 'what', 'when', 'where', 'which', 'who', 'why', 'will', 'with',
+    'you', 'your', 'about',
+    # Every scraped entry is RUGIPO-related, so the school name carries no signal
+    'rugipo', 'rufus', 'giwa', 'polytechnic', 'owo',
+}
+
+# Relative weight of each field (question/keywords/answer = 3/2/1)
+FIELD_WEIGHTS = {'question': 3.0, 'keywords': 2.0, 'answer': 1.0}
+
+# Weight of a spelling correction relative to the term it was made for
+CORRECTION_WEIGHT = 0.5
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def normalize_term(term):
+    """Fold simple English plurals so "fees" matches "fee" """
+    if len(term) > 4 and term.endswith('ies'):
+        return term[:-3] + 'y'
+    if len(term) > 4 and term.endswith('sses'):
+        return term[:-2]
+    if len(term) > 3 and term.endswith('s') and not term.endswith(('ss', 'us', 'is')):
+        return term[:-1]
+    return term
+
+
+def tokenize(text):
+    """
+    Lowercase, plural-folded word tokens without stop words
+    Whole-token matching means "fee" no longer matches "coffee"
+    """
+    return [
+        normalize_term(t)
+        for t in TOKEN_RE.findall((text or '').lower())
+        if t not in STOP_WORDS
+    ]
+
+
+class BM25Index:
+    """
+    Term -> postings index; each posting holds the document's precomputed
+    BM25F contribution, so a query is a sum over the query terms' postings
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.postings = {}
+        # The same postings split by category: {category: {term: postings}}
+        self.partitions = {}
+        self.idf = {}
+        # Distinct question and keyword terms per entry, used to judge how
+        # closely a query matches a curated Q&A
+        self.question_terms = []
+        self.keyword_terms = []
+        self._build()
+
+    def _build(self):
+        n_docs = len(self.entries)
+        field_tfs = []
+        total_len = dict.fromkeys(FIELD_WEIGHTS, 0)
+
+        for qa in self.entries:
+            doc = {}
+            for field in FIELD_WEIGHTS:
+                tokens = tokenize(qa.get(field, ''))
+                counts = {}
+                for token in tokens:
+                    counts[token] = counts.get(token, 0) + 1
+                doc[field] = (counts, len(tokens))
+                total_len[field] += len(tokens)
+            field_tfs.append(doc)
+            self.question_terms.append(frozenset(doc['question'][0]))
+            self.keyword_terms.append(frozenset(doc['keywords'][0]))
+
+        avg_len = {field: (total_len[field] / n_docs) or 1.0 for field in FIELD_WEIGHTS} if n_docs else {}
+
+        # Combined, length-normalised term frequency per (term, doc)
+        weighted_tf = {}
+        for doc_id, doc in enumerate(field_tfs):
+            for field, weight in FIELD_WEIGHTS.items():
+                counts, length = doc[field]
+                norm = 1 - B + B * length / avg_len[field]
+                for term, tf in counts.items():
+                    per_doc = weighted_tf.setdefault(term, {})
+                    per_doc[doc_id] = per_doc.get(doc_id, 0.0) + weight * tf / norm
+
+        for term, per_doc in weighted_tf.items():
+            df = len(per_doc)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            self.idf[term] = idf
+            self.postings[term] = [
+                (doc_id, idf * tf / (K1 + tf))
+                for doc_id, tf in per_doc.items()
+            ]
+            for posting in self.postings[term]:
+                category = self.entries[posting[0]].get('category', '')
+                self.partitions.setdefault(category, {}).setdefault(term, []).append(posting)
+
+    def score(self, query_terms, categories=None):
+        """
+        Score documents for {term: weight}; returns {doc_id: score}
+        Pass categories to only score those partitions (idf stays global, so
+        scores are the same as in a full search)
+        """
+        if categories is None:
+            postings_maps = [self.postings]
+        else:
+            postings_maps = [self.partitions[c] for c in categories if c in self.partitions]
+
+        scores = {}
+        for postings in postings_maps:
+            for term, qweight in query_terms.items():
+                for doc_id, contribution in postings.get(term, ()):
+                    scores[doc_id] = scores.get(doc_id, 0.0) + qweight * contribution
+        return scores
+
+    def term_idf(self, term):
+        """
+        idf of a term; terms that appear in no document get the highest idf
+        """
+        try:
+            return self.idf[term]
+        except KeyError:
+            return math.log(1 + (len(self.entries) + 0.5) / 0.5)
+
+    def search(self, query_terms, limit=None, categories=None):
+        """
+        Return (score, entry) pairs best first; ties keep knowledge base order
+        """
+        items = self.score(query_terms, categories).items()
+        key = lambda item: (-item[1], item[0])
+        if limit is not None:
+            ranked = heapq.nsmallest(limit, items, key=key)
+        else:
+            ranked = sorted(items, key=key)
+        return [(score, self.entries[doc_id]) for doc_id, score in ranked]
+
+
+def routed_search(query_terms, limit=None, snapshot=None):
+    """
+    Search only the categories the query is routed to, falling back to the
+    whole index if the router isn't confident or those categories have no match
+    """
+    from chatbot.services.category_router import route_categories
+
+    index = get_search_index(snapshot)
+    categories = route_categories(query_terms, snapshot)
+    if categories is not None:
+        results = index.search(query_terms, limit, categories)
+        if results:
+            return results
+    return index.search(query_terms, limit)
+
+
+def get_search_index(snapshot=None):
+    """
+    BM25 index for the current knowledge base version
+    """
+    snapshot = snapshot or get_knowledge_snapshot()
+    return snapshot.derived('bm25_index', lambda snap: BM25Index(snap.entries))
+
+
+def get_spelling_index(snapshot=None):
+    """
+    Typo-tolerant lookup over the BM25 vocabulary for the current KB version
+    Weighted by document frequency so common terms win ties
+    """
+    snapshot = snapshot or get_knowledge_snapshot()
+    return snapshot.derived(
+        'spelling_index',
+        lambda snap: SpellingIndex({
+            term: len(postings) for term, postings in get_search_index(snap).postings.items()
+        })
+    )
+
+
+def expand_query(text, snapshot=None):
+    """
+    (term, correction) pairs for tokenize(text): terms missing from the
+    knowledge base vocabulary come with the closest known term, if any
+    """
+    return get_spelling_index(snapshot).expand_terms(tokenize(text))
+
+
+def weighted_query_terms(text, weight=1.0, snapshot=None):
+    """
+    {term: weight} for a text; spelling corrections are added next to the
+    original terms at CORRECTION_WEIGHT of the weight
+    """
+    expanded = expand_query(text, snapshot)
+    terms = {}
+    for term, _ in expanded:
+        terms[term] = weight
+    for _, correction in expanded:
+        if correction is not None and correction not in terms:
+            terms[correction] = weight * CORRECTION_WEIGHT
+    return terms
\ No newline at end of file
@@ -0,0 +1,98 @@
+"""
+Single-flight request coalescing
+Concurrent calls with the same key share one execution; every caller gets
+the leader's result (or its exception)
+"""
+import asyncio
+import threading
+from chatbot.services import metrics
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Per-process coalescing for threaded (WSGI) and async (ASGI) callers
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+
+    def do(self, key, fn):
+        """
+        Run fn() unless a call for key is already in flight, in which case
+        wait for it and return its result
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.incr(f'{self.name}_coalesced')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def ado(self, key, fn):
+        """
+        Async version of do(); fn is a coroutine function
+        Calls are only shared within the same event loop
+        """
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), key)
+        future = self._async_calls.get(flight_key)
+        if future is not None:
+            metrics.incr(f'{self.name}_coalesced')
+            return await asyncio.shield(future)
+
+        future = loop.create_future()
+        self._async_calls[flight_key] = future
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            # Waiters should not be cancelled along with the leader
+            future.set_exception(RuntimeError('Coalesced call was cancelled'))
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else is waiting
+            future.exception()
+            raise
+        finally:
+            del self._async_calls[flight_key]
+
+    def stats(self):
+        """
+        Calls currently in flight in this process and callers coalesced so far
+        """
+        with self._lock:
+            in_flight = len(self._calls) + len(self._async_calls)
+        return {
+            'in_flight': in_flight,
+            'coalesced': metrics.get_counters([f'{self.name}_coalesced'])[f'{self.name}_coalesced'],
+        }
@@ -0,0 +1,137 @@
+"""
+Typo-tolerant term lookup with a symmetric-delete dictionary
+Every vocabulary term is stored under each string obtained by deleting up to
+MAX_DISTANCE characters from it; a misspelled query term is then corrected by
+generating its own deletes and looking them up, instead of computing the edit
+distance to every word in the knowledge base
+"""
+
+# Largest edit distance corrected (terms up to SHORT_TERM_LENGTH get 1, as
+# two edits turn most short words into some other real word)
+MAX_DISTANCE = 2
+SHORT_TERM_LENGTH = 5
+
+# Terms shorter than this are never corrected
+MIN_TERM_LENGTH = 3
+
+# Deletes are generated from this many leading characters only, which bounds
+# the dictionary size for long words without missing corrections
+PREFIX_LENGTH = 7
+
+# Corrections remembered per index
+MAX_MEMO_ENTRIES = 10000
+
+
+def _deletes(word, max_distance):
+    """
+    Every string obtained by deleting 1..max_distance characters from word
+    """
+    results = set()
+    frontier = {word}
+    for _ in range(max_distance):
+        next_frontier = set()
+        for candidate in frontier:
+            if len(candidate) <= 1:
+                continue
+            for i in range(len(candidate)):
+                next_frontier.add(candidate[:i] + candidate[i + 1:])
+        next_frontier -= results
+        results |= next_frontier
+        frontier = next_frontier
+    return results
+
+
+def edit_distance(a, b, max_distance):
+    """
+    Damerau-Levenshtein distance (optimal string alignment) between a and b,
+    or max_distance + 1 if it is larger than max_distance
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+    return previous[-1] if previous[-1] <= max_distance else max_distance + 1
+
+
+def max_distance_for(term):
+    return 1 if len(term) <= SHORT_TERM_LENGTH else MAX_DISTANCE
+
+
+class SpellingIndex:
+    """
+    Symmetric-delete dictionary over a {term: frequency} vocabulary
+    """
+
+    def __init__(self, vocabulary):
+        self.vocabulary = vocabulary
+        self.deletes = {}
+        self._memo = {}
+        for term in vocabulary:
+            if len(term) < MIN_TERM_LENGTH or term.isdigit():
+                continue
+            prefix = term[:PREFIX_LENGTH]
+            self.deletes.setdefault(prefix, []).append(term)
+            for deleted in _deletes(prefix, max_distance_for(term)):
+                self.deletes.setdefault(deleted, []).append(term)
+
+    def correct(self, term):
+        """
+        Closest vocabulary term, the term itself if it is known, or None if
+        nothing is close enough
+        Only candidates starting with the same letter are considered (people
+        rarely mistype the first letter); fewer edits win, then more frequent terms
+        """
+        if term in self.vocabulary:
+            return term
+        if len(term) < MIN_TERM_LENGTH or term.isdigit():
+            return None
+        try:
+            return self._memo[term]
+        except KeyError:
+            pass
+
+        max_distance = max_distance_for(term)
+        prefix = term[:PREFIX_LENGTH]
+        candidates = set()
+        for key in _deletes(prefix, max_distance) | {prefix}:
+            candidates.update(self.deletes.get(key, ()))
+
+        best = None
+        best_key = None
+        for candidate in candidates:
+            if candidate[0] != term[0]:
+                continue
+            distance = edit_distance(term, candidate, min(max_distance, max_distance_for(candidate)))
+            if distance > max_distance:
+                continue
+            key = (distance, -self.vocabulary[candidate], candidate)
+            if best_key is None or key < best_key:
+                best, best_key = candidate, key
+
+        if len(self._memo) >= MAX_MEMO_ENTRIES:
+            self._memo.clear()
+        self._memo[term] = best
+        return best
+
+    def expand_terms(self, terms):
+        """
+        (term, correction) for each term; correction is None for known terms
+        and unknown ones without a close match
+        Unknown terms are kept, since they may well be spelled correctly
+        """
+        expanded = []
+        for term in terms:
+            correction = self.correct(term)
+            expanded.append((term, correction if correction != term else None))
+        return expanded
\ No newline at end of file
@@ -0,0 +1,177 @@
+"""
+Rolling per-session conversation summaries
+Once CHATBOT_SUMMARY_KEEP_RECENT + CHATBOT_SUMMARY_EVERY messages have piled up
+since the last summary, the older ones are folded into ChatSession.summary by a
+background worker; prompts carry the summary plus only the newer messages, so
+their size stays constant however long the conversation gets
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connections
+from chatbot.models import ChatSession, ChatMessage
+from chatbot.services import metrics
+from chatbot.services.llm_backends import get_llm_backend, is_backend_configured
+from chatbot.services.openai_service import openai_breaker, record_usage
+from chatbot.services.token_budget import count_tokens, truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_INSTRUCTIONS = """You keep a running summary of a conversation between a student and the Rufus Giwa Polytechnic (RUGIPO) support assistant.
+Update the summary with the new messages. Keep what the student told you about themselves (name, department, level), what they asked and the key facts they were given.
+Reply with the updated summary only, in a few short sentences."""
+
+# Longest excerpt of one message given to the summarizer
+MESSAGE_EXCERPT_TOKENS = 200
+
+_lock = threading.Lock()
+_executor = None
+_pending = set()
+
+
+def get_summary_settings():
+    return {
+        'every': getattr(settings, 'CHATBOT_SUMMARY_EVERY', 6),
+        'keep_recent': getattr(settings, 'CHATBOT_SUMMARY_KEEP_RECENT', 4),
+        'max_tokens': getattr(settings, 'CHATBOT_SUMMARY_TOKEN_LIMIT', 250),
+    }
+
+
+def history_limit():
+    """
+    Most unsummarized messages sent with a prompt; reaching it triggers a summary
+    """
+    config = get_summary_settings()
+    return config['keep_recent'] + config['every']
+
+
+def to_history(session, messages):
+    """
+    Session summary plus messages (oldest first, as message_type/content
+    dicts) in OpenAI message format
+    """
+    history = []
+    if session.summary:
+        history.append({
+            'role': 'system',
+            'content': f"Summary of the earlier conversation:\n{session.summary}"
+        })
+    history.extend(
+        {
+            'role': 'assistant' if msg['message_type'] == 'bot' else 'user',
+            'content': msg['content']
+        }
+        for msg in messages
+    )
+    return history
+
+
+def _transcript(messages):
+    return "\n".join(
+        f"{'Assistant' if msg['message_type'] == 'bot' else 'Student'}: "
+        f"{truncate_to_tokens(msg['content'], MESSAGE_EXCERPT_TOKENS)}"
+        for msg in messages
+    )
+
+
+def extractive_summary(previous, messages, max_tokens):
+    """
+    Summary without the LLM: the student's questions, most recent kept
+    """
+    lines = previous.splitlines() if previous else []
+    lines.extend(
+        f"- Student asked: {truncate_to_tokens(msg['content'], 40)}"
+        for msg in messages
+        if msg['message_type'] == 'user'
+    )
+    while len(lines) > 1 and count_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return truncate_to_tokens("\n".join(lines), max_tokens)
+
+
+def summarize(previous, messages, max_tokens):
+    """
+    Fold messages into the previous summary, using the LLM when it is available
+    """
+    if is_backend_configured():
+        prompt = [
+            {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+            {"role": "user", "content": (
+                f"Current summary:\n{previous or '(none)'}\n\nNew messages:\n{_transcript(messages)}"
+            )},
+        ]
+        try:
+            result = openai_breaker.call(lambda: get_llm_backend().complete(prompt))
+            record_usage(result['usage'])
+            if result['content']:
+                return truncate_to_tokens(result['content'].strip(), max_tokens)
+        except Exception as e:
+            metrics.incr('summary_llm_failures')
+            logger.warning(f"Summarizing with the LLM failed, using extractive summary: {str(e)}")
+    return extractive_summary(previous, messages, max_tokens)
+
+
+def update_summary(session_pk):
+    """
+    Fold everything but the most recent messages into the session summary
+    Returns True if the summary changed
+    """
+    config = get_summary_settings()
+    session = ChatSession.objects.only('summary', 'summary_until').get(pk=session_pk)
+    messages = list(
+        ChatMessage.objects.filter(session_id=session_pk, id__gt=session.summary_until)
+        .order_by('id')
+        .values('id', 'message_type', 'content')
+    )
+    to_fold = messages[:len(messages) - config['keep_recent']] if config['keep_recent'] else messages
+    if not to_fold:
+        return False
+
+    summary = summarize(session.summary, to_fold, config['max_tokens'])
+    # Conditional on the watermark so a concurrent update is never overwritten
+    updated = ChatSession.objects.filter(pk=session_pk, summary_until=session.summary_until).update(
+        summary=summary,
+        summary_until=to_fold[-1]['id'],
+    )
+    if updated:
+        metrics.incr('summary_updates')
+    return bool(updated)
+
+
+def _run_update(session_pk):
+    try:
+        update_summary(session_pk)
+    except Exception as e:
+        logger.error(f"Error updating conversation summary: {str(e)}")
+    finally:
+        with _lock:
+            _pending.discard(session_pk)
+        connections.close_all()
+
+
+def schedule_summary(session_pk):
+    """
+    Update the session summary off the request path (at most one pending update
+    per session); runs inline when CHATBOT_SUMMARY_IN_BACKGROUND is off
+    """
+    global _executor
+
+    if not getattr(settings, 'CHATBOT_SUMMARY_IN_BACKGROUND', True):
+        update_summary(session_pk)
+        return
+
+    with _lock:
+        if session_pk in _pending:
+            return
+        _pending.add(session_pk)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chat-summary')
+    _executor.submit(_run_update, session_pk)
+
+
+def get_summary_stats():
+    stats = metrics.get_counters(['summary_updates', 'summary_llm_failures'])
+    with _lock:
+        stats['pending'] = len(_pending)
+    return stats
\ No newline at end of file
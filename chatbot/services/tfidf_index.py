@@ -0,0 +1,203 @@
+"""
+Local TF-IDF similarity index persisted as NumPy arrays
+Built offline by the build_tfidf_index management command and loaded with
+mmap_mode so every worker shares the same pages
+Each build goes into a directory of its own and is switched to by atomically
+replacing a pointer file, so a worker never loads half of a rebuild
+"""
+import json
+import logging
+import math
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+import numpy as np
+from django.conf import settings
+from chatbot.services.search_index import FIELD_WEIGHTS, tokenize
+
+logger = logging.getLogger(__name__)
+
+# Column-major (term -> documents) sparse matrix, rows are L2-normalised
+ARRAY_FILES = {
+    'indptr': 'tfidf_indptr.npy',
+    'rows': 'tfidf_rows.npy',
+    'data': 'tfidf_data.npy',
+    'idf': 'tfidf_idf.npy',
+    'ids': 'tfidf_ids.npy',
+}
+VOCAB_FILE = 'tfidf_vocab.json'
+# Names the directory of the current build
+POINTER_FILE = 'tfidf_current'
+VERSION_PREFIX = 'tfidf_'
+
+_lock = threading.Lock()
+_loaded = None
+_loaded_version = None
+
+
+def get_index_dir():
+    return Path(getattr(settings, 'TFIDF_INDEX_DIR', Path(settings.BASE_DIR) / 'data'))
+
+
+def get_current_version(index_dir=None):
+    """
+    Directory name of the current build, or None if there is none
+    """
+    index_dir = Path(index_dir or get_index_dir())
+    try:
+        with open(index_dir / POINTER_FILE, 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _weighted_counts(qa):
+    counts = {}
+    for field, weight in FIELD_WEIGHTS.items():
+        for term in tokenize(qa.get(field, '')):
+            counts[term] = counts.get(term, 0.0) + weight
+    return counts
+
+
+def build_tfidf_index(entries, index_dir=None):
+    """
+    Build the TF-IDF matrix for entries (dicts with id/question/answer/keywords)
+    and save it as .npy files in a new version directory, then make that
+    version current; returns (documents, terms)
+    """
+    index_dir = Path(index_dir or get_index_dir())
+    index_dir.mkdir(parents=True, exist_ok=True)
+
+    doc_counts = [_weighted_counts(qa) for qa in entries]
+    n_docs = len(doc_counts)
+
+    vocab = {}
+    for counts in doc_counts:
+        for term in counts:
+            if term not in vocab:
+                vocab[term] = len(vocab)
+
+    df = np.zeros(len(vocab), dtype=np.float64)
+    for counts in doc_counts:
+        for term in counts:
+            df[vocab[term]] += 1
+    idf = np.log((1 + n_docs) / (1 + df)) + 1
+
+    # Sublinear tf * idf, normalised per document
+    postings = [[] for _ in range(len(vocab))]
+    for doc_id, counts in enumerate(doc_counts):
+        weights = {vocab[t]: (1 + math.log(c)) * idf[vocab[t]] for t, c in counts.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        for term_id, w in weights.items():
+            postings[term_id].append((doc_id, w / norm))
+
+    indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+    for term_id, plist in enumerate(postings):
+        indptr[term_id + 1] = indptr[term_id] + len(plist)
+    rows = np.fromiter((d for plist in postings for d, _ in plist), dtype=np.int32, count=indptr[-1])
+    data = np.fromiter((w for plist in postings for _, w in plist), dtype=np.float32, count=indptr[-1])
+    ids = np.array([qa['id'] for qa in entries], dtype=np.int64)
+
+    arrays = {'indptr': indptr, 'rows': rows, 'data': data, 'idf': idf.astype(np.float32), 'ids': ids}
+    version = f"{VERSION_PREFIX}{time.strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}"
+    version_dir = index_dir / version
+    version_dir.mkdir()
+    for name, filename in ARRAY_FILES.items():
+        np.save(version_dir / filename, arrays[name])
+    with open(version_dir / VOCAB_FILE, 'w', encoding='utf-8') as f:
+        json.dump(vocab, f, ensure_ascii=False)
+
+    previous = get_current_version(index_dir)
+    tmp_path = index_dir / (POINTER_FILE + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(tmp_path, index_dir / POINTER_FILE)
+    _remove_old_versions(index_dir, keep={version, previous})
+
+    return n_docs, len(vocab)
+
+
+def _remove_old_versions(index_dir, keep):
+    """
+    Delete builds older than the previous one (which workers that have not
+    reloaded yet may still be reading)
+    """
+    for path in index_dir.glob(VERSION_PREFIX + '*'):
+        if path.is_dir() and path.name not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class TfidfIndex:
+    """
+    Memory-mapped TF-IDF index; scoring is a single vectorized pass over the
+    postings of the query terms
+    """
+
+    def __init__(self, index_dir):
+        with open(index_dir / VOCAB_FILE, 'r', encoding='utf-8') as f:
+            self.vocab = json.load(f)
+        for name, filename in ARRAY_FILES.items():
+            setattr(self, name, np.load(index_dir / filename, mmap_mode='r'))
+        self.n_docs = len(self.ids)
+
+    def score(self, query_terms):
+        """
+        Cosine similarity of every document with {term: weight}
+        """
+        term_ids = [self.vocab[t] for t in query_terms if t in self.vocab]
+        if not term_ids or not self.n_docs:
+            return np.zeros(self.n_docs, dtype=np.float32)
+
+        qweights = np.array(
+            [query_terms[t] for t in query_terms if t in self.vocab], dtype=np.float32
+        ) * self.idf[term_ids]
+        qweights /= np.linalg.norm(qweights) or 1.0
+
+        starts = self.indptr[term_ids]
+        ends = self.indptr[np.array(term_ids) + 1]
+        rows = np.concatenate([self.rows[s:e] for s, e in zip(starts, ends)])
+        contributions = np.concatenate([
+            self.data[s:e] * w for s, e, w in zip(starts, ends, qweights)
+        ])
+        return np.bincount(rows, weights=contributions, minlength=self.n_docs)
+
+    def search(self, query_terms, limit=10):
+        """
+        Return (score, knowledge id) pairs best first
+        """
+        scores = self.score(query_terms)
+        matched = np.flatnonzero(scores > 0)
+        if limit is not None and len(matched) > limit:
+            matched = matched[np.argpartition(-scores[matched], limit - 1)[:limit]]
+        order = matched[np.lexsort((matched, -scores[matched]))]
+        return [(float(scores[i]), int(self.ids[i])) for i in order]
+
+
+def get_tfidf_index():
+    """
+    The shared TF-IDF index, reloaded when a rebuild switches the current version
+    Returns None if the index has not been built
+    """
+    global _loaded, _loaded_version
+
+    index_dir = get_index_dir()
+    version = get_current_version(index_dir)
+    if version is None:
+        return None
+
+    if _loaded is not None and version == _loaded_version:
+        return _loaded
+
+    with _lock:
+        if _loaded is None or version != _loaded_version:
+            try:
+                _loaded = TfidfIndex(index_dir / version)
+                _loaded_version = version
+                logger.info(f"TF-IDF index loaded: {_loaded.n_docs} documents, {len(_loaded.vocab)} terms")
+            except (OSError, ValueError) as e:
+                logger.error(f"Error loading TF-IDF index: {str(e)}")
+                return None
+        return _loaded
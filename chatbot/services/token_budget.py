@@ -0,0 +1,95 @@
+"""
+Token accounting for chat prompts
+Uses an offline estimator calibrated for OpenAI's BPE tokenizers on English
+text, so prompt size can be bounded without a network call or extra package
+"""
+import re
+from django.conf import settings
+
+# Word pieces and individual punctuation marks
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+
+# Average characters per token inside long words
+CHARS_PER_TOKEN = 4
+
+# Chat format overhead: tokens per message and for priming the reply
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+
+TRUNCATION_MARKER = ' …'
+
+
+def count_tokens(text):
+    """
+    Estimate the number of tokens in text
+    Common words are one token; long words and numbers split every few characters
+    """
+    tokens = 0
+    for piece in _PIECE_RE.findall(text or ''):
+        tokens += 1 + (len(piece) - 1) // CHARS_PER_TOKEN if len(piece) > CHARS_PER_TOKEN + 2 else 1
+    return tokens
+
+
+def count_message_tokens(message):
+    return MESSAGE_OVERHEAD + count_tokens(message['content'])
+
+
+def count_messages_tokens(messages):
+    """
+    Estimated prompt tokens for a list of chat messages
+    """
+    return sum(count_message_tokens(m) for m in messages) + REPLY_OVERHEAD
+
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    Deterministically cut text to at most max_tokens, keeping the beginning
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    limit = max(max_tokens - count_tokens(TRUNCATION_MARKER), 0)
+    used = 0
+    end = 0
+    for match in _PIECE_RE.finditer(text):
+        piece = match.group()
+        cost = 1 + (len(piece) - 1) // CHARS_PER_TOKEN if len(piece) > CHARS_PER_TOKEN + 2 else 1
+        if used + cost > limit:
+            break
+        used += cost
+        end = match.end()
+    return text[:end] + TRUNCATION_MARKER
+
+
+def trim_history(conversation_history, max_tokens):
+    """
+    Keep the most recent messages that fit in max_tokens (oldest first)
+    A newest message that alone exceeds the budget is truncated instead of dropped
+    Returns (messages, tokens used)
+    """
+    kept = []
+    used = 0
+    for msg in reversed(conversation_history or []):
+        cost = count_message_tokens(msg)
+        if used + cost > max_tokens:
+            if not kept and max_tokens > MESSAGE_OVERHEAD:
+                content = truncate_to_tokens(msg['content'], max_tokens - MESSAGE_OVERHEAD)
+                kept.append({'role': msg['role'], 'content': content})
+                used += count_message_tokens(kept[-1])
+            break
+        kept.append(msg)
+        used += cost
+    kept.reverse()
+    return kept, used
+
+
+def get_budget():
+    """
+    Configured token limits for each part of the prompt
+    """
+    return {
+        'total': getattr(settings, 'CHATBOT_PROMPT_TOKEN_BUDGET', 3500),
+        'context': getattr(settings, 'CHATBOT_CONTEXT_TOKEN_BUDGET', 1500),
+        'history': getattr(settings, 'CHATBOT_HISTORY_TOKEN_BUDGET', 1000),
+        'user_message': getattr(settings, 'CHATBOT_USER_MESSAGE_TOKEN_LIMIT', 500),
+    }
@@ -1,3 +1,1404 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import ThreadingHTTPServer
+from unittest import mock
+import httpx
+import openai
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from chatbot.models import ChatSession, ChatMessage, ChatDailyStats
+from chatbot.services import metrics
+from chatbot.services.analytics import update_daily_stats
+from chatbot.services.answer_cache import get_answer_cache_stats, make_cache_key, reset_answer_cache_stats
+from chatbot.services.knowledge_cache import (
+    KnowledgeSnapshot, clear_knowledge_cache, get_knowledge_snapshot, get_knowledge_version,
+)
+from chatbot.management.commands.run_llm_stub import StubHandler
+from chatbot.services.llm_backends import OpenAIBackend, StubBackend, create_backend, reset_llm_backend
+from chatbot.services.category_router import CategoryRouter, get_category_router, route_categories
+from chatbot.services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from chatbot.services.openai_service import (
+    aget_chatbot_reply, build_messages, fallback_keyword_search, get_chatbot_reply, get_prompt_cache_stats,
+    get_system_prompt_prefix,
+)
+from chatbot.services.retrieval import (
+    HISTORY_WEIGHT, build_query_terms, format_knowledge_entry, retrieve_relevant_knowledge, uses_database,
+)
+from chatbot.services.routing import ROUTE_DIRECT, ROUTE_LLM, route_question
+from chatbot.services.search_index import (
+    CORRECTION_WEIGHT, get_search_index, routed_search, tokenize, weighted_query_terms,
+)
+from chatbot.services.spelling import SpellingIndex
+from chatbot.services.summaries import extractive_summary, update_summary
+from chatbot.services.tfidf_index import build_tfidf_index, get_current_version, get_tfidf_index
+from chatbot.services.token_budget import (
+    MESSAGE_OVERHEAD, TRUNCATION_MARKER, count_message_tokens, count_tokens, trim_history, truncate_to_tokens,
+)
+from chatbot.services.message_writer import get_message_writer, stop_message_writer
+from chatbot.services.singleflight import SingleFlight
+from knowledge import fulltext
+from knowledge.models import RUGIPOKnowledge
+from knowledge.utils import write_json_if_changed
 
-# Create your tests here.
+
+def fake_reply(user_message, conversation_history=None):
+    return {'content': f"Answer to: {user_message}", 'route': 'llm', 'score': 0.5}
+
+
+# A small fixed knowledge base, so tests don't depend on the exported data/*.json
+TEST_KNOWLEDGE = [
+    {'id': 1, 'category': 'fees', 'category_display': 'Fees & Payments',
+     'question': 'How do I pay the school fees?', 'answer': 'School fees are paid online through the portal.',
+     'keywords': 'fees, payment, portal'},
+    {'id': 2, 'category': 'fees', 'category_display': 'Fees & Payments',
+     'question': 'How much is the acceptance fee?', 'answer': 'The acceptance fee is paid once, after admission.',
+     'keywords': 'acceptance fee'},
+    {'id': 3, 'category': 'admissions', 'category_display': 'Admissions & Registration',
+     'question': 'What are the admission requirements?', 'answer': 'Five credits including English and Mathematics.',
+     'keywords': 'admission, requirements, credits'},
+    {'id': 4, 'category': 'admissions', 'category_display': 'Admissions & Registration',
+     'question': 'When does registration close?', 'answer': 'Registration closes six weeks into the semester.',
+     'keywords': 'registration, deadline'},
+    {'id': 5, 'category': 'hostel', 'category_display': 'Hostel & Accommodation',
+     'question': 'Where is the hostel?', 'answer': 'The hostel is behind the library.',
+     'keywords': 'hostel, accommodation'},
+    {'id': 6, 'category': 'hostel', 'category_display': 'Hostel & Accommodation',
+     'question': 'How do I apply for a hostel room?', 'answer': 'Apply at the student affairs office.',
+     'keywords': 'hostel, room, apply'},
+]
+
+
+def use_knowledge(test, entries=TEST_KNOWLEDGE, version='test'):
+    """
+    Serve a fixed knowledge base to every module that reads it, for the rest of the test
+    """
+    snapshot = KnowledgeSnapshot(version, entries)
+    for module in ('search_index', 'category_router', 'retrieval', 'openai_service'):
+        patcher = mock.patch(f'chatbot.services.{module}.get_knowledge_snapshot', return_value=snapshot)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+    return snapshot
+
+
+@mock.patch('chatbot.views.get_chatbot_reply', side_effect=fake_reply)
+class SendMessageQueriesTest(TestCase):
+    """
+    send_message persistence: history read (from the history cache when it
+    is warm), one bulk INSERT for both messages and one UPDATE of the
+    session, inside a single transaction
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def post(self, message, session_id=''):
+        return self.client.post(
+            '/chat/send-message/',
+            json.dumps({'message': message, 'session_id': session_id}),
+            content_type='application/json'
+        )
+
+    def test_new_session_queries(self, reply):
+        # Session INSERT and message INSERT, inside a savepoint
+        with self.assertNumQueries(4):
+            response = self.post('Hello')
+
+        self.assertTrue(response.json()['success'])
+        session = ChatSession.objects.get()
+        self.assertEqual(
+            list(session.messages.values_list('message_type', 'content')),
+            [('user', 'Hello'), ('bot', 'Answer to: Hello')]
+        )
+
+    def test_existing_session_queries(self, reply):
+        session_id = self.post('Hello').json()['session_id']
+        before = ChatSession.objects.get().last_activity
+
+        # Session SELECT (history comes from the cache), then session UPDATE
+        # and message INSERT inside a savepoint
+        with self.assertNumQueries(5):
+            response = self.post('And fees?', session_id)
+
+        self.assertEqual(response.json()['session_id'], session_id)
+        self.assertGreater(ChatSession.objects.get().last_activity, before)
+        self.assertEqual(ChatMessage.objects.count(), 4)
+        reply.assert_called_with('And fees?', [
+            {'role': 'user', 'content': 'Hello'},
+            {'role': 'assistant', 'content': 'Answer to: Hello'},
+        ])
+
+    @override_settings(CHATBOT_HISTORY_CACHE_TTL=0)
+    def test_history_cache_miss_reads_database(self, reply):
+        session_id = self.post('Hello').json()['session_id']
+
+        # Plus the history SELECT
+        with self.assertNumQueries(6):
+            self.post('And fees?', session_id)
+        reply.assert_called_with('And fees?', [
+            {'role': 'user', 'content': 'Hello'},
+            {'role': 'assistant', 'content': 'Answer to: Hello'},
+        ])
+
+    def test_stale_history_cache_is_ignored(self, reply):
+        session_id = self.post('Hello').json()['session_id']
+        # Another worker saved an exchange the cache hasn't seen
+        session = ChatSession.objects.get()
+        ChatMessage.objects.create(session=session, message_type='user', content='From another tab')
+        ChatSession.objects.update(last_activity=timezone.now())
+
+        self.post('And fees?', session_id)
+        self.assertEqual(reply.call_args.args[1][-1], {'role': 'user', 'content': 'From another tab'})
+
+    def test_user_message_keeps_received_time(self, reply):
+        self.post('Hello')
+        user, bot = ChatMessage.objects.order_by('created_at')
+        self.assertEqual((user.message_type, bot.message_type), ('user', 'bot'))
+        self.assertLess(user.created_at, bot.created_at)
+
+@mock.patch('chatbot.views.get_chatbot_reply', side_effect=fake_reply)
+@override_settings(CHATBOT_WRITE_BEHIND=True, CHATBOT_WRITE_BEHIND_MAX_DELAY=60, CHATBOT_HISTORY_CACHE_TTL=0)
+class WriteBehindTest(TestCase):
+    """
+    Queued messages are saved on flush and visible to history reads before
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(stop_message_writer)
+
+    def post(self, message, session_id=''):
+        return self.client.post(
+            '/chat/send-message/',
+            json.dumps({'message': message, 'session_id': session_id}),
+            content_type='application/json'
+        ).json()
+
+    def test_pending_messages_are_read_and_flushed(self, reply):
+        first = self.post('Hello')
+        self.assertFalse(ChatMessage.objects.exists())
+
+        self.post('And fees?', first['session_id'])
+        reply.assert_called_with('And fees?', [
+            {'role': 'user', 'content': 'Hello'},
+            {'role': 'assistant', 'content': 'Answer to: Hello'},
+        ])
+
+        history = self.client.get('/chat/get-history/', {'session_id': first['session_id']}).json()
+        self.assertEqual(
+            [m['content'] for m in history['messages']],
+            ['Hello', 'Answer to: Hello', 'And fees?', 'Answer to: And fees?']
+        )
+        newer = self.client.get('/chat/get-history/', {
+            'session_id': first['session_id'], 'since': first['cursor']
+        }).json()
+        self.assertEqual([m['content'] for m in newer['messages']], ['And fees?', 'Answer to: And fees?'])
+
+        self.assertEqual(get_message_writer().flush(), 4)
+        self.assertEqual(ChatMessage.objects.count(), 4)
+        session = ChatSession.objects.get()
+        self.assertEqual(session.messages.latest('created_at').content, 'Answer to: And fees?')
+
+    @override_settings(CHATBOT_HISTORY_CACHE_TTL=3600, CHATBOT_SUMMARY_IN_BACKGROUND=False)
+    @mock.patch('chatbot.services.summaries.summarize', return_value='Summary')
+    def test_summarized_messages_leave_the_cached_history(self, summarize, reply):
+        session_id = ''
+        with mock.patch('chatbot.services.summaries.update_summary', wraps=update_summary) as update:
+            for turn in range(1, 11):
+                session_id = self.post(f'q{turn}', session_id)['session_id']
+                get_message_writer().flush()
+
+        self.assertEqual(update.call_count, 2)
+        history = reply.call_args.args[1]
+        self.assertEqual(history[0]['content'], 'Summary of the earlier conversation:\nSummary')
+        contents = [msg['content'] for msg in history[1:]]
+        self.assertEqual(contents, ['q7', 'Answer to: q7', 'q8', 'Answer to: q8', 'q9', 'Answer to: q9'])
+
+    def test_full_queue_saves_synchronously(self, reply):
+        with override_settings(CHATBOT_WRITE_BEHIND_QUEUE_SIZE=1):
+            self.post('Hello')
+        self.assertEqual(ChatMessage.objects.count(), 2)
+
+
+class HistoryTest(TestCase):
+    """
+    get_history keyset pagination and conditional GET
+    """
+
+    def setUp(self):
+        self.session = ChatSession.objects.create()
+        start = timezone.now() - timedelta(hours=1)
+        ChatMessage.objects.bulk_create([
+            ChatMessage(
+                session=self.session,
+                message_type='user' if i % 2 == 0 else 'bot',
+                content=f'message {i}',
+                created_at=start + timedelta(seconds=i)
+            )
+            for i in range(5)
+        ])
+
+    def get(self, headers=None, **params):
+        params.setdefault('session_id', str(self.session.session_id))
+        return self.client.get('/chat/get-history/', params, headers=headers)
+
+    def contents(self, response):
+        return [msg['content'] for msg in response.json()['messages']]
+
+    def test_pages_backwards_and_forwards(self):
+        page = self.get(limit=2).json()
+        self.assertEqual([m['content'] for m in page['messages']], ['message 3', 'message 4'])
+        self.assertTrue(page['has_more'])
+
+        older = self.get(limit=2, before=page['before_cursor'])
+        self.assertEqual(self.contents(older), ['message 1', 'message 2'])
+
+        ChatMessage.objects.create(session=self.session, message_type='user', content='message 5')
+        newer = self.get(since=page['since_cursor'])
+        self.assertEqual(self.contents(newer), ['message 5'])
+
+    def test_not_modified_until_activity(self):
+        response = self.get()
+        etag = response['ETag']
+
+        self.assertEqual(self.get(headers={'If-None-Match': etag}).status_code, 304)
+
+        ChatSession.objects.filter(pk=self.session.pk).update(last_activity=timezone.now() + timedelta(seconds=1))
+        self.assertEqual(self.get(headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.get(before='nonsense').status_code, 400)
+
+
+class ArchiveChatHistoryTest(TestCase):
+    """
+    archive_chat_history writes inactive sessions to JSONL and deletes them
+    """
+
+    def test_archives_and_deletes_inactive_sessions(self):
+        old, recent = ChatSession.objects.create(), ChatSession.objects.create()
+        for session in (old, recent):
+            ChatMessage.objects.bulk_create([
+                ChatMessage(session=session, message_type='user', content='Hello'),
+                ChatMessage(
+                    session=session, message_type='bot', content='Hi', route='llm', route_score=0.25,
+                    category='fees', tokens=120, latency_ms=850
+                ),
+            ])
+        ChatSession.objects.filter(pk=old.pk).update(
+            last_activity=timezone.now() - timedelta(days=100), summary='Greetings', summary_until=7
+        )
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            call_command('archive_chat_history', days=90, output_dir=output_dir, batch_size=1, stdout=io.StringIO())
+            [name] = os.listdir(output_dir)
+            with gzip.open(os.path.join(output_dir, name), 'rt') as f:
+                lines = [json.loads(line) for line in f]
+
+        self.assertEqual([line['session_id'] for line in lines], [str(old.session_id)])
+        self.assertEqual([m['content'] for m in lines[0]['messages']], ['Hello', 'Hi'])
+        self.assertEqual((lines[0]['summary'], lines[0]['summary_until']), ('Greetings', 7))
+        bot = lines[0]['messages'][1]
+        self.assertEqual(
+            {key: bot[key] for key in ('route', 'route_score', 'category', 'tokens', 'latency_ms')},
+            {'route': 'llm', 'route_score': 0.25, 'category': 'fees', 'tokens': 120, 'latency_ms': 850}
+        )
+        self.assertEqual(list(ChatSession.objects.all()), [recent])
+        self.assertEqual(ChatMessage.objects.filter(session=recent).count(), 2)
+        self.assertEqual(ChatMessage.objects.count(), 2)
+
+
+class BenchmarkHistoryTest(TestCase):
+    """
+    benchmark_history times the views' queries on its own SQLite file
+    """
+
+    def test_refuses_existing_path(self):
+        with tempfile.NamedTemporaryFile(suffix='.sqlite3') as existing:
+            existing.write(b'data')
+            existing.flush()
+            with self.assertRaises(CommandError):
+                call_command('benchmark_history', path=existing.name, stdout=io.StringIO())
+            with open(existing.name, 'rb') as f:
+                self.assertEqual(f.read(), b'data')
+
+    def test_runs_the_view_queries(self):
+        out = io.StringIO()
+        call_command('benchmark_history', messages=200, sessions=10, lookups=5, stdout=out)
+        self.assertIn('chat_message_session_time_idx', out.getvalue())
+        self.assertIn('history page (get_history)', out.getvalue())
+
+
+class ChatAdminTest(TestCase):
+    """
+    Changelists run a fixed number of queries and search the full-text index
+    """
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    def add_sessions(self, count):
+        for _ in range(count):
+            session = ChatSession.objects.create()
+            ChatMessage.objects.bulk_create([
+                ChatMessage(session=session, message_type='user', content='What are the admission requirements?'),
+                ChatMessage(session=session, message_type='bot', content='You need five credits.'),
+            ])
+
+    def assert_queries_constant(self, url):
+        self.add_sessions(2)
+        with CaptureQueriesContext(connection) as first:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.add_sessions(5)
+        with self.assertNumQueries(len(first)):
+            self.client.get(url)
+
+    def test_session_changelist_queries(self):
+        self.assert_queries_constant('/admin/chatbot/chatsession/')
+
+    def test_message_changelist_queries(self):
+        self.assert_queries_constant('/admin/chatbot/chatmessage/')
+
+    def test_message_search(self):
+        self.assertTrue(fulltext.is_available(ChatMessage))
+        self.add_sessions(1)
+        # Stemmed matches, which an icontains scan would miss
+        for q in ('admiss requirement', 'admissions requiring'):
+            response = self.client.get('/admin/chatbot/chatmessage/', {'q': q})
+            self.assertEqual(
+                [message.content for message in response.context['cl'].result_list],
+                ['What are the admission requirements?']
+            )
+        response = self.client.get('/admin/chatbot/chatmessage/', {'q': 'credits "OR" fees'})
+        self.assertEqual(list(response.context['cl'].result_list), [])
+
+    def test_message_stats_fields_are_read_only(self):
+        self.add_sessions(1)
+        message = ChatMessage.objects.get(message_type='bot')
+        for url in (
+            f'/admin/chatbot/chatmessage/{message.pk}/change/',
+            f'/admin/chatbot/chatsession/{message.session_id}/change/',
+        ):
+            content = self.client.get(url).content.decode()
+            self.assertIn('Latency ms', content)
+            for field in ('category', 'tokens', 'latency_ms'):
+                # No form input (messages-0-tokens in the session's inline)
+                self.assertNotRegex(content, rf'name="[\w-]*{field}"')
+
+
+class ChatStatsTest(TestCase):
+    """
+    Daily stats only read rows past the watermark and count each row once
+    """
+
+    def add_exchange(self, session, when, route='llm', category='fees'):
+        ChatMessage.objects.bulk_create([
+            ChatMessage(session=session, message_type='user', content='Fees?', created_at=when),
+            ChatMessage(
+                session=session, message_type='bot', content='Answer', route=route,
+                category=category, tokens=100, latency_ms=400, created_at=when
+            ),
+        ])
+
+    def test_incremental_rollup(self):
+        when = timezone.now() - timedelta(hours=1)
+        session = ChatSession.objects.create()
+        self.add_exchange(session, when)
+        self.add_exchange(session, when, route='fallback', category='admissions')
+        # Too recent to be counted yet
+        self.add_exchange(session, timezone.now())
+
+        self.assertEqual(update_daily_stats(), {'messages': 4, 'sessions': 0})
+        stats = ChatDailyStats.objects.get()
+        self.assertEqual((stats.messages, stats.questions, stats.fallbacks, stats.tokens), (4, 2, 1, 200))
+        self.assertEqual(stats.avg_latency_ms, 400)
+
+        ChatMessage.objects.filter(created_at__gt=when).update(created_at=when)
+        ChatSession.objects.update(created_at=when)
+        self.add_exchange(session, when, category='fees')
+        self.assertEqual(update_daily_stats(batch_size=3), {'messages': 4, 'sessions': 1})
+        self.assertEqual(update_daily_stats(), {'messages': 0, 'sessions': 0})
+
+        stats.refresh_from_db()
+        self.assertEqual((stats.sessions, stats.messages, stats.fallbacks, stats.tokens), (1, 8, 1, 400))
+        self.assertEqual(stats.top_categories(), [('fees', 3), ('admissions', 1)])
+
+
+class SpellingTest(TestCase):
+    """
+    Typos get a correction added next to them; correctly spelled words that
+    are not in the knowledge base are left alone
+    """
+
+    def setUp(self):
+        self.index = SpellingIndex({
+            'admission': 5, 'requirement': 4, 'hostel': 3, 'fee': 6, 'lift': 1,
+            'must': 2, 'warm': 1, 'hall': 2, 'offer': 2, 'less': 3,
+        })
+
+    def test_typos_are_corrected(self):
+        self.assertEqual(self.index.correct('admision'), 'admission')
+        self.assertEqual(self.index.correct('requirment'), 'requirement')
+        self.assertEqual(self.index.correct('hostle'), 'hostel')
+
+    def test_short_words_allow_one_edit_with_the_same_first_letter(self):
+        for word in ('much', 'want', 'hello', 'coffee', 'fess'):
+            self.assertIsNone(self.index.correct(word), word)
+        self.assertEqual(self.index.correct('fees'), 'fee')
+
+    def test_expand_keeps_the_original_term(self):
+        self.assertEqual(
+            self.index.expand_terms(['admision', 'list', 'fee']),
+            [('admision', 'admission'), ('list', 'lift'), ('fee', None)]
+        )
+
+    def test_knowledge_base_queries(self):
+        use_knowledge(self)
+        terms = weighted_query_terms('admision requirments')
+        self.assertEqual(
+            terms, {'admision': 1.0, 'requirment': 1.0, 'admission': CORRECTION_WEIGHT, 'requirement': CORRECTION_WEIGHT}
+        )
+        [(_, best)] = routed_search(terms, limit=1)
+        self.assertEqual(best['id'], 3)
+        self.assertEqual([qa['id'] for _, qa in routed_search(weighted_query_terms('hostle room'), limit=1)], [6])
+
+        self.assertEqual(weighted_query_terms('admission list'), {'admission': 1.0, 'list': 1.0})
+        self.assertEqual(weighted_query_terms('coffee'), {'coffee': 1.0})
+        self.assertEqual(weighted_query_terms('hello'), {'hello': 1.0})
+        self.assertEqual(routed_search(weighted_query_terms('coffee')), [])
+
+
+def api_status_error(status_code):
+    request = httpx.Request('POST', 'https://api.openai.com/v1/chat/completions')
+    response = httpx.Response(status_code, request=request)
+    return openai.APIStatusError(f"Error code: {status_code}", response=response, body=None)
+
+
+def api_connection_error():
+    return openai.APIConnectionError(request=httpx.Request('POST', 'https://api.openai.com/v1/chat/completions'))
+
+
+class CircuitBreakerTest(TestCase):
+    """
+    The OpenAI circuit breaker opens on upstream failures and recovers through
+    a single half-open trial call
+    """
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('chatbot.services.circuit_breaker.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker('test', failure_threshold=3, cooldown=30)
+
+    def fail(self, error):
+        def call():
+            raise error
+        with self.assertRaises(type(error)):
+            self.breaker.call(call)
+
+    def test_opens_after_threshold_and_recovers(self):
+        self.fail(api_connection_error())
+        self.fail(api_status_error(500))
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.fail(api_status_error(429))
+        self.assertEqual(self.breaker.state, OPEN)
+
+        upstream = mock.Mock(return_value='answer')
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.call(upstream)
+        upstream.assert_not_called()
+
+        self.now += 30
+        self.assertEqual(self.breaker.call(upstream), 'answer')
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertEqual(self.breaker.failures, 0)
+
+    def test_failed_trial_reopens(self):
+        for _ in range(3):
+            self.fail(api_status_error(503))
+        self.now += 30
+        self.fail(api_status_error(503))
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.breaker.status()['retry_in_seconds'], 30)
+
+    def test_single_trial_call_while_half_open(self):
+        for _ in range(3):
+            self.fail(api_connection_error())
+        self.now += 30
+
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        # Other calls are rejected while the trial is in flight
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.breaker.before_call()
+
+    def test_client_errors_are_not_failures(self):
+        for status_code in (400, 401, 404, 422):
+            self.fail(api_status_error(status_code))
+        self.fail(ValueError('bad input'))
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertEqual(self.breaker.failures, 0)
+
+    def test_status_endpoint(self):
+        for _ in range(3):
+            self.fail(api_status_error(500))
+        self.now += 10
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.call(mock.Mock())
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+
+        with mock.patch('chatbot.views.openai_breaker', self.breaker):
+            response = self.client.get('/chat/status/')
+
+        status = response.json()['circuit_breaker']
+        self.assertEqual(status['state'], OPEN)
+        self.assertEqual(status['failures'], 3)
+        self.assertEqual(status['retry_in_seconds'], 20)
+        self.assertEqual(status['rejected_calls'], 1)
+        self.assertEqual(status['last_error'], 'Error code: 500')
+
+
+class SingleFlightTest(TestCase):
+    """
+    Concurrent calls with the same key run once and share the result
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.flight = SingleFlight('test_flight')
+
+    def run_threads(self, fn, n=5):
+        """
+        Start n do() calls, let fn finish once the other n - 1 are waiting
+        Returns each caller's result or exception
+        """
+        release = threading.Event()
+        outcomes = [None] * n
+
+        def leader_fn():
+            release.wait(5)
+            return fn()
+
+        def caller(i):
+            try:
+                outcomes[i] = self.flight.do('key', leader_fn)
+            except Exception as e:
+                outcomes[i] = e
+
+        threads = [threading.Thread(target=caller, args=(i,)) for i in range(n)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while self.flight.stats()['coalesced'] < n - 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        return outcomes
+
+    def test_concurrent_calls_run_once(self):
+        fn = mock.Mock(return_value='answer')
+        self.assertEqual(self.run_threads(fn), ['answer'] * 5)
+        self.assertEqual(fn.call_count, 1)
+        self.assertEqual(self.flight.stats(), {'in_flight': 0, 'coalesced': 4})
+
+    def test_leader_exception_reaches_waiters(self):
+        error = ValueError('upstream failed')
+        outcomes = self.run_threads(mock.Mock(side_effect=error))
+        self.assertEqual(outcomes, [error] * 5)
+        # The next call runs again
+        self.assertEqual(self.flight.do('key', lambda: 'retry'), 'retry')
+
+    async def test_async_calls_run_once(self):
+        release = asyncio.Event()
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await release.wait()
+            return 'answer'
+
+        tasks = [asyncio.create_task(self.flight.ado('key', fn)) for _ in range(5)]
+        await asyncio.sleep(0)
+        release.set()
+        self.assertEqual(await asyncio.gather(*tasks), ['answer'] * 5)
+        self.assertEqual(len(calls), 1)
+
+    async def test_cancelled_leader_does_not_cancel_waiters(self):
+        started = asyncio.Event()
+
+        async def fn():
+            started.set()
+            await asyncio.Event().wait()
+
+        leader = asyncio.create_task(self.flight.ado('key', fn))
+        await started.wait()
+        waiter = asyncio.create_task(self.flight.ado('key', fn))
+        await asyncio.sleep(0)
+        leader.cancel()
+
+        with self.assertRaises(asyncio.CancelledError):
+            await leader
+        with self.assertRaises(RuntimeError):
+            await waiter
+
+        async def retry():
+            return 'retry'
+        self.assertEqual(await self.flight.ado('key', retry), 'retry')
+
+
+def parse_sse(chunks):
+    """
+    (event, data) pairs of a Server-Sent Events stream
+    """
+    events = []
+    for block in b''.join(chunks).decode().split('\n\n'):
+        if block:
+            event, data = block.split('\n')
+            events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+    return events
+
+
+@override_settings(
+    CHATBOT_LLM_BACKEND='stub', CHATBOT_STUB_LATENCY=0, CHATBOT_STUB_TOKENS_PER_SECOND=0,
+    CHATBOT_WRITE_BEHIND=False,
+)
+class StreamMessageTest(TestCase):
+    """
+    stream_message sends the answer as delta events and saves the exchange
+    """
+
+    def setUp(self):
+        cache.clear()
+        reset_llm_backend()
+        self.addCleanup(reset_llm_backend)
+        use_knowledge(self)
+
+    def stream(self, message):
+        return self.client.post(
+            '/chat/stream-message/', json.dumps({'message': message}), content_type='application/json'
+        )
+
+    def test_streams_deltas_then_done(self):
+        response = self.stream('Tell me something unusual')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        events = parse_sse(response.streaming_content)
+        deltas = [data['content'] for event, data in events[:-1]]
+        self.assertEqual({event for event, data in events[:-1]}, {'delta'})
+        self.assertGreater(len(deltas), 1)
+        self.assertEqual(''.join(deltas), '(stub) You asked: Tell me something unusual')
+
+        event, done = events[-1]
+        self.assertEqual(event, 'done')
+        self.assertEqual(done['route'], 'llm')
+        session = ChatSession.objects.get()
+        self.assertEqual(done['session_id'], str(session.session_id))
+        self.assertEqual(
+            list(session.messages.order_by('id').values_list('message_type', 'content', 'route')),
+            [
+                ('user', 'Tell me something unusual', ''),
+                ('bot', '(stub) You asked: Tell me something unusual', 'llm'),
+            ]
+        )
+
+    def test_disconnect_saves_partial_answer(self):
+        response = self.stream('Tell me something unusual')
+        first = next(iter(response.streaming_content))
+        # What the server does when the client goes away
+        response.close()
+
+        self.assertEqual(parse_sse([first]), [('delta', {'content': '(stub) '})])
+        self.assertEqual(
+            list(ChatMessage.objects.order_by('id').values_list('message_type', 'content')),
+            [('user', 'Tell me something unusual'), ('bot', '(stub) ')]
+        )
+
+
+@override_settings(CHATBOT_WRITE_BEHIND=False)
+@mock.patch('chatbot.views.aget_chatbot_reply', new_callable=mock.AsyncMock, side_effect=fake_reply)
+class AsyncViewsTest(TestCase):
+    """
+    The async endpoints behave like the sync ones
+    """
+
+    async def asend(self, message, session_id=''):
+        response = await self.async_client.post(
+            '/chat/async/send-message/',
+            json.dumps({'message': message, 'session_id': session_id}),
+            content_type='application/json'
+        )
+        return response.json()
+
+    async def test_send_message_keeps_the_conversation(self, reply):
+        first = await self.asend('Hello')
+        self.assertTrue(first['success'])
+        self.assertEqual(first['bot_response'], 'Answer to: Hello')
+        self.assertEqual(first['route'], 'llm')
+
+        second = await self.asend('And fees?', first['session_id'])
+        self.assertEqual(second['session_id'], first['session_id'])
+        self.assertEqual(
+            [msg['content'] for msg in reply.call_args.args[1]],
+            ['Hello', 'Answer to: Hello']
+        )
+        self.assertEqual(await ChatMessage.objects.acount(), 4)
+
+    async def test_empty_message(self, reply):
+        response = await self.async_client.post(
+            '/chat/async/send-message/', json.dumps({'message': ' '}), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        reply.assert_not_called()
+
+    async def test_get_history_pages_and_not_modified(self, reply):
+        session_id = (await self.asend('Hello'))['session_id']
+        await self.asend('And fees?', session_id)
+
+        response = await self.async_client.get('/chat/async/get-history/', {'session_id': session_id, 'limit': 2})
+        page = response.json()
+        self.assertEqual([msg['content'] for msg in page['messages']], ['And fees?', 'Answer to: And fees?'])
+        self.assertTrue(page['has_more'])
+
+        older = await self.async_client.get(
+            '/chat/async/get-history/', {'session_id': session_id, 'before': page['before_cursor']}
+        )
+        self.assertEqual([msg['content'] for msg in older.json()['messages']], ['Hello', 'Answer to: Hello'])
+
+        not_modified = await self.async_client.get(
+            '/chat/async/get-history/', {'session_id': session_id, 'limit': 2},
+            headers={'If-None-Match': response['ETag']}
+        )
+        self.assertEqual(not_modified.status_code, 304)
+
+    async def test_get_history_unknown_session(self, reply):
+        response = await self.async_client.get(
+            '/chat/async/get-history/', {'session_id': '00000000-0000-0000-0000-000000000000'}
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(
+    CHATBOT_LLM_BACKEND='stub', CHATBOT_STUB_LATENCY=0, CHATBOT_STUB_TOKENS_PER_SECOND=0,
+    CHATBOT_WRITE_BEHIND=False,
+)
+class RoutingTest(TestCase):
+    """
+    Knowledge base questions are answered directly, anything else by the LLM,
+    and the decision is saved on the bot message
+    """
+
+    def setUp(self):
+        cache.clear()
+        reset_llm_backend()
+        self.addCleanup(reset_llm_backend)
+        use_knowledge(self)
+        self.entry = TEST_KNOWLEDGE[2]
+
+    def test_exact_question_routes_direct(self):
+        decision = route_question(self.entry['question'])
+        self.assertEqual(decision['route'], ROUTE_DIRECT)
+        self.assertEqual(decision['score'], 1.0)
+        self.assertEqual(decision['entry']['id'], self.entry['id'])
+
+    def test_near_match_routes_direct(self):
+        decision = route_question('how do i pay school fees')
+        self.assertEqual((decision['route'], decision['entry']['id']), (ROUTE_DIRECT, 1))
+
+    def test_unrelated_question_routes_to_llm(self):
+        decision = route_question('What is the weather on Mars tomorrow')
+        self.assertEqual(decision['route'], ROUTE_LLM)
+        self.assertEqual(decision['score'], 0.0)
+
+    def test_partial_match_routes_to_llm(self):
+        decision = route_question('How do I pay for the hostel?')
+        self.assertEqual(decision['route'], ROUTE_LLM)
+        self.assertGreater(decision['score'], 0.0)
+
+    def test_route_is_saved_on_the_bot_message(self):
+        exchanges = (
+            (self.entry['question'], ROUTE_DIRECT),
+            ('Where can I buy coffee?', ROUTE_LLM),
+            ('How do I pay for the hostel?', ROUTE_LLM),
+        )
+        for message, route in exchanges:
+            response = self.client.post(
+                '/chat/send-message/', json.dumps({'message': message}), content_type='application/json'
+            ).json()
+            self.assertEqual(response['route'], route)
+            bot = ChatMessage.objects.filter(message_type='bot').latest('id')
+            self.assertEqual((bot.route, bot.route_score), (route, response['route_score']))
+        direct = ChatMessage.objects.filter(message_type='bot', route=ROUTE_DIRECT).get()
+        self.assertIn(self.entry['answer'], direct.content)
+        self.assertEqual(direct.route_score, 1.0)
+
+
+@override_settings(
+    CHATBOT_CATEGORY_ROUTING=True, CHATBOT_CATEGORY_ROUTER_COVERAGE=0.8, CHATBOT_CATEGORY_ROUTER_MAX_CATEGORIES=1,
+)
+class CategoryRouterTest(TestCase):
+    """
+    Retrieval only scores the categories a query is routed to, and searches
+    the whole index when the router isn't confident or finds nothing there
+    """
+
+    def setUp(self):
+        self.snapshot = use_knowledge(self)
+
+    def test_probabilities(self):
+        router = CategoryRouter(TEST_KNOWLEDGE)
+        self.assertEqual(router.categories, ['admissions', 'fees', 'hostel'])
+        probabilities = router.probabilities(weighted_query_terms('registration deadline'))
+        self.assertAlmostEqual(sum(probabilities.values()), 1.0)
+        self.assertEqual(max(probabilities, key=probabilities.get), 'admissions')
+        self.assertIsNone(router.probabilities(weighted_query_terms('coffee')))
+        self.assertIs(get_category_router(), get_category_router(self.snapshot))
+
+    def test_route(self):
+        self.assertEqual(route_categories(weighted_query_terms('registration deadline')), ['admissions'])
+        self.assertEqual(route_categories(weighted_query_terms('pay fees')), ['fees'])
+        # Needs more than CHATBOT_CATEGORY_ROUTER_MAX_CATEGORIES, or no known terms
+        self.assertIsNone(route_categories(weighted_query_terms('hostel fees')))
+        self.assertIsNone(route_categories(weighted_query_terms('coffee')))
+        with override_settings(CHATBOT_CATEGORY_ROUTER_MAX_CATEGORIES=2):
+            self.assertEqual(route_categories(weighted_query_terms('hostel fees')), ['hostel', 'fees'])
+        with override_settings(CHATBOT_CATEGORY_ROUTING=False):
+            self.assertIsNone(route_categories(weighted_query_terms('pay fees')))
+
+    def test_routed_search_scores_only_routed_categories(self):
+        # Entry 2 (fees) mentions admission in its answer
+        terms = weighted_query_terms('admission requirements after')
+        self.assertEqual([qa['id'] for _, qa in routed_search(terms)], [3])
+        with override_settings(CHATBOT_CATEGORY_ROUTING=False):
+            self.assertEqual([qa['id'] for _, qa in routed_search(terms)], [3, 2])
+
+    def test_routed_search_falls_back_to_full_index(self):
+        self.assertIsNone(route_categories(weighted_query_terms('admission')))
+        self.assertEqual([qa['id'] for _, qa in routed_search(weighted_query_terms('admission'))], [3, 2])
+        with mock.patch('chatbot.services.category_router.route_categories', return_value=['hostel']):
+            self.assertEqual([qa['id'] for _, qa in routed_search(weighted_query_terms('acceptance fee'))], [2, 1])
+
+
+@override_settings(CHATBOT_RETRIEVAL_BACKEND='bm25', CHATBOT_CATEGORY_ROUTING=False)
+class RetrievalTest(TestCase):
+    """
+    The prompt gets the top-k ranked entries that fit the token budget, from
+    the configured retrieval backend
+    """
+
+    def setUp(self):
+        use_knowledge(self)
+
+    def ids(self, message, conversation_history=None, **kwargs):
+        return [qa['id'] for qa in retrieve_relevant_knowledge(message, conversation_history, **kwargs)]
+
+    def test_top_k(self):
+        self.assertEqual(self.ids('hostel fees'), [5, 2, 1, 6])
+        self.assertEqual(self.ids('hostel fees', top_k=2), [5, 2])
+        with override_settings(CHATBOT_RETRIEVAL_TOP_K=3):
+            self.assertEqual(self.ids('hostel fees'), [5, 2, 1])
+        self.assertEqual(self.ids('Where can I buy coffee?'), [])
+
+    def test_token_budget(self):
+        cost = {qa['id']: count_tokens(format_knowledge_entry(qa)) + 1 for qa in TEST_KNOWLEDGE}
+        self.assertGreater(cost[2], cost[1])
+        # Entry 2 doesn't fit after entry 5, but the smaller entry 1 still does
+        self.assertEqual(self.ids('hostel fees', token_budget=cost[5] + cost[1]), [5, 1])
+        self.assertEqual(self.ids('hostel fees', token_budget=cost[5] - 1), [])
+
+    def test_history_terms(self):
+        history = [
+            {'role': 'user', 'content': 'Where is the hostel?'},
+            {'role': 'assistant', 'content': 'Pay the acceptance fee'},
+            {'role': 'user', 'content': 'Can I apply?'},
+        ]
+        # Earlier user turns count at HISTORY_WEIGHT, assistant turns not at all
+        self.assertEqual(build_query_terms('How do I apply?', history), {'hostel': HISTORY_WEIGHT, 'apply': 1.0})
+        self.assertEqual(self.ids('How do I apply?'), [6])
+        self.assertEqual(self.ids('How do I apply?', history), [6, 5])
+
+    def test_tfidf_backend(self):
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir)
+        with override_settings(CHATBOT_RETRIEVAL_BACKEND='tfidf', TFIDF_INDEX_DIR=index_dir):
+            # Not built yet: BM25
+            self.assertEqual(self.ids('hostel fees'), [5, 2, 1, 6])
+            build_tfidf_index(TEST_KNOWLEDGE[:4])
+            self.assertEqual(self.ids('hostel fees'), [2, 1])
+            self.assertFalse(uses_database())
+
+    def test_fulltext_backend(self):
+        for qa in TEST_KNOWLEDGE[:4]:
+            RUGIPOKnowledge.objects.create(
+                id=qa['id'], category=qa['category'], question=qa['question'],
+                answer=qa['answer'], keywords=qa['keywords'],
+            )
+        with override_settings(CHATBOT_RETRIEVAL_BACKEND='fulltext'):
+            self.assertTrue(uses_database())
+            self.assertEqual(set(self.ids('hostel fees')), {1, 2})
+
+
+class PromptPrefixTest(TestCase):
+    """
+    The system prompt prefix is built once per KB version and is byte-identical
+    in every request, so OpenAI can reuse its cached prefix
+    """
+
+    def setUp(self):
+        metrics.reset_counters(['prompt_prefix_builds', 'prompt_prefix_requests'])
+        self.snapshot = use_knowledge(self)
+
+    def test_built_once_per_version(self):
+        prefix = get_system_prompt_prefix()
+        self.assertIn('RUGIPO KNOWLEDGE BASE OVERVIEW (6 entries)', prefix)
+        for _ in range(3):
+            self.assertEqual(build_messages('Where is the hostel?')[0]['content'].encode(), prefix.encode())
+        stats = get_prompt_cache_stats()
+        self.assertEqual((stats['prompt_prefix_builds'], stats['prompt_prefix_requests']), (1, 3))
+        self.assertEqual(stats['prefix_reuse_rate'], round(1 - 1 / 3, 4))
+
+        # A new version rebuilds it; the same entries in another order give the same bytes
+        use_knowledge(self, list(reversed(TEST_KNOWLEDGE)), version='test-2')
+        self.assertEqual(get_system_prompt_prefix().encode(), prefix.encode())
+        get_system_prompt_prefix()
+        self.assertEqual(get_prompt_cache_stats()['prompt_prefix_builds'], 2)
+
+        use_knowledge(self, TEST_KNOWLEDGE[:4], version='test-3')
+        self.assertIn('(4 entries)', get_system_prompt_prefix())
+        self.assertNotIn('Hostel & Accommodation', get_system_prompt_prefix())
+        self.assertEqual(get_prompt_cache_stats()['prompt_prefix_builds'], 3)
+
+
+class KeywordSearchTest(TestCase):
+    """
+    The BM25 fallback matches whole terms, weighting the question over the answer
+    """
+
+    def setUp(self):
+        use_knowledge(self)
+
+    def test_terms_are_whole_words(self):
+        self.assertNotIn('fee', tokenize('Where can I buy coffee?'))
+        self.assertEqual(routed_search(weighted_query_terms('coffee')), [])
+
+    def test_question_matches_rank_first(self):
+        # "admission" is in entry 3's question and only in entry 2's answer
+        ranked = get_search_index().search(weighted_query_terms('admission'))
+        self.assertEqual([qa['id'] for _, qa in ranked], [3, 2])
+        self.assertEqual([qa['id'] for _, qa in get_search_index().search({'hostel': 1.0}, limit=1)], [5])
+
+    def test_fallback_answers(self):
+        self.assertIn(TEST_KNOWLEDGE[0]['answer'], fallback_keyword_search('How do I pay the school fees?'))
+        self.assertTrue(fallback_keyword_search('Where can I buy coffee?').startswith("Hello! I'm the RUGIPO AI assistant"))
+
+
+class TokenBudgetTest(TestCase):
+    """
+    History is trimmed to the most recent messages that fit the budget
+    """
+
+    def messages(self, n):
+        return [
+            {'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'message number {i}'}
+            for i in range(n)
+        ]
+
+    def test_keeps_the_most_recent_messages(self):
+        history = self.messages(6)
+        budget = sum(count_message_tokens(msg) for msg in history[-3:])
+        kept, used = trim_history(history, budget)
+        self.assertEqual(kept, history[-3:])
+        self.assertEqual(used, budget)
+        self.assertEqual(trim_history(history, budget + 1)[0], history[-3:])
+        self.assertEqual(trim_history(history, 10000)[0], history)
+        self.assertEqual(trim_history([], 100), ([], 0))
+
+    def test_oversized_newest_message_is_truncated(self):
+        long_message = {'role': 'user', 'content': ' '.join(['word'] * 200)}
+        kept, used = trim_history(self.messages(2) + [long_message], 50)
+        self.assertEqual(len(kept), 1)
+        self.assertTrue(kept[0]['content'].endswith(TRUNCATION_MARKER))
+        self.assertLessEqual(used, 50)
+        self.assertEqual(trim_history([long_message], MESSAGE_OVERHEAD), ([], 0))
+
+    def test_truncate_keeps_the_beginning(self):
+        text = 'Rufus Giwa Polytechnic admission requirements and school fees ' * 20
+        self.assertEqual(truncate_to_tokens(text, count_tokens(text)), text)
+        truncated = truncate_to_tokens(text, 20)
+        self.assertTrue(truncated.startswith('Rufus Giwa Polytechnic'))
+        self.assertTrue(truncated.endswith(TRUNCATION_MARKER))
+        self.assertLessEqual(count_tokens(truncated), 20)
+        self.assertEqual(truncate_to_tokens(text, 20), truncated)
+
+
+@override_settings(CHATBOT_LLM_BACKEND='stub', CHATBOT_STUB_LATENCY=0.05, CHATBOT_STUB_TOKENS_PER_SECOND=0)
+class CoalescedRepliesTest(TestCase):
+    """
+    Requests sharing one OpenAI call don't each count its tokens
+    """
+
+    def setUp(self):
+        cache.clear()
+        reset_llm_backend()
+        self.addCleanup(reset_llm_backend)
+        use_knowledge(self)
+
+    async def test_only_the_leader_records_tokens(self):
+        replies = await asyncio.gather(*[aget_chatbot_reply('Where can I buy coffee?') for _ in range(3)])
+        self.assertEqual({reply['route'] for reply in replies}, {'llm'})
+        self.assertEqual(len({reply['content'] for reply in replies}), 1)
+        tokens = [reply['tokens'] for reply in replies]
+        self.assertEqual(tokens.count(None), 2)
+        self.assertGreater(tokens[0], 0)
+
+
+@override_settings(
+    CHATBOT_LLM_BACKEND='stub', CHATBOT_STUB_LATENCY=0, CHATBOT_STUB_TOKENS_PER_SECOND=0,
+    CHATBOT_ANSWER_CACHE_TTL=60,
+)
+class AnswerCacheTest(TestCase):
+    """
+    Repeated first-turn questions are answered from the cache until the KB
+    version changes or the entry expires
+    """
+
+    def setUp(self):
+        cache.clear()
+        reset_answer_cache_stats()
+        reset_llm_backend()
+        self.addCleanup(reset_llm_backend)
+        use_knowledge(self)
+
+    def test_key_normalization(self):
+        key = make_cache_key('Where can I buy coffee?', 'v1')
+        self.assertEqual(make_cache_key('  where CAN i buy coffee ', 'v1'), key)
+        self.assertNotEqual(make_cache_key('Where can I buy tea?', 'v1'), key)
+        self.assertNotEqual(make_cache_key('Where can I buy coffee?', 'v2'), key)
+        self.assertNotEqual(make_cache_key('Where can I buy coffee?', 'v1', '1,2'), key)
+
+    def test_hit_and_stats(self):
+        first = get_chatbot_reply('Where can I buy coffee?')
+        self.assertEqual(first['route'], 'llm')
+        second = get_chatbot_reply('where can I buy COFFEE')
+        self.assertEqual(second['route'], 'cache')
+        self.assertEqual(second['content'], first['content'])
+
+        stats = get_answer_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['saved_tokens'], first['tokens'])
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+        reset_answer_cache_stats()
+        self.assertEqual(get_answer_cache_stats()['hits'], 0)
+
+    def test_knowledge_change_misses(self):
+        get_chatbot_reply('Where can I buy coffee?')
+        use_knowledge(self, version='test-2')
+        self.assertEqual(get_chatbot_reply('Where can I buy coffee?')['route'], 'llm')
+
+    def test_history_is_not_cached(self):
+        history = [{'role': 'user', 'content': 'Hello'}, {'role': 'assistant', 'content': 'Hi'}]
+        get_chatbot_reply('Where can I buy coffee?', history)
+        self.assertEqual(get_chatbot_reply('Where can I buy coffee?', history)['route'], 'llm')
+
+    def test_entries_expire(self):
+        get_chatbot_reply('Where can I buy coffee?')
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=time.time() + 61):
+            self.assertEqual(get_chatbot_reply('Where can I buy coffee?')['route'], 'llm')
+
+    @override_settings(CHATBOT_ANSWER_CACHE_TTL=0)
+    def test_disabled(self):
+        get_chatbot_reply('Where can I buy coffee?')
+        self.assertEqual(get_chatbot_reply('Where can I buy coffee?')['route'], 'llm')
+        self.assertFalse(get_answer_cache_stats()['enabled'])
+        self.assertEqual(get_answer_cache_stats()['misses'], 0)
+
+
+TFIDF_ENTRIES = [
+    {'id': 10, 'question': 'How do I pay the school fees?', 'answer': 'Pay at the bursary.', 'keywords': 'fees payment'},
+    {'id': 20, 'question': 'Where is the hostel?', 'answer': 'Behind the library.', 'keywords': 'hostel accommodation'},
+    {'id': 30, 'question': 'When is the fees deadline?', 'answer': 'The fees deadline is in March.', 'keywords': 'fees'},
+]
+
+
+class TfidfIndexTest(TestCase):
+    """
+    The TF-IDF index is built into a new version directory and workers switch
+    to it on their next lookup
+    """
+
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.index_dir)
+        settings_override = override_settings(TFIDF_INDEX_DIR=self.index_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def terms(self, text):
+        return {term: 1.0 for term in tokenize(text)}
+
+    def test_not_built(self):
+        self.assertIsNone(get_tfidf_index())
+
+    def test_build_and_search(self):
+        self.assertEqual(build_tfidf_index(TFIDF_ENTRIES), (3, len(get_tfidf_index().vocab)))
+        index = get_tfidf_index()
+
+        results = index.search(self.terms('fees deadline'))
+        self.assertEqual([qa_id for _, qa_id in results], [30, 10])
+        self.assertGreater(results[0][0], results[1][0])
+        self.assertEqual(index.search(self.terms('fees deadline'), limit=1), results[:1])
+        self.assertEqual(index.search(self.terms('coffee')), [])
+        self.assertEqual([qa_id for _, qa_id in index.search(self.terms('hostel bursary'))], [20, 10])
+
+    def test_rebuild_switches_versions(self):
+        build_tfidf_index(TFIDF_ENTRIES)
+        first_version = get_current_version()
+        first = get_tfidf_index()
+
+        build_tfidf_index(TFIDF_ENTRIES[1:] + [{'id': 40, 'question': 'Fees for hostel', 'answer': '', 'keywords': ''}])
+        second = get_tfidf_index()
+        self.assertIsNot(second, first)
+        self.assertEqual(sorted(int(i) for i in second.ids), [20, 30, 40])
+        self.assertIs(get_tfidf_index(), second)
+        # The previous build stays for workers still reading it, older ones go
+        self.assertTrue(os.path.isdir(os.path.join(self.index_dir, first_version)))
+        build_tfidf_index(TFIDF_ENTRIES)
+        self.assertFalse(os.path.isdir(os.path.join(self.index_dir, first_version)))
+        self.assertEqual(len([name for name in os.listdir(self.index_dir) if name.startswith('tfidf_2')]), 2)
+
+
+class KnowledgeCacheTest(TestCase):
+    """
+    The exported knowledge base is only re-parsed when its contents change
+    """
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        self.kb_path = os.path.join(self.data_dir, 'engineering_qa.json')
+        self.general_path = os.path.join(self.data_dir, 'general_qa.json')
+        settings_override = override_settings(
+            KNOWLEDGE_BASE_JSON_PATH=self.kb_path,
+            GENERAL_KNOWLEDGE_JSON_PATH=self.general_path,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        clear_knowledge_cache()
+        self.addCleanup(clear_knowledge_cache)
+
+    def export(self, entries, path=None):
+        return write_json_if_changed(path or self.kb_path, {'qa_data': entries})
+
+    def test_missing_files(self):
+        snapshot = get_knowledge_snapshot()
+        self.assertEqual(snapshot.entries, [])
+        self.assertIs(get_knowledge_snapshot(), snapshot)
+
+    def test_loads_both_files(self):
+        self.export(TEST_KNOWLEDGE[:2])
+        self.export(TEST_KNOWLEDGE[2:3], self.general_path)
+        self.assertEqual([entry['id'] for entry in get_knowledge_snapshot().entries], [1, 2, 3])
+
+    def test_reloads_only_on_content_change(self):
+        self.export(TEST_KNOWLEDGE[:2])
+        snapshot = get_knowledge_snapshot()
+        version = get_knowledge_version()
+
+        # A touched file is re-read but keeps the parsed snapshot
+        os.utime(self.kb_path, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+        self.assertIs(get_knowledge_snapshot(), snapshot)
+
+        self.export(TEST_KNOWLEDGE[:3])
+        changed = get_knowledge_snapshot()
+        self.assertIsNot(changed, snapshot)
+        self.assertNotEqual(get_knowledge_version(), version)
+        self.assertEqual(len(changed.entries), 3)
+
+    def test_same_content_export_keeps_version(self):
+        self.assertTrue(self.export(TEST_KNOWLEDGE))
+        snapshot = get_knowledge_snapshot()
+        stat = os.stat(self.kb_path)
+
+        self.assertFalse(self.export(TEST_KNOWLEDGE))
+        self.assertEqual(os.stat(self.kb_path).st_mtime_ns, stat.st_mtime_ns)
+        self.assertIs(get_knowledge_snapshot(), snapshot)
+
+        # The version is a content hash, so it also survives a fresh load
+        clear_knowledge_cache()
+        self.assertIsNot(get_knowledge_snapshot(), snapshot)
+        self.assertEqual(get_knowledge_version(), snapshot.version)
+
+    def test_parse_error_keeps_previous_snapshot(self):
+        self.export(TEST_KNOWLEDGE)
+        snapshot = get_knowledge_snapshot()
+
+        with open(self.kb_path, 'w') as f:
+            f.write('{"qa_data": [')
+        with self.assertLogs('chatbot.services.knowledge_cache', 'ERROR'):
+            self.assertIs(get_knowledge_snapshot(), snapshot)
+
+        # Fixed on the next export
+        self.export(TEST_KNOWLEDGE[:1])
+        self.assertEqual(len(get_knowledge_snapshot().entries), 1)
+
+
+class LLMBackendTest(TestCase):
+    """
+    CHATBOT_LLM_BACKEND picks the backend, and the stub LLM server speaks
+    enough of the OpenAI API for the openai_compatible backend
+    """
+
+    def start_stub_server(self):
+        handler = type('StubHandler', (StubHandler,), {'backend': StubBackend()})
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    @override_settings(CHATBOT_STUB_LATENCY=0.25, CHATBOT_STUB_TOKENS_PER_SECOND=10)
+    def test_stub(self):
+        backend = create_backend('stub')
+        self.assertIsInstance(backend, StubBackend)
+        self.assertEqual((backend.latency, backend.tokens_per_second), (0.25, 10))
+
+    @override_settings(CHATBOT_LLM_BACKEND='openai', CHATBOT_LLM_MODEL='gpt-test', CHATBOT_LLM_BASE_URL='http://llm.test/v1')
+    def test_openai(self):
+        backend = create_backend()
+        self.assertIsInstance(backend, OpenAIBackend)
+        self.assertEqual(backend.model, 'gpt-test')
+        # The base URL is only for openai_compatible
+        self.assertNotIn('llm.test', str(backend.client.base_url))
+
+        backend = create_backend('openai_compatible')
+        self.assertEqual(str(backend.client.base_url), 'http://llm.test/v1/')
+        self.assertEqual(str(backend.async_client.base_url), 'http://llm.test/v1/')
+
+    def test_unknown(self):
+        with override_settings(CHATBOT_LLM_BACKEND='llama'):
+            with self.assertRaises(ValueError):
+                create_backend()
+
+    def test_stub_server(self):
+        with override_settings(CHATBOT_LLM_BASE_URL=self.start_stub_server()):
+            backend = create_backend('openai_compatible')
+        messages = [
+            {'role': 'system', 'content': 'Q: Where is the hostel?\nA: Behind the library.'},
+            {'role': 'user', 'content': 'Where is the hostel?'},
+        ]
+        expected = StubBackend().complete(messages)
+
+        # JSON
+        self.assertEqual(backend.complete(messages), expected)
+
+        # SSE
+        chunks = list(backend.stream(messages))
+        self.assertEqual(''.join(chunk['delta'] for chunk in chunks), '(stub) Behind the library.')
+        self.assertGreater(len(chunks), 2)
+        self.assertEqual([chunk['usage'] for chunk in chunks[:-1]], [None] * (len(chunks) - 1))
+        self.assertEqual(chunks[-1]['usage'], expected['usage'])
+
+
+@override_settings(
+    CHATBOT_LLM_BACKEND='stub', CHATBOT_STUB_LATENCY=0, CHATBOT_STUB_TOKENS_PER_SECOND=0,
+    CHATBOT_SUMMARY_KEEP_RECENT=2, CHATBOT_SUMMARY_TOKEN_LIMIT=250,
+)
+class SummaryTest(TestCase):
+    """
+    Older messages are folded into the session summary, which stays within
+    its token limit
+    """
+
+    def setUp(self):
+        cache.clear()
+        reset_llm_backend()
+        self.addCleanup(reset_llm_backend)
+        self.session = ChatSession.objects.create()
+        self.messages = [
+            ChatMessage.objects.create(session=self.session, message_type=message_type, content=content)
+            for message_type, content in (
+                ('user', 'Where is the hostel?'), ('bot', 'Behind the library.'),
+                ('user', 'How do I pay the school fees?'), ('bot', 'Online through the portal.'),
+                ('user', 'When does registration close?'), ('bot', 'Six weeks into the semester.'),
+            )
+        ]
+
+    def summary(self):
+        self.session.refresh_from_db()
+        return self.session.summary, self.session.summary_until
+
+    def test_extractive_summary(self):
+        messages = [{'message_type': m.message_type, 'content': m.content} for m in self.messages]
+        self.assertEqual(
+            extractive_summary('- Student asked: Hello', messages, 250),
+            '- Student asked: Hello\n'
+            '- Student asked: Where is the hostel?\n'
+            '- Student asked: How do I pay the school fees?\n'
+            '- Student asked: When does registration close?'
+        )
+        # Over the cap the oldest questions go first
+        capped = extractive_summary('- Student asked: Hello', messages, 20)
+        self.assertLessEqual(count_tokens(capped), 20)
+        self.assertTrue(capped.endswith('- Student asked: When does registration close?'))
+        self.assertNotIn('Hello', capped)
+        # Long questions are cut short
+        long_question = [{'message_type': 'user', 'content': 'hostel ' * 200}]
+        self.assertLessEqual(count_tokens(extractive_summary('', long_question, 250)), 50)
+        self.assertLessEqual(count_tokens(extractive_summary('', long_question * 10, 30)), 30)
+
+    def test_update_summary(self):
+        self.assertTrue(update_summary(self.session.pk))
+        summary, summary_until = self.summary()
+        # Everything but the two most recent messages
+        self.assertEqual(summary_until, self.messages[3].id)
+        self.assertTrue(summary.startswith('(stub)'))
+        self.assertFalse(update_summary(self.session.pk))
+
+    @override_settings(CHATBOT_SUMMARY_TOKEN_LIMIT=5)
+    def test_summary_token_limit(self):
+        update_summary(self.session.pk)
+        self.assertLessEqual(count_tokens(self.summary()[0]), 5)
+
+    def test_llm_failure_uses_extractive_summary(self):
+        metrics.reset_counters(['summary_llm_failures'])
+        with mock.patch('chatbot.services.summaries.get_llm_backend', side_effect=RuntimeError('down')):
+            self.assertTrue(update_summary(self.session.pk))
+        self.assertEqual(self.summary(), (
+            '- Student asked: Where is the hostel?\n- Student asked: How do I pay the school fees?',
+            self.messages[3].id,
+        ))
+        self.assertEqual(metrics.get_counters(['summary_llm_failures'])['summary_llm_failures'], 1)
+
+    def test_watermark_only_advances_on_success(self):
+        with mock.patch('chatbot.services.summaries.summarize', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                update_summary(self.session.pk)
+        self.assertEqual(self.summary(), ('', 0))
+
+        # Another worker folded the messages first: its summary is kept
+        def concurrent_summarize(previous, messages, max_tokens):
+            ChatSession.objects.filter(pk=self.session.pk).update(summary='other', summary_until=self.messages[1].id)
+            return 'mine'
+
+        with mock.patch('chatbot.services.summaries.summarize', side_effect=concurrent_summarize):
+            self.assertFalse(update_summary(self.session.pk))
+        self.assertEqual(self.summary(), ('other', self.messages[1].id))
\ No newline at end of file
@@ -3,5 +3,10 @@ from . import views
 
 urlpatterns = [
     path('send-message/', views.send_message, name='chat_send_message'),
+    path('stream-message/', views.stream_message, name='chat_stream_message'),
     path('get-history/', views.get_history, name='chat_get_history'),
+    # Async endpoints (use when serving config.asgi:application)
+    path('async/send-message/', views.asend_message, name='chat_async_send_message'),
+    path('async/get-history/', views.aget_history, name='chat_async_get_history'),
+    path('status/', views.service_status, name='chat_service_status'),
 ]
\ No newline at end of file
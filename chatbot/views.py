@@ -1,10 +1,309 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
+from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from datetime import datetime, timedelta, timezone as dt_timezone
+import hashlib
+from asgiref.sync import sync_to_async
 import json
 from chatbot.models import ChatSession, ChatMessage
-from chatbot.services.openai_service import get_chatbot_response
+from chatbot.services.openai_service import (
+    get_chatbot_reply, aget_chatbot_reply, stream_chatbot_response, get_prompt_cache_stats,
+    openai_calls, openai_breaker,
+)
+from chatbot.services import history_cache, message_writer
+from chatbot.services.answer_cache import get_answer_cache_stats
+from chatbot.services.routing import get_routing_stats
+from chatbot.services.summaries import get_summary_stats, history_limit, schedule_summary, to_history
+
+# Session fields the chat endpoints use
+SESSION_FIELDS = ('id', 'session_id', 'last_activity', 'summary', 'summary_until')
+
+def get_session(session_id):
+    """
+    Return the ChatSession for session_id, or None for a new conversation
+    """
+    if session_id:
+        try:
+            session = ChatSession.objects.only(*SESSION_FIELDS).get(session_id=session_id)
+        except ChatSession.DoesNotExist:
+            return None
+        # Including exchanges still queued for write-behind
+        session.last_activity = message_writer.effective_last_activity(session)
+        return session
+    return None
+
+def get_recent_messages(session):
+    """
+    Messages not yet folded into the session summary, oldest first, as
+    id/message_type/content dicts (the message being answered is not saved yet)
+    Served from the history cache, falling back to the database
+    """
+    if session is None:
+        return []
+    limit = history_limit()
+    cached = history_cache.get_messages(session)
+    if cached is not None and cache_is_current(cached, session):
+        return unsummarized(cached, session)[-(limit - 1):]
+    
+    recent = list(recent_messages_query(session, limit))
+    recent.reverse()
+    return with_pending(recent, session)[-(limit - 1):]
+
+def recent_messages_query(session, limit):
+    """
+    The session's newest unsummarized messages, newest first
+    """
+    return (
+        ChatMessage.objects.filter(session=session, id__gt=session.summary_until)
+        .order_by('-created_at')
+        .values('id', 'message_type', 'content')[:limit - 1]
+    )
+
+def cache_is_current(cached, session):
+    """
+    Unsaved (write-behind) messages are cached without ids; once they are
+    flushed the cached copy can't be compared with the summary watermark,
+    so it is only used while they are still queued
+    """
+    unsaved = sum(1 for msg in cached if msg['id'] is None)
+    return unsaved <= sum(1 for msg in message_writer.pending_messages(session.pk) if msg.pk is None)
+
+def unsummarized(messages, session):
+    """
+    Messages after the summary watermark; unsaved (write-behind) ones have no id yet
+    """
+    return [msg for msg in messages if msg['id'] is None or msg['id'] > session.summary_until]
+
+def with_pending(rows, session, fields=('id', 'message_type', 'content')):
+    """
+    Rows from the database followed by the session's messages still queued
+    for write-behind (skipping any that were flushed in the meantime)
+    """
+    pending = message_writer.pending_messages(session.pk)
+    if not pending:
+        return rows
+    seen = {row['id'] for row in rows}
+    return rows + [
+        {field: getattr(msg, field) for field in fields}
+        for msg in pending
+        if msg.id is None or msg.id not in seen
+    ]
+
+def get_conversation_history(session, recent):
+    """
+    Session summary plus the recent messages in OpenAI message format
+    Schedules a summary update once enough messages have piled up
+    """
+    if session is None:
+        return []
+    # Counting the message being answered
+    if len(recent) + 1 >= history_limit():
+        schedule_summary(session.pk)
+    return to_history(session, recent)
+
+def save_exchange(session, user_message, reply, received_at, recent=()):
+    """
+    Save the user message and the reply, and bump the session's activity, in
+    one transaction: a single INSERT for both messages plus one UPDATE (or the
+    session INSERT for a new conversation)
+    With write-behind on, only a new session is inserted here and the
+    messages are queued (their ids stay None until flushed)
+    The exchange is then written through to the history cache after `recent`
+    Returns the session and the saved bot message
+    """
+    now = timezone.now()
+    
+    def build_messages():
+        return [
+            ChatMessage(
+                session=session,
+                message_type='user',
+                content=user_message,
+                created_at=received_at
+            ),
+            ChatMessage(
+                session=session,
+                message_type='bot',
+                content=reply['content'],
+                route=reply.get('route', ''),
+                route_score=reply.get('score'),
+                category=reply.get('category') or None,
+                tokens=reply.get('tokens'),
+                latency_ms=max(int((now - received_at).total_seconds() * 1000), 0),
+                created_at=now
+            ),
+        ]
+    
+    queued = False
+    writer = message_writer.get_message_writer()
+    if writer is not None:
+        if session is None:
+            session = ChatSession.objects.create()
+        session.last_activity = now
+        user, bot = build_messages()
+        queued = writer.enqueue(session.pk, [user, bot], now)
+    
+    # Saved right away unless queued (write-behind off, or its queue is full)
+    if not queued:
+        with transaction.atomic():
+            if session is None:
+                session = ChatSession.objects.create()
+            else:
+                ChatSession.objects.filter(pk=session.pk).update(last_activity=now)
+                session.last_activity = now
+            user, bot = ChatMessage.objects.bulk_create(build_messages())
+    
+    history_cache.store_messages(
+        session,
+        list(recent) + [
+            {'id': msg.id, 'message_type': msg.message_type, 'content': msg.content}
+            for msg in (user, bot)
+        ],
+        history_limit(),
+    )
+    return session, bot
+
+# History pages: newest HISTORY_PAGE_SIZE messages by default, at most HISTORY_MAX_PAGE_SIZE
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# Stands in for the id of a message still queued for write-behind, so it
+# sorts after every saved message with the same timestamp
+PENDING_ID = 2 ** 63 - 1
+
+def encode_cursor(created_at, message_id):
+    """
+    Opaque keyset cursor for a message: microseconds since the epoch and id
+    """
+    if message_id is None:
+        message_id = PENDING_ID
+    return f"{(created_at - _EPOCH) // timedelta(microseconds=1)}_{message_id}"
+
+def decode_cursor(cursor):
+    """
+    (created_at, id) for a cursor; raises ValueError if it is malformed
+    """
+    micros, message_id = cursor.split('_')
+    return _EPOCH + timedelta(microseconds=int(micros)), int(message_id)
+
+def history_etag(request, session):
+    """
+    Strong ETag for a history page; every saved exchange bumps last_activity
+    """
+    raw = f"{session.session_id}|{session.last_activity.isoformat()}|{request.GET.urlencode()}"
+    return '"' + hashlib.sha1(raw.encode('utf-8')).hexdigest() + '"'
+
+def history_page_query(session, params):
+    """
+    Query for one page of history: since= returns messages after a cursor
+    (oldest first), otherwise the newest messages, before= a cursor if given
+    Returns (queryset, limit, newest_first)
+    """
+    limit = min(max(int(params.get('limit') or HISTORY_PAGE_SIZE), 1), HISTORY_MAX_PAGE_SIZE)
+    messages = ChatMessage.objects.filter(session=session)
+    
+    if params.get('since'):
+        created_at, message_id = decode_cursor(params['since'])
+        messages = messages.filter(
+            Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=message_id)
+        ).order_by('created_at', 'id')
+        newest_first = False
+    else:
+        if params.get('before'):
+            created_at, message_id = decode_cursor(params['before'])
+            messages = messages.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=message_id)
+            )
+        messages = messages.order_by('-created_at', '-id')
+        newest_first = True
+    
+    # One extra row tells whether there is another page
+    return messages.values('id', 'message_type', 'content', 'created_at')[:limit + 1], limit, newest_first
+
+def history_key(row):
+    return row['created_at'], PENDING_ID if row['id'] is None else row['id']
+
+def merge_pending_history(rows, session, params, limit, newest_first):
+    """
+    Add the session's messages still queued for write-behind to a page of
+    rows from history_page_query, keeping its cursor bounds and order
+    """
+    merged = with_pending(rows, session, fields=('id', 'message_type', 'content', 'created_at'))
+    if len(merged) == len(rows):
+        return rows
+    
+    if params.get('since'):
+        since = decode_cursor(params['since'])
+        merged = [row for row in merged if history_key(row) > since]
+    elif params.get('before'):
+        before = decode_cursor(params['before'])
+        merged = [row for row in merged if history_key(row) < before]
+    merged.sort(key=history_key, reverse=newest_first)
+    return merged[:limit + 1]
+
+def history_response(request, session, rows, limit, newest_first):
+    """
+    JSON page of messages (oldest first) with cursors and caching headers
+    before_cursor fetches older messages, since_cursor newer ones
+    """
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if newest_first:
+        rows.reverse()
+    
+    response = JsonResponse({
+        'success': True,
+        'messages': [
+            {
+                'type': row['message_type'],
+                'content': row['content'],
+                'timestamp': row['created_at'].isoformat()
+            }
+            for row in rows
+        ],
+        'has_more': has_more,
+        'before_cursor': encode_cursor(rows[0]['created_at'], rows[0]['id']) if rows else None,
+        'since_cursor': (
+            encode_cursor(rows[-1]['created_at'], rows[-1]['id']) if rows
+            else request.GET.get('since') or None
+        ),
+    })
+    return add_history_headers(response, request, session)
+
+def add_history_headers(response, request, session):
+    response['ETag'] = history_etag(request, session)
+    response['Last-Modified'] = http_date(session.last_activity.timestamp())
+    # Cached by the browser, but always revalidated
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+def not_modified_response(request, session):
+    """
+    304 response if the client's ETag / Last-Modified is still current
+    """
+    response = get_conditional_response(
+        request,
+        etag=history_etag(request, session),
+        last_modified=int(session.last_activity.timestamp()),
+    )
+    if response is not None:
+        return add_history_headers(response, request, session)
+    return None
+
+def sse_event(event, data):
+    """
+    Format one Server-Sent Event
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 @csrf_exempt
 @require_http_methods(["POST"])
@@ -23,48 +322,24 @@ def send_message(request):
                 'error': 'Message cannot be empty'
             }, status=400)
         
-        # Get or create session
-        session = None
-        if session_id:
-            try:
-                session = ChatSession.objects.get(session_id=session_id)
-            except ChatSession.DoesNotExist:
-                pass
+        received_at = timezone.now()
+        session = get_session(session_id)
+        recent = get_recent_messages(session)
+        conversation_history = get_conversation_history(session, recent)
         
-        if not session:
-            session = ChatSession.objects.create()
-        
-        # Save user message
-        ChatMessage.objects.create(
-            session=session,
-            message_type='user',
-            content=user_message
-        )
-        
-        # Get conversation history (last 10 messages)
-        history = ChatMessage.objects.filter(session=session).order_by('-created_at')[:10]
-        conversation_history = [
-            {
-                'role': 'assistant' if msg.message_type == 'bot' else 'user',
-                'content': msg.content
-            }
-            for msg in reversed(history)
-        ]
+        # Answer from the knowledge base or OpenAI (outside the transaction)
+        reply = get_chatbot_reply(user_message, conversation_history)
         
-        # Get bot response from OpenAI
-        bot_response = get_chatbot_response(user_message, conversation_history[:-1])
-        
-        # Save bot message
-        ChatMessage.objects.create(
-            session=session,
-            message_type='bot',
-            content=bot_response
-        )
+        # Save both messages
+        session, bot_message = save_exchange(session, user_message, reply, received_at, recent)
         
         return JsonResponse({
             'success': True,
-            'bot_response': bot_response,
-            'session_id': str(session.session_id)
+            'bot_response': reply['content'],
+            'route': reply['route'],
+            'route_score': reply['score'],
+            'session_id': str(session.session_id),
+            'cursor': encode_cursor(bot_message.created_at, bot_message.id)
         })
     
     except Exception as e:
@@ -73,10 +348,67 @@ def send_message(request):
             'error': str(e)
         }, status=400)
 
+@csrf_exempt
+@require_http_methods(["POST"])
+def stream_message(request):
+    """
+    Handle incoming chat messages, streaming the answer as Server-Sent Events
+    Emits "delta" events with chunks of the answer, then a "done" event; both
+    messages are saved once the stream completes
+    """
+    try:
+        data = json.loads(request.body)
+        user_message = data.get('message', '').strip()
+        session_id = data.get('session_id', '')
+        
+        if not user_message:
+            return JsonResponse({
+                'success': False,
+                'error': 'Message cannot be empty'
+            }, status=400)
+        
+        received_at = timezone.now()
+        session = get_session(session_id)
+        recent = get_recent_messages(session)
+        conversation_history = get_conversation_history(session, recent)
+    
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=400)
+    
+    def event_stream():
+        parts = []
+        reply_info = {}
+        try:
+            for delta in stream_chatbot_response(user_message, conversation_history, reply_info):
+                parts.append(delta)
+                yield sse_event('delta', {'content': delta})
+        finally:
+            # Save both messages, with whatever was sent if the client went away
+            reply_info['content'] = ''.join(parts)
+            saved_session, bot_message = save_exchange(session, user_message, reply_info, received_at, recent)
+        
+        yield sse_event('done', {
+            'session_id': str(saved_session.session_id),
+            'route': reply_info.get('route', ''),
+            'route_score': reply_info.get('score'),
+            'cursor': encode_cursor(bot_message.created_at, bot_message.id),
+        })
+    
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx-style proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @require_http_methods(["GET"])
 def get_history(request):
     """
-    Retrieve chat history for a session
+    Retrieve chat history for a session, a page at a time
+    Query parameters: limit, before (older page) or since (newer messages)
+    cursors from a previous page; answers 304 if the client's ETag is current
     """
     session_id = request.GET.get('session_id', '')
     
@@ -87,23 +419,154 @@ def get_history(request):
         }, status=400)
     
     try:
-        session = ChatSession.objects.get(session_id=session_id)
-        messages = ChatMessage.objects.filter(session=session).order_by('created_at')
+        session = ChatSession.objects.only('id', 'session_id', 'last_activity').get(session_id=session_id)
+        session.last_activity = message_writer.effective_last_activity(session)
         
-        message_list = [
-            {
-                'type': msg.message_type,
-                'content': msg.content,
-                'timestamp': msg.created_at.isoformat()
-            }
-            for msg in messages
-        ]
+        # Nothing new since the client's copy
+        not_modified = not_modified_response(request, session)
+        if not_modified is not None:
+            return not_modified
+        
+        try:
+            messages, limit, newest_first = history_page_query(session, request.GET)
+        except ValueError:
+            return JsonResponse({
+                'success': False,
+                'error': 'Invalid cursor or limit'
+            }, status=400)
+        
+        rows = merge_pending_history(list(messages), session, request.GET, limit, newest_first)
+        return history_response(request, session, rows, limit, newest_first)
+    
+    except ChatSession.DoesNotExist:
+        return JsonResponse({
+            'success': False,
+            'error': 'Session not found'
+        }, status=404)
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=400)
+
+# Async versions of the chat endpoints, for serving through config.asgi
+# Waiting on OpenAI does not hold a worker thread, so one ASGI worker can
+# serve many concurrent chats
+
+async def aget_session(session_id):
+    """
+    Async version of get_session
+    """
+    if session_id:
+        try:
+            session = await ChatSession.objects.only(*SESSION_FIELDS).aget(session_id=session_id)
+        except ChatSession.DoesNotExist:
+            return None
+        session.last_activity = message_writer.effective_last_activity(session)
+        return session
+    return None
+
+async def aget_recent_messages(session):
+    """
+    Async version of get_recent_messages
+    """
+    if session is None:
+        return []
+    limit = history_limit()
+    cached = history_cache.get_messages(session)
+    if cached is not None and cache_is_current(cached, session):
+        return unsummarized(cached, session)[-(limit - 1):]
+    
+    recent = [msg async for msg in recent_messages_query(session, limit)]
+    recent.reverse()
+    return with_pending(recent, session)[-(limit - 1):]
+
+async def aget_conversation_history(session, recent):
+    """
+    Async version of get_conversation_history
+    """
+    if session is None:
+        return []
+    if len(recent) + 1 >= history_limit():
+        await sync_to_async(schedule_summary)(session.pk)
+    return to_history(session, recent)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def asend_message(request):
+    """
+    Handle incoming chat messages (async)
+    """
+    try:
+        data = json.loads(request.body)
+        user_message = data.get('message', '').strip()
+        session_id = data.get('session_id', '')
+        
+        if not user_message:
+            return JsonResponse({
+                'success': False,
+                'error': 'Message cannot be empty'
+            }, status=400)
+        
+        received_at = timezone.now()
+        session = await aget_session(session_id)
+        recent = await aget_recent_messages(session)
+        conversation_history = await aget_conversation_history(session, recent)
+        
+        # Answer from the knowledge base or OpenAI
+        reply = await aget_chatbot_reply(user_message, conversation_history)
+        
+        # Save both messages (transactions need a sync connection)
+        session, bot_message = await sync_to_async(save_exchange)(session, user_message, reply, received_at, recent)
         
         return JsonResponse({
             'success': True,
-            'messages': message_list
+            'bot_response': reply['content'],
+            'route': reply['route'],
+            'route_score': reply['score'],
+            'session_id': str(session.session_id),
+            'cursor': encode_cursor(bot_message.created_at, bot_message.id)
         })
     
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=400)
+
+@require_http_methods(["GET"])
+async def aget_history(request):
+    """
+    Retrieve chat history for a session (async)
+    """
+    session_id = request.GET.get('session_id', '')
+    
+    if not session_id:
+        return JsonResponse({
+            'success': False,
+            'error': 'Session ID required'
+        }, status=400)
+    
+    try:
+        session = await ChatSession.objects.only('id', 'session_id', 'last_activity').aget(session_id=session_id)
+        session.last_activity = message_writer.effective_last_activity(session)
+        
+        # Nothing new since the client's copy
+        not_modified = not_modified_response(request, session)
+        if not_modified is not None:
+            return not_modified
+        
+        try:
+            messages, limit, newest_first = history_page_query(session, request.GET)
+        except ValueError:
+            return JsonResponse({
+                'success': False,
+                'error': 'Invalid cursor or limit'
+            }, status=400)
+        
+        rows = merge_pending_history([row async for row in messages], session, request.GET, limit, newest_first)
+        return history_response(request, session, rows, limit, newest_first)
+    
     except ChatSession.DoesNotExist:
         return JsonResponse({
             'success': False,
@@ -113,4 +576,25 @@ def get_history(request):
         return JsonResponse({
             'success': False,
             'error': str(e)
-        }, status=400)
\ No newline at end of file
+        }, status=400)
+
+@login_required
+@require_http_methods(["GET"])
+def service_status(request):
+    """
+    Chatbot performance counters (direct answers, answer cache, history cache,
+    prompt prefix reuse, coalesced OpenAI calls, summaries) and the OpenAI
+    circuit breaker state
+    Only accessible to authenticated admin users
+    """
+    return JsonResponse({
+        'success': True,
+        'routing': get_routing_stats(),
+        'answer_cache': get_answer_cache_stats(),
+        'history_cache': history_cache.get_history_cache_stats(),
+        'write_behind': message_writer.get_write_behind_stats(),
+        'prompt_cache': get_prompt_cache_stats(),
+        'coalescing': openai_calls.stats(),
+        'summaries': get_summary_stats(),
+        'circuit_breaker': openai_breaker.status(),
+    })
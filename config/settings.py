@@ -133,9 +133,100 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 # OpenAI Configuration
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+# Per-call deadline (seconds) and retries before falling back to keyword search
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '15'))
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '1'))
+
+# LLM backend: 'openai', 'openai_compatible' (any OpenAI-style API at
+# CHATBOT_LLM_BASE_URL) or 'stub' (deterministic local replies for load testing;
+# `python manage.py run_llm_stub` serves the same stub as an OpenAI-compatible API)
+CHATBOT_LLM_BACKEND = os.getenv('CHATBOT_LLM_BACKEND', 'openai')
+CHATBOT_LLM_MODEL = os.getenv('CHATBOT_LLM_MODEL', 'gpt-4o-mini')
+CHATBOT_LLM_BASE_URL = os.getenv('CHATBOT_LLM_BASE_URL', '')
+# Stub backend: seconds before the first token, then tokens per second (0 = instant)
+CHATBOT_STUB_LATENCY = float(os.getenv('CHATBOT_STUB_LATENCY', '0.5'))
+CHATBOT_STUB_TOKENS_PER_SECOND = float(os.getenv('CHATBOT_STUB_TOKENS_PER_SECOND', '50'))
+
+# Circuit breaker: after this many consecutive upstream failures, skip OpenAI
+# for the cooldown (seconds) and answer from the keyword fallback immediately
+CHATBOT_BREAKER_FAILURE_THRESHOLD = int(os.getenv('CHATBOT_BREAKER_FAILURE_THRESHOLD', '5'))
+CHATBOT_BREAKER_COOLDOWN = float(os.getenv('CHATBOT_BREAKER_COOLDOWN', '30'))
 
 # Knowledge base settings
 KNOWLEDGE_BASE_JSON_PATH = BASE_DIR / 'data' / 'engineering_qa.json'
+GENERAL_KNOWLEDGE_JSON_PATH = BASE_DIR / 'data' / 'general_qa.json'
+
+# Retrieval: how many Q&As go into each prompt
+CHATBOT_RETRIEVAL_TOP_K = int(os.getenv('CHATBOT_RETRIEVAL_TOP_K', '8'))
+
+# Answer straight from the knowledge base (no LLM call) when the best match's
+# confidence (0-1, 1 = same question) reaches this; above 1 disables it
+CHATBOT_DIRECT_ANSWER_THRESHOLD = float(os.getenv('CHATBOT_DIRECT_ANSWER_THRESHOLD', '0.8'))
+
+# Prompt token budget: total input tokens, split between retrieved knowledge,
+# conversation history and the user's message (instructions are always sent)
+CHATBOT_PROMPT_TOKEN_BUDGET = int(os.getenv('CHATBOT_PROMPT_TOKEN_BUDGET', '3500'))
+CHATBOT_CONTEXT_TOKEN_BUDGET = int(os.getenv('CHATBOT_CONTEXT_TOKEN_BUDGET', '1500'))
+CHATBOT_HISTORY_TOKEN_BUDGET = int(os.getenv('CHATBOT_HISTORY_TOKEN_BUDGET', '1000'))
+CHATBOT_USER_MESSAGE_TOKEN_LIMIT = int(os.getenv('CHATBOT_USER_MESSAGE_TOKEN_LIMIT', '500'))
+
+# Rolling conversation summaries: once KEEP_RECENT + EVERY messages are unsummarized,
+# all but the last KEEP_RECENT are folded into the session summary (in a background thread)
+CHATBOT_SUMMARY_EVERY = int(os.getenv('CHATBOT_SUMMARY_EVERY', '6'))
+CHATBOT_SUMMARY_KEEP_RECENT = int(os.getenv('CHATBOT_SUMMARY_KEEP_RECENT', '4'))
+CHATBOT_SUMMARY_TOKEN_LIMIT = int(os.getenv('CHATBOT_SUMMARY_TOKEN_LIMIT', '250'))
+CHATBOT_SUMMARY_IN_BACKGROUND = os.getenv('CHATBOT_SUMMARY_IN_BACKGROUND', 'True').lower() == 'true'
+
+# Ranking used for retrieval: 'bm25' (in-memory, always available), 'tfidf'
+# ('tfidf' needs `python manage.py build_tfidf_index`; falls back to bm25 until built)
+# or 'fulltext' (the database full-text index of the knowledge table)
+CHATBOT_RETRIEVAL_BACKEND = os.getenv('CHATBOT_RETRIEVAL_BACKEND', 'bm25')
+# Where build_tfidf_index writes the TF-IDF index versions (tfidf_*)
+TFIDF_INDEX_DIR = BASE_DIR / 'data'
+
+# Category routing: bm25 lookups only score the categories whose predicted
+# probabilities add up to COVERAGE, if that takes at most MAX_CATEGORIES
+CHATBOT_CATEGORY_ROUTING = os.getenv('CHATBOT_CATEGORY_ROUTING', 'True').lower() == 'true'
+CHATBOT_CATEGORY_ROUTER_COVERAGE = float(os.getenv('CHATBOT_CATEGORY_ROUTER_COVERAGE', '0.95'))
+CHATBOT_CATEGORY_ROUTER_MAX_CATEGORIES = int(os.getenv('CHATBOT_CATEGORY_ROUTER_MAX_CATEGORIES', '3'))
+
+# Cache (local memory per worker; evicts least recently used past MAX_ENTRIES)
+# Switch BACKEND to django.core.cache.backends.filebased.FileBasedCache to share between workers
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'rugipo-chatbot',
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,
+        },
+    }
+}
+
+# Answer cache for repeated questions (seconds; 0 disables it)
+CHATBOT_ANSWER_CACHE_ALIAS = 'default'
+CHATBOT_ANSWER_CACHE_TTL = int(os.getenv('CHATBOT_ANSWER_CACHE_TTL', '3600'))
+
+# Write-through cache of each session's recent messages (seconds; 0 disables it)
+CHATBOT_HISTORY_CACHE_ALIAS = 'default'
+CHATBOT_HISTORY_CACHE_TTL = int(os.getenv('CHATBOT_HISTORY_CACHE_TTL', '3600'))
+
+# Write-behind: queue chat messages in memory and save them in batches from a
+# background thread. MAX_DELAY (seconds) is the durability window, i.e. how
+# long a message may stay unsaved; when the queue is full messages are saved
+# synchronously again
+CHATBOT_WRITE_BEHIND = os.getenv('CHATBOT_WRITE_BEHIND', 'False').lower() == 'true'
+CHATBOT_WRITE_BEHIND_BATCH_SIZE = int(os.getenv('CHATBOT_WRITE_BEHIND_BATCH_SIZE', '500'))
+CHATBOT_WRITE_BEHIND_MAX_DELAY = float(os.getenv('CHATBOT_WRITE_BEHIND_MAX_DELAY', '1.0'))
+CHATBOT_WRITE_BEHIND_QUEUE_SIZE = int(os.getenv('CHATBOT_WRITE_BEHIND_QUEUE_SIZE', '10000'))
+
+# Retention for chat history (python manage.py archive_chat_history): sessions
+# inactive for longer are archived to gzipped JSONL files and deleted
+CHATBOT_CHAT_RETENTION_DAYS = int(os.getenv('CHATBOT_CHAT_RETENTION_DAYS', '90'))
+CHATBOT_CHAT_ARCHIVE_DIR = BASE_DIR / 'archives'
+
+# Daily chat stats (admin > Daily chat stats) are updated by the background
+# scheduler every this many minutes, or with `python manage.py rollup_chat_stats`
+CHATBOT_STATS_INTERVAL_MINUTES = int(os.getenv('CHATBOT_STATS_INTERVAL_MINUTES', '15'))
 
 # Background Scheduler
 # Set to True to enable automatic daily scraping at 2 AM
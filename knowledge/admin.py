@@ -1,14 +1,16 @@
 from django.contrib import admin
 from django.contrib import messages
+from .fulltext import FullTextSearchMixin
 from .models import RUGIPOKnowledge, EngineeringQA, ScraperURL
+from .search import SEARCH_FIELDS
 from .utils import export_engineering_qa_to_json
 from .scraper import scrape_rugipo_data
 
 @admin.register(RUGIPOKnowledge)
-class RUGIPOKnowledgeAdmin(admin.ModelAdmin):
+class RUGIPOKnowledgeAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ['question_preview', 'category', 'is_active', 'source_url', 'updated_at']
     list_filter = ['category', 'is_active', 'created_at']
-    search_fields = ['question', 'answer', 'keywords']
+    search_fields = SEARCH_FIELDS
     list_editable = ['is_active']
     date_hierarchy = 'created_at'
     actions = ['activate_selected', 'deactivate_selected', 'export_to_json', 'scrape_websites']
@@ -0,0 +1,234 @@
+"""
+Full-text search over text columns, the same way on both database backends
+- SQLite: an external-content FTS5 table (<table>_fts) kept in sync by triggers
+- PostgreSQL: a GIN index over to_tsvector('english', ...) of the columns
+Both are created by the CreateFullTextIndex migration operation; search()
+filters a queryset with whichever index exists (plain icontains otherwise)
+and FullTextSearchMixin uses it for admin search
+On SQLite, migrations that rebuild the table drop its triggers; such a
+migration has to recreate the index (drop_statements, then create_statements)
+"""
+import operator
+import re
+from functools import reduce
+from django.db import connections
+from django.db.migrations.operations.base import Operation
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+TS_CONFIG = 'english'
+
+_WORD_RE = re.compile(r"\w+")
+
+# (database alias, table) -> whether the index exists
+_available = {}
+
+
+def fts_table(table):
+    return f"{table}_fts"
+
+
+def _document(columns):
+    """
+    The tsvector expression; queries must repeat it exactly to use the index
+    """
+    text = " || ' ' || ".join(f'coalesce("{column}", \'\')' for column in columns)
+    return f"to_tsvector('{TS_CONFIG}', {text})"
+
+
+def create_statements(vendor, table, columns):
+    """
+    SQL creating (and filling) the full-text index of table's columns
+    """
+    if vendor == 'sqlite':
+        fts = fts_table(table)
+        names = ', '.join(columns)
+        new = ', '.join(f'new.{column}' for column in columns)
+        old = ', '.join(f'old.{column}' for column in columns)
+        delete_old = f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old});"
+        insert_new = f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new});"
+        return [
+            f"CREATE VIRTUAL TABLE {fts} USING fts5({names}, content='{table}', "
+            f"content_rowid='id', tokenize='porter unicode61')",
+            f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN {insert_new} END",
+            f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN {delete_old} END",
+            f"CREATE TRIGGER {fts}_au AFTER UPDATE OF {names} ON {table} BEGIN {delete_old} {insert_new} END",
+            f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+        ]
+    if vendor == 'postgresql':
+        # Concurrently so writes carry on while it builds (needs a non-atomic migration)
+        return [
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {fts_table(table)}_idx "
+            f"ON {table} USING GIN ({_document(columns)})"
+        ]
+    return []
+
+
+def drop_statements(vendor, table, columns):
+    fts = fts_table(table)
+    if vendor == 'sqlite':
+        return [f"DROP TRIGGER IF EXISTS {fts}_{suffix}" for suffix in ('ai', 'ad', 'au')] + [
+            f"DROP TABLE IF EXISTS {fts}"
+        ]
+    if vendor == 'postgresql':
+        return [f"DROP INDEX IF EXISTS {fts}_idx"]
+    return []
+
+
+class CreateFullTextIndex(Operation):
+    """
+    Migration operation adding the full-text index for the current backend
+    (nothing on other backends, where search() falls back to icontains)
+    """
+
+    reversible = True
+
+    def __init__(self, model_name, columns):
+        self.model_name = model_name
+        self.columns = list(columns)
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def _run(self, statements, app_label, schema_editor, state):
+        model = state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        for sql in statements(schema_editor.connection.vendor, model._meta.db_table, self.columns):
+            schema_editor.execute(sql)
+        _available.clear()
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        self._run(create_statements, app_label, schema_editor, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        self._run(drop_statements, app_label, schema_editor, from_state)
+
+    def describe(self):
+        return f"Create full-text index on {self.model_name} ({', '.join(self.columns)})"
+
+
+def is_available(model, using='default'):
+    """
+    Whether the model's table has a full-text index on this database
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    key = (using, table)
+    if key not in _available:
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                _available[key] = fts_table(table) in connection.introspection.table_names(cursor)
+        elif connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname = %s", [f"{fts_table(table)}_idx"])
+                _available[key] = cursor.fetchone() is not None
+        else:
+            _available[key] = False
+    return _available[key]
+
+
+def match_query(query, prefix=False, any_word=False):
+    """
+    FTS5 query for the words of a user query (quoted, so operators and
+    punctuation in the input are taken literally)
+    """
+    words = [f'"{word}"' + ('*' if prefix else '') for word in _WORD_RE.findall(query)]
+    return (' OR ' if any_word else ' ').join(words)
+
+
+def ts_query(query, prefix=False, any_word=False):
+    """
+    PostgreSQL to_tsquery() text for the words of a user query
+    """
+    words = [word + (':*' if prefix else '') for word in _WORD_RE.findall(query)]
+    return (' | ' if any_word else ' & ').join(words)
+
+
+def _pg_document(model, columns):
+    table = model._meta.db_table
+    return _document(columns).replace('coalesce("', f'coalesce("{table}"."')
+
+
+def search_condition(model, columns, query, using='default', prefix=False, any_word=False):
+    """
+    Condition matching rows whose columns contain every word of query (or
+    any word), or None if the query has no words
+    """
+    words = _WORD_RE.findall(query)
+    if not words:
+        return None
+    table = model._meta.db_table
+
+    if not is_available(model, using):
+        per_word = [Q(*[(f'{column}__icontains', word) for column in columns], _connector=Q.OR) for word in words]
+        return reduce(operator.or_ if any_word else operator.and_, per_word)
+
+    if connections[using].vendor == 'sqlite':
+        fts = fts_table(table)
+        return RawSQL(
+            f'"{table}"."{model._meta.pk.column}" IN (SELECT rowid FROM {fts} WHERE {fts} MATCH %s)',
+            [match_query(query, prefix, any_word)],
+            output_field=BooleanField(),
+        )
+    # A query of stop words only is empty and matches everything, as on SQLite
+    # (numnode() of a constant is folded away when planning)
+    tsquery = f"to_tsquery('{TS_CONFIG}', %s)"
+    text = ts_query(query, prefix, any_word)
+    return RawSQL(
+        f"(numnode({tsquery}) = 0 OR {_pg_document(model, columns)} @@ {tsquery})",
+        [text, text],
+        output_field=BooleanField(),
+    )
+
+
+def rank_expression(model, columns, query, using='default', prefix=False, any_word=False):
+    """
+    Relevance of a matching row to query, higher is better (BM25 on SQLite,
+    ts_rank on PostgreSQL, 0 without an index)
+    """
+    table = model._meta.db_table
+    if not is_available(model, using):
+        return Value(0.0, output_field=FloatField())
+    if connections[using].vendor == 'sqlite':
+        fts = fts_table(table)
+        # bm25() is negative, more so for better matches
+        return RawSQL(
+            f"-(SELECT bm25({fts}) FROM {fts} WHERE {fts} MATCH %s "
+            f'AND rowid = "{table}"."{model._meta.pk.column}")',
+            [match_query(query, prefix, any_word)],
+            output_field=FloatField(),
+        )
+    return RawSQL(
+        f"ts_rank({_pg_document(model, columns)}, to_tsquery('{TS_CONFIG}', %s))",
+        [ts_query(query, prefix, any_word)],
+        output_field=FloatField(),
+    )
+
+
+def search(queryset, columns, query, prefix=False, any_word=False, ranked=False):
+    """
+    Filter queryset to rows whose columns contain every word of query (or
+    any word); ranked orders them best match first, with the relevance in
+    a search_rank annotation
+    For the index to be used, columns must be those it was created with
+    """
+    condition = search_condition(queryset.model, columns, query, queryset.db, prefix, any_word)
+    if condition is None:
+        return queryset
+    queryset = queryset.filter(condition)
+    if ranked:
+        queryset = queryset.annotate(
+            search_rank=rank_expression(queryset.model, columns, query, queryset.db, prefix, any_word)
+        ).order_by('-search_rank')
+    return queryset
+
+
+class FullTextSearchMixin:
+    """
+    Admin search through the full-text index of search_fields (all words,
+    each as a prefix) instead of an icontains scan
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        return search(queryset, self.search_fields, search_term, prefix=True), False
\ No newline at end of file
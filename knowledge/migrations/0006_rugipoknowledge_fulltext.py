@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:40
+
+from django.db import migrations
+
+from knowledge.fulltext import CreateFullTextIndex
+
+
+class Migration(migrations.Migration):
+
+    # The PostgreSQL index is built CONCURRENTLY, which can't run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('knowledge', '0005_rugipoknowledge_knowledge_type_and_more'),
+    ]
+
+    operations = [
+        CreateFullTextIndex('rugipoknowledge', ['question', 'answer', 'keywords']),
+    ]
@@ -5,6 +5,7 @@ Uses APScheduler for scheduled tasks
 import logging
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
@@ -36,8 +37,21 @@ def start_scheduler():
             replace_existing=True
         )
         
+        # Fold new chat messages into the daily stats
+        stats_interval = getattr(settings, 'CHATBOT_STATS_INTERVAL_MINUTES', 15)
+        scheduler.add_job(
+            func=scheduled_chat_stats,
+            trigger=IntervalTrigger(minutes=stats_interval),
+            id='chat_stats',
+            name='Chat Stats Rollup',
+            replace_existing=True
+        )
+        
         scheduler.start()
-        logger.info("✓ Background scheduler started - Scraper scheduled for 2 AM daily")
+        logger.info(
+            f"✓ Background scheduler started - Scraper scheduled for 2 AM daily, "
+            f"chat stats every {stats_interval} minutes"
+        )
     except Exception as e:
         logger.error(f"Error starting scheduler: {str(e)}")
 
@@ -74,6 +88,22 @@ def scheduled_scrape():
         logger.error(f"✗ Scheduled scrape failed: {str(e)}")
 
 
+def scheduled_chat_stats():
+    """
+    Wrapper function for the scheduled chat stats rollup
+    """
+    try:
+        from chatbot.services.analytics import update_daily_stats
+        
+        result = update_daily_stats()
+        logger.info(
+            f"✓ Chat stats rollup completed: "
+            f"{result['messages']} messages, {result['sessions']} sessions"
+        )
+    except Exception as e:
+        logger.error(f"✗ Chat stats rollup failed: {str(e)}")
+
+
 def get_scheduler_status():
     """
     Get current scheduler status
@@ -6,6 +6,7 @@ import requests
 from bs4 import BeautifulSoup
 from django.utils.timezone import now
 from knowledge.models import RUGIPOKnowledge, ScraperURL
+from knowledge.search import find_duplicate
 from datetime import datetime
 import logging
 import re
@@ -187,10 +188,7 @@ class GenericScraper:
         for qa in qa_list:
             try:
                 # Avoid duplicates by checking question + category
-                existing = RUGIPOKnowledge.objects.filter(
-                    question__iexact=qa['question'],
-                    category=qa['category']
-                ).first()
+                existing = find_duplicate(qa['question'], qa['category'])
                 
                 if existing:
                     # Update existing
@@ -0,0 +1,31 @@
+"""
+Full-text search over the knowledge base table, shared by the admin, the
+scraper's duplicate check and chatbot retrieval
+The index (FTS5 on SQLite, GIN tsvector on PostgreSQL) is maintained by the
+database itself, so it follows every save, update and delete
+"""
+from knowledge import fulltext
+from knowledge.models import RUGIPOKnowledge
+
+# The columns the index was created with (migration 0006)
+SEARCH_FIELDS = ['question', 'answer', 'keywords']
+
+
+def search_knowledge(query, queryset=None, any_word=False, limit=None):
+    """
+    Active entries containing every word of query (any word with
+    any_word), best match first with the relevance as search_rank
+    """
+    if queryset is None:
+        queryset = RUGIPOKnowledge.objects.filter(is_active=True)
+    results = fulltext.search(queryset, SEARCH_FIELDS, query, any_word=any_word, ranked=True)
+    return results[:limit] if limit else results
+
+
+def find_duplicate(question, category):
+    """
+    Entry with the same question (ignoring case) in the category, or None
+    The index narrows the candidates before the exact comparison
+    """
+    candidates = fulltext.search(RUGIPOKnowledge.objects.filter(category=category), SEARCH_FIELDS, question)
+    return candidates.filter(question__iexact=question).first()
\ No newline at end of file
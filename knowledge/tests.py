@@ -1,3 +1,51 @@
-from django.test import TestCase
+from unittest import mock
+from django.test import TestCase, override_settings
+from knowledge.models import RUGIPOKnowledge
+from knowledge.search import find_duplicate, search_knowledge
 
-# Create your tests here.
+
+class KnowledgeSearchTest(TestCase):
+    """
+    The full-text index follows saves and deletes and ranks matches
+    """
+
+    def setUp(self):
+        self.fees = RUGIPOKnowledge.objects.create(
+            category='fees', question='How much are the school fees?',
+            answer='Fees are paid at the bursary.', keywords='fees, payment'
+        )
+        self.admission = RUGIPOKnowledge.objects.create(
+            category='admissions', question='What are the admission requirements?',
+            answer='Five credits including English. Fees are paid after admission.', keywords='admission'
+        )
+
+    def test_search_ranks_and_follows_changes(self):
+        self.assertEqual(list(search_knowledge('fees')), [self.fees, self.admission])
+        self.assertEqual(list(search_knowledge('admission requirements')), [self.admission])
+        self.assertEqual(list(search_knowledge('hostel admission', any_word=True)), [self.admission])
+
+        self.fees.question = 'Where is the hostel?'
+        self.fees.save()
+        self.assertEqual(list(search_knowledge('hostel')), [self.fees])
+
+        self.fees.delete()
+        self.assertEqual(list(search_knowledge('hostel')), [])
+
+    def test_find_duplicate(self):
+        self.assertEqual(find_duplicate('how much are the SCHOOL fees?', 'fees'), self.fees)
+        self.assertIsNone(find_duplicate('How much are the school fees?', 'admissions'))
+        self.assertIsNone(find_duplicate('How much are the fees?', 'fees'))
+
+    @override_settings(CHATBOT_RETRIEVAL_BACKEND='fulltext')
+    def test_retrieval(self):
+        from chatbot.services import retrieval
+        from chatbot.services.knowledge_cache import KnowledgeSnapshot
+
+        entries = [
+            {'id': qa.id, 'category': qa.category, 'category_display': qa.get_category_display(),
+             'question': qa.question, 'answer': qa.answer, 'keywords': qa.keywords}
+            for qa in (self.fees, self.admission)
+        ]
+        with mock.patch.object(retrieval, 'get_knowledge_snapshot', return_value=KnowledgeSnapshot('test', entries)):
+            ranked = retrieval.rank_knowledge('What are the admission requirements?')
+        self.assertEqual([qa['id'] for _, qa in ranked], [self.admission.id])
\ No newline at end of file
@@ -1,7 +1,42 @@
 import json
+import os
+import tempfile
 from pathlib import Path
 from django.conf import settings
 
+
+def write_json_if_changed(json_path, data):
+    """
+    Atomically write data to json_path, leaving the file untouched when the
+    serialized content is identical (so the chatbot's KB cache is not invalidated)
+    Returns True if the file was written
+    """
+    json_path = Path(json_path)
+    content = json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8')
+    
+    try:
+        with open(json_path, 'rb') as f:
+            if f.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+    
+    # Ensure data directory exists
+    json_path.parent.mkdir(parents=True, exist_ok=True)
+    
+    # Write to a temp file and swap it in so readers never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=json_path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, json_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return True
+
+
 def export_engineering_qa_to_json():
     """
     Export all active Engineering RUGIPO Knowledge to JSON file
@@ -30,13 +65,9 @@ def export_engineering_qa_to_json():
             'source_url': qa.source_url,
         })
     
-    # Ensure data directory exists
+    # Write to JSON file (skipped when nothing changed)
     json_path = settings.KNOWLEDGE_BASE_JSON_PATH
-    json_path.parent.mkdir(parents=True, exist_ok=True)
-    
-    # Write to JSON file
-    with open(json_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    write_json_if_changed(json_path, data)
     
     return json_path
 
@@ -69,12 +100,8 @@ def export_general_qa_to_json():
             'source_url': qa.source_url,
         })
     
-    # Save to general_qa.json instead
-    json_path = Path(settings.BASE_DIR) / 'data' / 'general_qa.json'
-    json_path.parent.mkdir(parents=True, exist_ok=True)
-    
-    # Write to JSON file
-    with open(json_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    # Save to general_qa.json instead (skipped when nothing changed)
+    json_path = settings.GENERAL_KNOWLEDGE_JSON_PATH
+    write_json_if_changed(json_path, data)
     
     return json_path
\ No newline at end of file
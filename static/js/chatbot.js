@@ -2,6 +2,10 @@
 let sessionId = localStorage.getItem('rugipo_chat_session') || '';
 let isOpen = false;
 
+// History paging: newest message shown (for since=) and the ETag of the last check
+let historyCursor = '';
+let historyEtag = '';
+
 // Initialize chatbot
 document.addEventListener('DOMContentLoaded', function () {
   const chatToggle = document.getElementById('chat-toggle');
@@ -18,6 +22,7 @@ document.addEventListener('DOMContentLoaded', function () {
       chatWindow.classList.remove('hidden');
       chatToggle.classList.add('hidden');
       chatInput.focus();
+      loadHistory();
     }
   });
 
@@ -41,15 +46,119 @@ document.addEventListener('DOMContentLoaded', function () {
 
 // Send message to backend
 function sendMessage(message) {
-  const chatMessages = document.getElementById('chat-messages');
-
   // Add user message to chat
   addMessage('user', message);
 
   // Show typing indicator
   showTypingIndicator();
 
-  // Send to backend
+  // Stream the answer when the browser supports it, otherwise wait for it
+  if (window.ReadableStream && window.TextDecoder) {
+    streamMessage(message).catch(() => {
+      hideTypingIndicator();
+      addMessage('bot', 'Sorry, something went wrong. Please try again.');
+    });
+  } else {
+    sendMessageWhole(message);
+  }
+}
+
+// Stream the bot response over Server-Sent Events
+// Only a request that never got a response is retried without streaming: once
+// the server has answered, the exchange may already be saved
+async function streamMessage(message) {
+  let response;
+  try {
+    response = await fetch('/chat/stream-message/', {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({
+        message: message,
+        session_id: sessionId,
+      }),
+    });
+  } catch (error) {
+    sendMessageWhole(message);
+    return;
+  }
+
+  if (!response.ok || !response.body) {
+    hideTypingIndicator();
+    addMessage('bot', 'Sorry, something went wrong. Please try again.');
+    return;
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let content = '';
+  let messageDiv = null;
+
+  while (true) {
+    let chunk;
+    try {
+      chunk = await reader.read();
+    } catch (error) {
+      // The message was already accepted, so don't resend it
+      break;
+    }
+    const { value, done } = chunk;
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // Events are separated by a blank line
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const block = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let event;
+      try {
+        event = parseEvent(block);
+      } catch (error) {
+        // Skip a malformed event; the rest of the answer still arrives
+        continue;
+      }
+
+      if (event.name === 'delta') {
+        if (!messageDiv) {
+          hideTypingIndicator();
+          messageDiv = addMessage('bot', '');
+        }
+        content += event.data.content;
+        updateBotMessage(messageDiv, content);
+      } else if (event.name === 'done') {
+        sessionId = event.data.session_id;
+        localStorage.setItem('rugipo_chat_session', sessionId);
+        historyCursor = event.data.cursor || historyCursor;
+      }
+    }
+  }
+
+  hideTypingIndicator();
+  if (!messageDiv) {
+    addMessage('bot', 'Sorry, something went wrong. Please try again.');
+  }
+}
+
+// Parse one Server-Sent Event block
+function parseEvent(block) {
+  const event = { name: 'message', data: null };
+  const dataLines = [];
+  block.split('\n').forEach((line) => {
+    if (line.startsWith('event:')) {
+      event.name = line.slice(6).trim();
+    } else if (line.startsWith('data:')) {
+      dataLines.push(line.slice(5).trim());
+    }
+  });
+  event.data = dataLines.length ? JSON.parse(dataLines.join('\n')) : null;
+  return event;
+}
+
+// Send message and wait for the full response
+function sendMessageWhole(message) {
   fetch('/chat/send-message/', {
     method: 'POST',
     headers: {
@@ -68,6 +177,7 @@ function sendMessage(message) {
         // Save session ID
         sessionId = data.session_id;
         localStorage.setItem('rugipo_chat_session', sessionId);
+        historyCursor = data.cursor || historyCursor;
 
         // Add bot response
         addMessage('bot', data.bot_response);
@@ -84,8 +194,69 @@ function sendMessage(message) {
     });
 }
 
-// Add message to chat window
-function addMessage(type, content) {
+// Show the conversation so far the first time, then only messages added
+// since (e.g. from another tab); the server answers 304 when nothing changed
+async function loadHistory() {
+  if (!sessionId) return;
+
+  const params = new URLSearchParams({ session_id: sessionId });
+  if (historyCursor) params.set('since', historyCursor);
+  const headers = historyEtag ? { 'If-None-Match': historyEtag } : {};
+
+  let data;
+  try {
+    const response = await fetch(`/chat/get-history/?${params}`, { headers });
+    if (response.status === 304 || !response.ok) return;
+    historyEtag = response.headers.get('ETag') || '';
+    data = await response.json();
+  } catch (error) {
+    return;
+  }
+
+  const firstLoad = !historyCursor;
+  data.messages.forEach((msg) => addMessage(msg.type, msg.content));
+  historyCursor = data.since_cursor || historyCursor;
+
+  if (firstLoad && data.has_more) {
+    addEarlierMessagesLink(data.before_cursor);
+  } else if (!firstLoad && data.has_more) {
+    loadHistory();
+  }
+}
+
+// Link above the history that loads the previous page
+function addEarlierMessagesLink(cursor) {
+  const chatMessages = document.getElementById('chat-messages');
+  const link = document.createElement('button');
+  link.type = 'button';
+  link.className = 'block mx-auto text-xs text-[#017C01] hover:underline';
+  link.textContent = 'Show earlier messages';
+  link.addEventListener('click', () => loadEarlierMessages(link, cursor));
+  // Below the welcome message
+  chatMessages.insertBefore(link, chatMessages.children[1] || null);
+}
+
+async function loadEarlierMessages(link, cursor) {
+  const params = new URLSearchParams({ session_id: sessionId, before: cursor });
+  let data;
+  try {
+    const response = await fetch(`/chat/get-history/?${params}`);
+    if (!response.ok) return;
+    data = await response.json();
+  } catch (error) {
+    return;
+  }
+
+  const anchor = link.nextSibling;
+  link.remove();
+  data.messages.forEach((msg) => addMessage(msg.type, msg.content, anchor));
+  if (data.has_more) {
+    addEarlierMessagesLink(data.before_cursor);
+  }
+}
+
+// Add message to chat window (before `beforeNode` if given)
+function addMessage(type, content, beforeNode) {
   const chatMessages = document.getElementById('chat-messages');
   const messageDiv = document.createElement('div');
   messageDiv.className = `message ${type}-message`;
@@ -104,7 +275,19 @@ function addMessage(type, content) {
         `;
   }
 
-  chatMessages.appendChild(messageDiv);
+  if (beforeNode) {
+    chatMessages.insertBefore(messageDiv, beforeNode);
+  } else {
+    chatMessages.appendChild(messageDiv);
+    chatMessages.scrollTop = chatMessages.scrollHeight;
+  }
+  return messageDiv;
+}
+
+// Replace the content of a bot message that is still streaming
+function updateBotMessage(messageDiv, content) {
+  const chatMessages = document.getElementById('chat-messages');
+  messageDiv.firstElementChild.innerHTML = formatBotMessage(content);
   chatMessages.scrollTop = chatMessages.scrollHeight;
 }
 